@@ -98,6 +98,10 @@ optional arguments:
     search through metadata field for existence of values.
         *comma separated for AND (value1 AND value2 AND *)
 
+ --filter {filter_name}__{operator}=value
+    filter with an operator: gt, gte, lt, lte, exact, ne, startswith, endswith, contains.
+        python playlist_manager.py --jbop custom --libraries Movies --action show --filter year__gte=2000
+
 
 
  Excluding;
@@ -123,8 +127,11 @@ import requests
 import argparse
 import operator
 import datetime
-from collections import Counter
 from plexapi.server import PlexServer, CONFIG
+from plexapi.exceptions import BadRequest, NotFound
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from jbops.cache import KeyValueCache, cache_path  # noqa: E402
 
 filename = os.path.basename(__file__)
 filename = filename.split('.')[0]
@@ -167,6 +174,23 @@ if not TAUTULLI_APIKEY:
 # Defaults
 DAYS = 30
 TOP = 5
+# Seconds before the cached users, libraries and filter fields are fetched again from Plex
+BOOTSTRAP_TTL = 24 * 60 * 60
+# PlexAPI style operators accepted after a field (year__gte) and the Plex filter operator they become
+FILTER_OPERATORS = {'': '',
+                    'contains': '',
+                    'icontains': '',
+                    'exact': '==',
+                    'iexact': '==',
+                    'ne': '!=',
+                    'startswith': '<=',
+                    'istartswith': '<=',
+                    'endswith': '>=',
+                    'iendswith': '>=',
+                    'gt': '>>',
+                    'gte': '>>=',
+                    'lt': '<<',
+                    'lte': '<<='}
 
 sess = requests.Session()
 # Ignore verifying the SSL certificate
@@ -179,17 +203,102 @@ if sess.verify is False:
     import urllib3
     urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
-plex = PlexServer(PLEX_URL, PLEX_TOKEN, session=sess)
-account = plex.myPlexAccount()
-user_lst = [x.title for x in plex.myPlexAccount().users() if x.servers]
-sections = plex.library.sections()
-sections_dict = {x.key: x.title for x in sections}
-filters_lst = list(set([y.key for x in sections if x.type != 'photo' for y in x.listFields()]))
-admin_playlist_lst = [x for x in plex.playlists()]
+# Connected on first use, see plex_server()
+plex = None
+# Local cache of the server's users, libraries and filter fields, see jbops/cache.py
+bootstrap_cache = KeyValueCache(cache_path('playlist_manager.db'), ttl=BOOTSTRAP_TTL)
 today = datetime.datetime.now().date()
 weeknum = datetime.date(today.year, today.month, today.day).isocalendar()[1]
-json_check = sorted([f for f in os.listdir('.') if os.path.isfile(f) and f.endswith(".json")],
-                    key=os.path.getmtime)
+
+
+def plex_server():
+    """Connect to the Plex server on first use."""
+    global plex
+    if plex is None:
+        plex = PlexServer(PLEX_URL, PLEX_TOKEN, session=sess)
+
+    return plex
+
+
+def cached(name, fetch=None, refresh=False):
+    """Get server information from the local cache.
+
+    Parameters
+    ----------
+    name: str
+        Cached value name (users, sections, filters)
+    fetch: func
+        Called on a cache miss, the result is cached for BOOTSTRAP_TTL seconds.
+        Without fetch a miss returns None.
+    refresh: bool
+        Ignore the cached value and fetch it again.
+
+    Returns
+    -------
+    list
+    """
+    key = '{}:{}'.format(PLEX_URL, name)
+    if fetch is None:
+        return None if refresh else bootstrap_cache.get(key)
+
+    return bootstrap_cache.get_value(key, fetch, refresh)
+
+
+def fetch_users():
+    return [x.title for x in plex_server().myPlexAccount().users() if x.servers]
+
+
+def fetch_sections():
+    # [key, title] pairs, json would turn integer dict keys into strings
+    return [[x.key, x.title] for x in plex_server().library.sections()]
+
+
+def fetch_filters():
+    return sorted(set(y.key for x in plex_server().library.sections() if x.type != 'photo'
+                      for y in x.listFields()))
+
+
+def json_files():
+    """Exported playlist json files in the current folder, oldest first."""
+    return sorted([f for f in os.listdir('.') if os.path.isfile(f) and f.endswith(".json")],
+                  key=os.path.getmtime)
+
+
+def check_choices(parser, option, selected, name, fetch, names=None):
+    """Check argument values against the cached choices, refetching once before failing.
+
+    Parameters
+    ----------
+    names: func
+        Turns the cached value into the list of allowed names.
+
+    Returns
+    -------
+    list
+        The cached value
+    """
+    names = names or list
+    cached_value = cached(name, fetch)
+    choices = names(cached_value)
+    if not set(selected) <= set(choices):
+        cached_value = cached(name, fetch, refresh=True)
+        choices = names(cached_value)
+    for value in selected:
+        if value not in choices:
+            parser.error("argument {}: invalid choice: '{}' (choose from {})".format(
+                option, value, ', '.join("'{}'".format(c) for c in choices)))
+
+    return cached_value
+
+
+def section_titles(sections):
+    return [title for key, title in sections]
+
+
+def choices_help(name, names=None):
+    """Cached choices for --help, listing them live would need the Plex server."""
+    choices = cached(name)
+    return ', '.join((names or list)(choices)) if choices else 'see the Plex server'
 
 
 def actions():
@@ -326,9 +435,70 @@ def sort_by_dates(video, date_type):
         # exit()
 
 
+def search_keys(library, key, value, libtype=None, listings=None):
+    """Rating keys of the library items matching one filter or search value
+
+    The value is filtered by the Plex server in one search. Fields the server
+    can't filter on are matched against one listing of the library instead.
+
+    Parameters
+    ----------
+    library: class
+    key: str
+        Field name with an optional FILTER_OPERATORS operator (year__gte).
+        Without one text fields match by substring.
+    value: str or list
+        A list matches any of its values
+    libtype: str
+        Item type to return, e.g. episode from a show library
+    listings: dict
+        Library listings by libtype, shared between calls
+
+    Returns
+    -------
+    set
+    """
+    field, _, filter_operator = key.partition('__')
+    plex_operator = FILTER_OPERATORS[filter_operator]
+    try:
+        return set(item.ratingKey for item in
+                   library.search(libtype=libtype, filters={field + plex_operator: value}))
+    except (BadRequest, NotFound):
+        logger.debug("Plex can't filter on {}, searching the library listing".format(field))
+
+    if plex_operator not in ('', '=='):
+        logger.error("Plex can't filter on {} and the library listing is only matched on text, "
+                     "skipping {}={}".format(field, key, value))
+        return set()
+
+    listings = {} if listings is None else listings
+    if libtype not in listings:
+        listing = library.search(libtype=libtype)
+        for item in listing:
+            # Matched on the listed attributes, don't reload the items where one is empty
+            item._autoReload = False
+        listings[libtype] = listing
+    values = [v.lower() for v in (value if isinstance(value, list) else [value])]
+    found = set()
+    for item in listings[libtype]:
+        attr = getattr(item, field, None) or ''
+        texts = [str(getattr(tag, 'tag', tag)).lower() for tag in attr] if isinstance(attr, list) else [
+            str(attr).lower()]
+        if plex_operator == '==':
+            matched = any(v == text for v in values for text in texts)
+        else:
+            matched = any(v in text for v in values for text in texts)
+        if matched:
+            found.add(item.ratingKey)
+
+    return found
+
+
 def multi_filter_search(keyword_dict, library, search_eps=None):
     """Allowing for multiple filter or search values
 
+    Each value is one server side search, the results are intersected.
+
     Parameters
     ----------
     keyword_dict: dict
@@ -340,44 +510,17 @@ def multi_filter_search(keyword_dict, library, search_eps=None):
     list
         items that include all searched or filtered values
     """
-    multi_lst = []
-    ep_lst = []
-    logs = {}
-    ep_logs = []
-    # How many keywords
-    keyword_count = len(keyword_dict)
+    libtype = 'episode' if search_eps else None
+    listings = {}
+    search_set = None
     for key, values in keyword_dict.items():
-        if isinstance(values, list):
-            keyword_count += 1
-            for value in values:
-                search_dict = {}
-                search_dict[key] = value
-                if search_eps:
-                    logs["data"] = [{key: value}]
-                    for show in library.all():
-                        for episode in show.episodes(**search_dict):
-                            ep_lst += [episode.ratingKey]
-                            ep_logs += [episode.title, episode.summary]
-
-                        logs["data"].append({"keys": ep_lst, "info": ep_logs})
-                    search_lst = ep_lst
-                else:
-                    search_lst = [item.ratingKey for item in library.all(**search_dict)]
-                multi_lst += search_lst
-        else:
-            if search_eps:
-                for show in library.all():
-                    for episode in show.episodes(**{key: values}):
-                        ep_lst += [episode.ratingKey]
-                multi_lst += ep_lst
+        for value in values if isinstance(values, list) else [values]:
+            found = search_keys(library, key, value, libtype, listings)
+            search_set = found if search_set is None else search_set & found
+            if not search_set:
+                return []
 
-            else:
-                multi_lst += [item.ratingKey for item in library.all(**{key: values})]
-    counts = Counter(multi_lst)
-    # Use amount of keywords to check that all keywords were found in results
-    search_lst = [id for id in multi_lst if counts[id] >= keyword_count]
-
-    return list(set(search_lst))
+    return list(search_set or [])
 
 
 def get_content(libraries, jbop, filters=None, search=None, limit=None):
@@ -398,10 +541,9 @@ def get_content(libraries, jbop, filters=None, search=None, limit=None):
 
     """
     child_lst = []
-    filter_lst = []
-    search_lst = []
+    search_set = set()
+    filter_set = set()
     keywords = {}
-    tags = "__tag__icontains"
 
     if search or filters:
         if search:
@@ -411,49 +553,27 @@ def get_content(libraries, jbop, filters=None, search=None, limit=None):
         for library in libraries.keys():
             plex_library = plex.library.sectionByID(library)
             library_type = plex_library.type
-            # Find media type, if show then search/filter episodes
-            if library_type == 'movie':
-                # Decisions to stack filter and search
-                if keywords:
-                    child_lst += multi_filter_search(keywords, plex_library)
-                if filters:
-                    for key, value in filters.items():
-                        # Only genre filtering should allow multiple values and allow for AND statement
-                        if key == "genre":
-                            child_lst += multi_filter_search({key + tags: value}, plex_library)
-                        else:
-                            filter_lst = [movie.ratingKey for movie in plex_library.search(**{key: value})]
-                            child_lst += filter_lst
-                if keywords and filters:
-                    child_lst += list(set(filter_lst) & set(search_lst))
-
-            elif library_type == 'show':
-                # Decisions to stack filter and search
-                if keywords:
-                    search_lst = multi_filter_search(keywords, plex_library, search_eps=True)
-                    child_lst += search_lst
-                if filters:
-                    for key, value in filters.items():
-                        # Only genre filtering should allow multiple values and allow for AND statement
-                        if key == "genre":
-                            shows_lst = multi_filter_search({key: value}, plex_library)
-                        else:
-                            shows_lst = [show.ratingKey for show in plex_library.search(**{key: value})]
-                        for showkey in shows_lst:
-                            show = plex.fetchItem(showkey)
-                            for episode in show.episodes():
-                                filter_lst += [episode.ratingKey]
-                        child_lst += filter_lst
-
-                if keywords and filters:
-                    child_lst += list(set(filter_lst) & set(search_lst))
-            else:
-                pass
+            # Find media type, if show then search/filter episodes by the show's fields
+            if library_type not in ['movie', 'show']:
+                continue
+            search_eps = library_type == 'show'
+            prefix = 'show.' if search_eps else ''
+            # Decisions to stack filter and search
+            if keywords:
+                search_set.update(multi_filter_search(keywords, plex_library, search_eps))
+            if filters:
+                for key, value in filters.items():
+                    # Only genre filtering should allow multiple values and allow for AND statement
+                    if key == "genre":
+                        filter_set.update(multi_filter_search({prefix + key: value}, plex_library, search_eps))
+                    else:
+                        filter_set.update(search_keys(plex_library, prefix + key, value,
+                                                      'episode' if search_eps else None))
         # Keep only results found from both search and filters
         if keywords and filters:
-            child_lst = list(set(i for i in child_lst if child_lst.count(i) > 1))
-
-        play_lst = child_lst
+            play_lst = list(search_set & filter_set)
+        else:
+            play_lst = list(search_set | filter_set)
 
     else:
         for library_id in libraries.keys():
@@ -468,14 +588,14 @@ def get_content(libraries, jbop, filters=None, search=None, limit=None):
                     else:
                         child_lst += [child.ratingKey]
             elif library_type == 'show':
-                for child in plex_library.all():
-                    for episode in child.episodes():
-                        if jbop.startswith("history"):
-                            if sort_by_dates(episode, jbop):
-                                item_date = sort_by_dates(episode, jbop)
-                                child_lst += item_date
-                        else:
-                            child_lst += [episode.ratingKey]
+                # One listing of every episode instead of a request per show
+                for episode in plex_library.search(libtype='episode'):
+                    if jbop.startswith("history"):
+                        if sort_by_dates(episode, jbop):
+                            item_date = sort_by_dates(episode, jbop)
+                            child_lst += item_date
+                    else:
+                        child_lst += [episode.ratingKey]
             else:
                  pass
         # check if sort_by_dates was used
@@ -775,14 +895,14 @@ if __name__ == "__main__":
     parser.add_argument('--action', required=True, choices=actions(),
                         help='Action selector.'
                              '{}'.format(actions.__doc__))
-    parser.add_argument('--users', nargs='+', choices=user_lst, metavar='',
+    parser.add_argument('--users', nargs='+', metavar='',
                         help='The Plex usernames to create/share to or delete from. Allowed names are:\n'
-                             'Choices: %(choices)s')
+                             'Choices: {}'.format(choices_help('users')))
     parser.add_argument('--allUsers', default=False, action='store_true',
                         help='Select all users.')
-    parser.add_argument('--libraries', nargs='+', choices=sections_dict.values(), metavar='',
+    parser.add_argument('--libraries', nargs='+', metavar='',
                         help='Space separated list of case sensitive names to process. Allowed names are:\n'
-                             'Choices: %(choices)s')
+                             'Choices: {}'.format(choices_help('sections', section_titles)))
     parser.add_argument('--allLibraries', default=False, action='store_true',
                         help='Select all libraries.')
     parser.add_argument('--self', default=False, action='store_true',
@@ -803,19 +923,44 @@ if __name__ == "__main__":
     parser.add_argument('--limit', type=int, default=False,
                         help='Limit the amount items to be added to a playlist.')
     parser.add_argument('--filter', action='append', type=lambda kv: kv.split("="),
-                        help='Search filtered metadata fields.\n'
-                             'Filters: ({}).'.format(', '.join(filters_lst)))
+                        help='Search filtered metadata fields, field__operator=value to use an operator.\n'
+                             'Filters: ({}).\nOperators: ({}).'.format(
+                                 choices_help('filters'), ', '.join(sorted(op for op in FILTER_OPERATORS if op))))
     parser.add_argument('--search', action='append', type=lambda kv: kv.split("="),
                         help='Search non-filtered metadata fields for keywords '
                              'in title, summary, etc.')
     parser.add_argument('--export', choices=['csv', 'json'], default='json',
                         help='Space separated list of case sensitive names to process. Allowed names are:\n'
                              'Choices: %(choices)s\nDefault: %(default)s)')
-    parser.add_argument('--importJson', nargs='?', type=str, choices=json_check, metavar='',
-                        help='Filename of json file to use. \n(choices: %(choices)s)')
+    parser.add_argument('--importJson', nargs='?', type=str, metavar='',
+                        help='Filename of json file to use. \n(json files in the current folder)')
 
     opts = parser.parse_args()
 
+    # Only fetch the server information the selected options need
+    user_lst = []
+    if opts.users:
+        user_lst = check_choices(parser, '--users', opts.users, 'users', fetch_users)
+    elif opts.allUsers:
+        user_lst = cached('users', fetch_users)
+
+    sections_dict = {}
+    if opts.libraries:
+        sections_dict = dict(check_choices(parser, '--libraries', opts.libraries, 'sections', fetch_sections,
+                                           section_titles))
+    elif opts.allLibraries:
+        sections_dict = dict(cached('sections', fetch_sections))
+
+    if opts.importJson is not None and opts.importJson not in json_files():
+        parser.error("argument --importJson: invalid choice: '{}' (choose from {})".format(
+            opts.importJson, ', '.join("'{}'".format(f) for f in json_files())))
+
+    plex = plex_server()
+    account = plex.myPlexAccount() if user_lst else None
+    admin_playlist_lst = []
+    if opts.playlists or opts.allPlaylists or opts.action in ['show', 'share', 'export']:
+        admin_playlist_lst = [x for x in plex.playlists()]
+
     title = ''
     search = ''
     filters = ''
@@ -830,6 +975,7 @@ if __name__ == "__main__":
             if "," in v:
                 search[k] = v.split(",")
     if opts.filter:
+        filters_lst = cached('filters', fetch_filters)
         if len(opts.filter) >= 2:
             # Check if filter key was used twice or more
             filter_key = opts.filter[0][0]
@@ -843,8 +989,16 @@ if __name__ == "__main__":
             # If comma separated filter then consider filtering values with AND statement
             if "," in v:
                 filters[k] = v.split(",")
+            filter_operator = k.partition('__')[2]
+            if filter_operator not in FILTER_OPERATORS:
+                logger.error("Filter operator '{}' in {} is not supported, use one of: [{}]"
+                             .format(filter_operator, k, ', '.join(sorted(op for op in FILTER_OPERATORS if op))))
+                exit()
+        filter_fields = set(k.partition('__')[0] for k in filters)
         # Check if provided filter exist, exit if it doesn't exist
-        if not (set(filters.keys()) & set(filters_lst)):
+        if filters_lst and not (filter_fields & set(filters_lst)):
+            filters_lst = cached('filters', fetch_filters, refresh=True)
+        if not (filter_fields & set(filters_lst)):
             logger.error('({}) was not found in filters list: [{}]'
                   .format(' '.join(filters.keys()), ', '.join(filters_lst)))
             exit()
@@ -0,0 +1,8 @@
+# -*- coding: utf-8 -*-
+
+"""
+Description: Shared helpers for JBOPS scripts.
+
+Scripts that use these helpers add the repository root to sys.path so the
+jbops folder must be kept next to the script folders (killstream, utility, ...).
+"""
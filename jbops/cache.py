@@ -0,0 +1,283 @@
+# -*- coding: utf-8 -*-
+
+"""
+Description: Persistent SQLite caches of Tautulli get_metadata and get_geoip_lookup results, and of
+ other server data by name, shared by JBOPS scripts.
+Requires: sqlite3 (standard library)
+
+ Entries are keyed by rating_key and are refetched when:
+    - older than the cache's ttl, or
+    - the caller knows a newer updated_at than the cached copy.
+ GeoIP lookups are keyed by IP address and refetched after GEOIP_TTL.
+ The least recently used entries are removed once max_entries is reached.
+ KeyValueCache keeps any JSON value by key (user lists, title indexes, ...)
+ and fetches it again after its ttl.
+
+ Usage:
+    from jbops.cache import MetadataCache, GeoIPCache, KeyValueCache
+
+    metadata_cache = MetadataCache()
+    metadata = metadata_cache.get_metadata(rating_key, tautulli_server.get_metadata)
+
+    geoip_cache = GeoIPCache()
+    geo = geoip_cache.get_geoip_lookup(ip_address, tautulli_server.get_geoip_lookup)
+
+    server_cache = KeyValueCache(cache_path('my_script.db'), ttl=60 * 60)
+    users = server_cache.get_value('users', fetch_users)
+"""
+from __future__ import print_function
+from __future__ import unicode_literals
+
+from builtins import object
+from builtins import str
+import os
+import json
+import atexit
+import time
+import sqlite3
+import threading
+
+# Folder holding the jbops cache files. Override with the JBOPS_CACHE_DIR environment variable.
+CACHE_DIR = os.getenv('JBOPS_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'jbops'))
+# Seconds before a cached item is fetched again
+METADATA_TTL = 24 * 60 * 60
+# Maximum number of cached items
+MAX_ENTRIES = 100000
+# Seconds before a cached GeoIP lookup is fetched again
+GEOIP_TTL = 30 * 24 * 60 * 60
+
+
+def cache_path(filename):
+    """Path of a file in the cache folder, creating the folder if needed."""
+    if not os.path.isdir(CACHE_DIR):
+        os.makedirs(CACHE_DIR)
+
+    return os.path.join(CACHE_DIR, filename)
+
+
+class MetadataCache(object):
+    def __init__(self, path=None, ttl=METADATA_TTL, max_entries=MAX_ENTRIES):
+        self.path = path or cache_path('metadata.db')
+        self.ttl = ttl
+        self.max_entries = max_entries
+        # Scripts fetch metadata from a thread pool, share one connection behind a lock.
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.conn.execute('CREATE TABLE IF NOT EXISTS metadata ('
+                          'rating_key TEXT PRIMARY KEY, updated_at INTEGER, '
+                          'fetched_at REAL, accessed_at REAL, data TEXT)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS metadata_accessed ON metadata (accessed_at)')
+        self.conn.commit()
+        self._writes = 0
+        atexit.register(self.close)
+
+    def get(self, rating_key, updated_at=None):
+        """Get cached metadata.
+
+        Parameters
+        ----------
+        rating_key : int or str
+            The item's rating key.
+        updated_at : int
+            The item's known updated_at, a cached copy older than this is stale.
+
+        Returns
+        -------
+        dict or None
+            The cached metadata or None if missing or stale.
+        """
+        rating_key = str(rating_key)
+        now = time.time()
+        with self.lock:
+            row = self.conn.execute('SELECT updated_at, fetched_at, data FROM metadata WHERE rating_key = ?',
+                                    (rating_key,)).fetchone()
+            if not row:
+                return None
+            cached_updated_at, fetched_at, data = row
+            if self.ttl and now - fetched_at > self.ttl:
+                return None
+            if updated_at and int(updated_at) > (cached_updated_at or 0):
+                return None
+            self.conn.execute('UPDATE metadata SET accessed_at = ? WHERE rating_key = ?', (now, rating_key))
+            self._commit()
+
+        return json.loads(data)
+
+    def set(self, rating_key, metadata):
+        """Store metadata for a rating key."""
+        now = time.time()
+        updated_at = metadata.get('updated_at') or 0
+        with self.lock:
+            self.conn.execute('INSERT OR REPLACE INTO metadata VALUES (?, ?, ?, ?, ?)',
+                              (str(rating_key), int(updated_at), now, now, json.dumps(metadata)))
+            self._commit()
+
+    def delete(self, rating_key):
+        """Remove a rating key from the cache."""
+        with self.lock:
+            self.conn.execute('DELETE FROM metadata WHERE rating_key = ?', (str(rating_key),))
+            self._commit()
+
+    def get_metadata(self, rating_key, fetch, updated_at=None):
+        """Get metadata from the cache or fetch and store it.
+
+        Parameters
+        ----------
+        rating_key : int or str
+            The item's rating key.
+        fetch : function
+            Called with rating_key on a cache miss, e.g. tautulli_server.get_metadata.
+        updated_at : int
+            The item's known updated_at, a cached copy older than this is refetched.
+
+        Returns
+        -------
+        dict or None
+            The item's metadata. Blank metadata (item no longer exists) is not cached.
+        """
+        metadata = self.get(rating_key, updated_at)
+        if metadata is None:
+            metadata = fetch(rating_key)
+            if metadata:
+                self.set(rating_key, metadata)
+
+        return metadata
+
+    def evict(self):
+        """Remove the least recently used items above max_entries."""
+        with self.lock:
+            self._evict()
+            self.conn.commit()
+
+    def close(self):
+        """Evict, commit and close the cache."""
+        with self.lock:
+            if self.conn is None:
+                return
+            self._evict()
+            self.conn.commit()
+            self.conn.close()
+            self.conn = None
+
+    def _evict(self):
+        if not self.max_entries:
+            return
+        self.conn.execute('DELETE FROM metadata WHERE rating_key IN ('
+                          'SELECT rating_key FROM metadata ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)',
+                          (self.max_entries,))
+
+    def _commit(self):
+        # Commit in batches, every row committed on its own is slow on large runs.
+        self._writes += 1
+        if self._writes >= 100:
+            self._evict()
+            self.conn.commit()
+            self._writes = 0
+
+
+class GeoIPCache(MetadataCache):
+    """Persistent cache of Tautulli get_geoip_lookup results keyed by IP address."""
+    def __init__(self, path=None, ttl=GEOIP_TTL, max_entries=MAX_ENTRIES):
+        super(GeoIPCache, self).__init__(path or cache_path('geoip.db'), ttl, max_entries)
+
+    def get_geoip_lookup(self, ip_address, fetch):
+        """Get a GeoIP lookup from the cache or fetch and store it.
+
+        Parameters
+        ----------
+        ip_address : str
+            The IP address to look up.
+        fetch : function
+            Called with ip_address on a cache miss, e.g. tautulli_server.get_geoip_lookup.
+
+        Returns
+        -------
+        dict or None
+            The geolocation data. Failed lookups are not cached.
+        """
+        data = self.get(ip_address)
+        if data is None:
+            data = fetch(ip_address)
+            if data and not data.get('error'):
+                self.set(ip_address, data)
+
+        return data
+
+
+class KeyValueCache(object):
+    """Persistent cache of JSON values by key, for server data that isn't item metadata."""
+    def __init__(self, path, ttl=METADATA_TTL):
+        self.path = path
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.conn.execute('CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, stored_at REAL, value TEXT)')
+        self.conn.commit()
+        atexit.register(self.close)
+
+    def get(self, key):
+        """Get a cached value.
+
+        Parameters
+        ----------
+        key : str
+
+        Returns
+        -------
+        obj or None
+            The cached value or None if missing or older than the ttl.
+        """
+        with self.lock:
+            row = self.conn.execute('SELECT stored_at, value FROM entries WHERE key = ?', (key,)).fetchone()
+        if not row:
+            return None
+        stored_at, value = row
+        if self.ttl and time.time() - stored_at > self.ttl:
+            return None
+
+        return json.loads(value)
+
+    def set(self, key, value):
+        """Store a JSON serializable value for a key."""
+        with self.lock:
+            self.conn.execute('INSERT OR REPLACE INTO entries VALUES (?, ?, ?)',
+                              (key, time.time(), json.dumps(value)))
+            self.conn.commit()
+
+    def delete(self, key):
+        """Remove a key from the cache."""
+        with self.lock:
+            self.conn.execute('DELETE FROM entries WHERE key = ?', (key,))
+            self.conn.commit()
+
+    def get_value(self, key, fetch, refresh=False):
+        """Get a value from the cache or fetch and store it.
+
+        Parameters
+        ----------
+        key : str
+        fetch : function
+            Called without arguments on a cache miss.
+        refresh : bool
+            Ignore the cached value and fetch it again.
+
+        Returns
+        -------
+        obj
+            The value. None is not cached.
+        """
+        value = None if refresh else self.get(key)
+        if value is None:
+            value = fetch()
+            if value is not None:
+                self.set(key, value)
+
+        return value
+
+    def close(self):
+        """Close the cache."""
+        with self.lock:
+            if self.conn is None:
+                return
+            self.conn.close()
+            self.conn = None
@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+
+"""
+Description: Append-only SQLite time series of library sizes shared by JBOPS scripts.
+Requires: sqlite3 (standard library)
+
+ Reporting scripts append one sample per library on each run (item counts and
+ total file size). Growth over any range is then read from the stored samples
+ instead of listing the libraries again. Samples are never updated or removed.
+
+ Usage:
+    from jbops.growth import GrowthSeries
+
+    growth = GrowthSeries()
+    growth.record('tautulli', section_id, section_name, count=1200, total_file_size=total_size)
+    for library in growth.delta('tautulli', start=time.time() - 7 * 24 * 60 * 60):
+        print(library['section_name'], library['count'])
+"""
+from __future__ import print_function
+from __future__ import unicode_literals
+
+from builtins import object
+from builtins import str
+import time
+import sqlite3
+
+from jbops.cache import cache_path
+
+# Sample values compared by delta()
+VALUE_COLUMNS = ('count', 'parent_count', 'child_count', 'total_file_size')
+
+
+class GrowthSeries(object):
+    def __init__(self, path=None):
+        self.path = path or cache_path('growth.db')
+        self.conn = sqlite3.connect(self.path)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute('CREATE TABLE IF NOT EXISTS samples (taken INTEGER, source TEXT, section_id TEXT, '
+                          'section_name TEXT, section_type TEXT, count INTEGER, parent_count INTEGER, '
+                          'child_count INTEGER, total_file_size INTEGER)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS samples_section ON samples (source, section_id, taken)')
+        self.conn.commit()
+
+    def record(self, source, section_id, section_name, section_type=None, count=None, parent_count=None,
+               child_count=None, total_file_size=None, taken=None):
+        """Append a sample of a library's size.
+
+        Parameters
+        ----------
+        source : str
+            Where the values come from, e.g. 'tautulli' or 'plex'. Only samples
+            of the same source are compared.
+        section_id : int or str
+            Library section ID.
+        section_name : str
+            Library name at the time of the sample.
+        section_type : str
+            'movie', 'show', 'artist' or 'photo'.
+        count, parent_count, child_count : int
+            Item counts, e.g. shows, seasons and episodes.
+        total_file_size : int
+            Bytes used by the library.
+        taken : int
+            Epoch time of the sample, defaults to now.
+        """
+        self.conn.execute('INSERT INTO samples VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                          (int(taken or time.time()), source, str(section_id), section_name, section_type,
+                           count, parent_count, child_count, total_file_size))
+        self.conn.commit()
+
+    def samples(self, source, section_id=None, after=None, before=None):
+        """Get samples oldest first.
+
+        Parameters
+        ----------
+        source : str
+        section_id : int or str
+            Only samples of this library.
+        after : int
+            Only samples taken at or after this epoch time.
+        before : int
+            Only samples taken at or before this epoch time.
+
+        Returns
+        -------
+        list
+            Samples as dicts.
+        """
+        where = ['source = ?']
+        params = [source]
+        if section_id is not None:
+            where.append('section_id = ?')
+            params.append(str(section_id))
+        if after is not None:
+            where.append('taken >= ?')
+            params.append(int(after))
+        if before is not None:
+            where.append('taken <= ?')
+            params.append(int(before))
+
+        return [dict(row) for row in self.conn.execute(
+            'SELECT * FROM samples WHERE {} ORDER BY taken, rowid'.format(' AND '.join(where)), params)]
+
+    def latest(self, source, before=None):
+        """Newest sample of each library taken at or before the epoch time before (default now).
+
+        Returns
+        -------
+        dict
+            {section_id: sample dict}
+        """
+        latest = {}
+        for sample in self.samples(source, before=before if before is not None else time.time()):
+            latest[sample['section_id']] = sample
+
+        return latest
+
+    def delta(self, source, start, end=None):
+        """Change of each library between two times.
+
+        Each library's newest sample at or before start is compared with its
+        newest sample at or before end (default now). Libraries without a
+        sample at both times are left out.
+
+        Parameters
+        ----------
+        source : str
+        start : int
+            Epoch time.
+        end : int
+            Epoch time.
+
+        Returns
+        -------
+        list
+            Dicts with section_id, section_name and section_type of the end
+            sample, 'start' and 'end' samples, and the difference of each of
+            count, parent_count, child_count and total_file_size (None when
+            a sample lacks the value).
+        """
+        first = self.latest(source, before=start)
+        last = self.latest(source, before=end)
+
+        deltas = []
+        for section_id, end_sample in last.items():
+            start_sample = first.get(section_id)
+            if start_sample is None:
+                continue
+            delta = {'section_id': section_id,
+                     'section_name': end_sample['section_name'],
+                     'section_type': end_sample['section_type'],
+                     'start': start_sample,
+                     'end': end_sample}
+            for column in VALUE_COLUMNS:
+                if start_sample[column] is None or end_sample[column] is None:
+                    delta[column] = None
+                else:
+                    delta[column] = end_sample[column] - start_sample[column]
+            deltas.append(delta)
+
+        return deltas
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,277 @@
+# -*- coding: utf-8 -*-
+
+"""
+Description: Local SQLite mirror of Tautulli's play history shared by JBOPS scripts.
+Requires: requests, sqlite3 (standard library)
+
+ The first sync downloads the whole history, or only back to `after` when
+ given. Later syncs request the pages newer than the last synced play (minus
+ SYNC_OVERLAP to catch plays that were still running), and the older plays
+ down to a smaller `after` than before. Rows are committed before each page
+ request, so the database is not locked while waiting on Tautulli. A failed
+ page raises SyncError and the sync position is not saved, the next sync
+ requests the same pages again. Rows are stored ungrouped,
+ query(grouping=True) merges them back like Tautulli's grouped history.
+
+ Usage:
+    from jbops.history import HistoryStore
+
+    history = HistoryStore()
+    history.sync(tautulli_server, after=time.time() - 7 * 24 * 60 * 60)
+    plays = history.query(user='Bob', watched=True, after=time.time() - 7 * 24 * 60 * 60)
+"""
+from __future__ import print_function
+from __future__ import unicode_literals
+
+from builtins import object
+import time
+import sqlite3
+
+from jbops.cache import cache_path
+from jbops.tautulli import paginate
+
+# Seconds before the last synced play to request again on the next sync.
+# Plays are written to history when they stop, so a play started before the
+# last sync can still show up later.
+SYNC_OVERLAP = 24 * 60 * 60
+# Rows requested per history page during sync
+SYNC_PAGE_LENGTH = 1000
+# Seconds to wait for another script syncing the same history file to commit
+LOCK_TIMEOUT = 60
+
+# Columns kept from Tautulli's get_history rows
+COLUMNS = ('id', 'reference_id', 'date', 'started', 'stopped', 'duration', 'paused_counter',
+           'user_id', 'user', 'friendly_name', 'section_id', 'media_type', 'rating_key',
+           'parent_rating_key', 'grandparent_rating_key', 'full_title', 'title', 'parent_title',
+           'grandparent_title', 'year', 'media_index', 'parent_media_index', 'platform', 'player',
+           'ip_address', 'transcode_decision', 'percent_complete', 'watched_status', 'guid')
+INTEGER_COLUMNS = ('id', 'reference_id', 'date', 'started', 'stopped', 'duration', 'paused_counter',
+                   'user_id', 'section_id', 'rating_key', 'parent_rating_key', 'grandparent_rating_key',
+                   'percent_complete', 'watched_status')
+
+# Column expressions used to merge grouped plays, the other columns are read from the newest play
+GROUPED_COLUMNS = {'id': 'MAX(id)',
+                   'date': 'MIN(date)',
+                   'started': 'MIN(started)',
+                   'stopped': 'MAX(stopped)',
+                   'duration': 'SUM(duration)',
+                   'paused_counter': 'SUM(paused_counter)',
+                   'percent_complete': 'MAX(percent_complete)',
+                   'watched_status': 'MAX(watched_status)'}
+
+
+def _column_type(column):
+    return 'INTEGER' if column in INTEGER_COLUMNS else 'TEXT'
+
+
+class SyncError(Exception):
+    """A history page could not be fetched from Tautulli, the sync position was not saved."""
+
+
+class HistoryStore(object):
+    def __init__(self, path=None, timeout=LOCK_TIMEOUT):
+        self.path = path or cache_path('history.db')
+        self.conn = sqlite3.connect(self.path, timeout=timeout)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute('CREATE TABLE IF NOT EXISTS history ({})'.format(
+            ', '.join('{} {}{}'.format(c, _column_type(c), ' PRIMARY KEY' if c == 'id' else '')
+                      for c in COLUMNS)))
+        # Columns added since the file was created, plays synced before keep them empty
+        existing = [row['name'] for row in self.conn.execute('PRAGMA table_info(history)')]
+        for column in COLUMNS:
+            if column not in existing:
+                self.conn.execute('ALTER TABLE history ADD COLUMN {} {}'.format(column, _column_type(column)))
+        for column in ('started', 'user', 'user_id', 'rating_key', 'grandparent_rating_key'):
+            self.conn.execute('CREATE INDEX IF NOT EXISTS history_{0} ON history ({0})'.format(column))
+        self.conn.execute('CREATE TABLE IF NOT EXISTS sync (name TEXT PRIMARY KEY, value INTEGER)')
+        self.conn.commit()
+
+    def cursor(self):
+        """Started time of the newest synced play, 0 if never synced."""
+        row = self.conn.execute("SELECT value FROM sync WHERE name = 'started'").fetchone()
+
+        return row[0] if row else 0
+
+    def floor(self):
+        """Started time the synced history goes back to, 0 if it holds the whole history."""
+        row = self.conn.execute("SELECT value FROM sync WHERE name = 'floor'").fetchone()
+
+        return row[0] if row else 0
+
+    def checkpoint(self, name):
+        """Value saved by a script with set_checkpoint, None if never set."""
+        row = self.conn.execute('SELECT value FROM sync WHERE name = ?', ('checkpoint:' + name,)).fetchone()
+
+        return row[0] if row else None
+
+    def set_checkpoint(self, name, value):
+        """Save a script's position in the history (e.g. the last play id it handled)."""
+        self.conn.execute('INSERT OR REPLACE INTO sync VALUES (?, ?)', ('checkpoint:' + name, value))
+        self.conn.commit()
+
+    def sync(self, tautulli, after=None, length=SYNC_PAGE_LENGTH, overlap=SYNC_OVERLAP):
+        """Add plays newer than the last sync from Tautulli.
+
+        Parameters
+        ----------
+        tautulli : obj
+            jbops.tautulli.Tautulli object.
+        after : int
+            Epoch time the history is needed back to. Older plays are not
+            requested, leave empty to sync the whole history.
+        length : int
+            Rows requested per history page.
+        overlap : int
+            Seconds before the last synced play to request again. Scripts
+            syncing every few seconds pass a smaller overlap and sync with
+            the default now and then for the plays that ran longer.
+
+        Returns
+        -------
+        int
+            Number of rows added or updated.
+
+        Raises
+        ------
+        SyncError
+            A page failed. The sync position is not saved so the next sync
+            requests the pages again.
+        """
+        cursor = self.cursor()
+        floor = self.floor()
+        after = int(after or 0)
+
+        try:
+            if cursor:
+                synced, newest = self._sync_pages(tautulli, length, cursor - overlap)
+                if floor and after < floor:
+                    # An earlier sync stopped at floor, fetch the plays between after and floor.
+                    # Tautulli's before includes the whole day of floor.
+                    backfilled, _ = self._sync_pages(tautulli, length, after,
+                                                     before=time.strftime('%Y-%m-%d', time.localtime(floor)))
+                    synced += backfilled
+                    floor = after
+                newest = max(cursor, newest)
+            else:
+                synced, newest = self._sync_pages(tautulli, length, after)
+                floor = after
+        except SyncError:
+            self.conn.rollback()
+            raise
+
+        self.conn.execute('INSERT OR REPLACE INTO sync VALUES (?, ?)', ('started', newest))
+        self.conn.execute('INSERT OR REPLACE INTO sync VALUES (?, ?)', ('floor', floor))
+        self.conn.commit()
+
+        return synced
+
+    def _sync_pages(self, tautulli, length, oldest, **kwargs):
+        # Store plays newest first until one started before oldest, returns (rows stored, newest started)
+        def get_history(**params):
+            # Release the write lock before waiting on Tautulli
+            self.conn.commit()
+            # paginate ends on a missing page, which would save a gap in the history as synced
+            page = tautulli.get_history(**params)
+            if page is None:
+                raise SyncError('Tautulli get_history failed at row {}'.format(params.get('start') or 0))
+            return page
+
+        synced = 0
+        newest = 0
+        rows = paginate(get_history, length=length, grouping=0,
+                        order_column='date', order_dir='desc', **kwargs)
+        for row in rows:
+            # Current activity is listed with the history but has not been saved yet
+            if row.get('state') or not row.get('id'):
+                continue
+            if row['started'] < oldest:
+                break
+            self.conn.execute('INSERT OR REPLACE INTO history ({}) VALUES ({})'.format(
+                ', '.join(COLUMNS), ', '.join('?' * len(COLUMNS))), [row.get(c) for c in COLUMNS])
+            newest = max(newest, row['started'])
+            synced += 1
+
+        return synced, newest
+
+    def query(self, user=None, user_id=None, section_id=None, rating_key=None, grandparent_rating_key=None,
+              media_type=None, transcode_decision=None, watched=None, after=None, before=None,
+              after_id=None, grouping=False):
+        """Get plays from the local history, newest first.
+
+        Parameters
+        ----------
+        user : str
+            Username.
+        user_id : int
+            User ID.
+        section_id : int
+            Library section ID.
+        rating_key : int
+            Rating key of the item played.
+        grandparent_rating_key : int
+            Rating key of the show or artist played.
+        media_type : str or list
+            Media type(s), e.g. 'movie' or ['episode', 'show'].
+        transcode_decision : str
+            'direct play', 'copy' or 'transcode'.
+        watched : bool
+            Only watched (True) or not watched (False) plays.
+        after : int
+            Only plays started at or after this epoch time.
+        before : int
+            Only plays started before this epoch time.
+        after_id : int
+            Only plays with a history id greater than this.
+        grouping : bool
+            Merge consecutive plays of the same item like Tautulli's grouped history.
+
+        Returns
+        -------
+        list
+            History rows as dicts with Tautulli's get_history keys.
+        """
+        where = []
+        params = []
+        for column, value in (('user', user), ('user_id', user_id), ('section_id', section_id),
+                              ('rating_key', rating_key), ('grandparent_rating_key', grandparent_rating_key),
+                              ('transcode_decision', transcode_decision)):
+            if value is not None:
+                where.append('{} = ?'.format(column))
+                params.append(value)
+        if media_type:
+            media_types = [media_type] if isinstance(media_type, str) else list(media_type)
+            where.append('media_type IN ({})'.format(', '.join('?' * len(media_types))))
+            params += media_types
+        if after is not None:
+            where.append('started >= ?')
+            params.append(int(after))
+        if before is not None:
+            where.append('started < ?')
+            params.append(int(before))
+        if after_id is not None:
+            where.append('id > ?')
+            params.append(int(after_id))
+
+        having = ''
+        if watched is not None:
+            having = 'watched_status {} 1'.format('=' if watched else '<')
+
+        if grouping:
+            # Merge each group in a subquery, then join its newest play (MAX(id)) for the other columns
+            grouped = ', '.join('{} AS {}'.format(expression, column)
+                                for column, expression in GROUPED_COLUMNS.items())
+            columns = ', '.join('{}.{}'.format('g' if c in GROUPED_COLUMNS else 'h', c) for c in COLUMNS)
+            sql = ('SELECT {} FROM history h JOIN (SELECT {} FROM history{} GROUP BY reference_id{}) g '
+                   'ON h.id = g.id ORDER BY g.started DESC').format(
+                columns, grouped, ' WHERE ' + ' AND '.join(where) if where else '',
+                ' HAVING ' + having if having else '')
+        else:
+            if having:
+                where.append(having)
+            sql = 'SELECT * FROM history{} ORDER BY started DESC'.format(
+                ' WHERE ' + ' AND '.join(where) if where else '')
+
+        return [dict(row) for row in self.conn.execute(sql, params)]
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+
+"""
+Description: One process watching many Plex sessions from a deadline queue, shared by JBOPS scripts.
+Requires: requests, sqlite3 (standard library)
+
+ Scripts started by Tautulli hand the session they want to watch to a
+ SessionQueue and exit. A single SessionMonitor (the script's daemon mode)
+ takes the queued sessions, polls get_activity once per tick for all of them
+ and calls the script back when a session's deadline is reached. Deadlines
+ are kept in a heap, so the monitor sleeps until the next one is due instead
+ of waking every session on a fixed interval.
+
+ When no monitor is running, or it stops before taking the session, the
+ script runs one itself for its own session, see SessionQueue.hand_off().
+
+ Usage:
+    from jbops.monitor import SessionMonitor, SessionQueue
+
+    queue = SessionQueue('my_script')
+    if not queue.hand_off(session_id, {'message': message}):
+        monitor = SessionMonitor(tautulli_server, deadline_for, on_due)
+        monitor.track(session_id, {'message': message})
+        monitor.run(forever=False)
+"""
+from __future__ import print_function
+from __future__ import unicode_literals
+
+from builtins import object
+import json
+import time
+import heapq
+import sqlite3
+
+from jbops.cache import cache_path
+
+# Seconds between get_activity polls while sessions are tracked.
+TICK = 5
+
+
+class SessionQueue(object):
+    def __init__(self, name, path=None):
+        self.path = path or cache_path('{}_monitor.db'.format(name))
+        self.conn = sqlite3.connect(self.path, timeout=30)
+        self.conn.execute('CREATE TABLE IF NOT EXISTS sessions (session_id TEXT PRIMARY KEY, data TEXT)')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS heartbeat (name TEXT PRIMARY KEY, value REAL)')
+        self.conn.commit()
+
+    def add(self, session_id, data):
+        """Queue a session for the running monitor, replacing any earlier entry."""
+        self.conn.execute('INSERT OR REPLACE INTO sessions VALUES (?, ?)', (session_id, json.dumps(data)))
+        self.conn.commit()
+
+    def hand_off(self, session_id, data, poll=1):
+        """Queue a session and wait for the running monitor to take it.
+
+        Parameters
+        ----------
+        session_id : str
+            The session to hand off.
+        data : dict
+            The data queued with the session.
+        poll : int
+            Seconds between checks of the queue.
+
+        Returns
+        -------
+        bool
+            True once the monitor took the session. False when no monitor is
+            running or its heartbeat expired before it took the session, the
+            session is then removed from the queue and the caller watches it.
+        """
+        if not self.alive():
+            return False
+        self.add(session_id, data)
+
+        # A live monitor takes new sessions at least once per heartbeat
+        while self.alive():
+            if not self.conn.execute('SELECT 1 FROM sessions WHERE session_id = ?', (session_id,)).fetchone():
+                return True
+            time.sleep(poll)
+
+        with self.conn:
+            reclaimed = self.conn.execute('DELETE FROM sessions WHERE session_id = ?', (session_id,)).rowcount
+
+        return not reclaimed
+
+    def take(self):
+        """Remove and return the queued sessions as (session_id, data) tuples."""
+        with self.conn:
+            rows = self.conn.execute('SELECT session_id, data FROM sessions').fetchall()
+            self.conn.execute('DELETE FROM sessions')
+
+        return [(session_id, json.loads(data)) for session_id, data in rows]
+
+    def beat(self, max_age=TICK * 3):
+        """Record that the monitor is running for the next max_age seconds."""
+        self.conn.execute("INSERT OR REPLACE INTO heartbeat VALUES ('monitor', ?)", (time.time() + max_age,))
+        self.conn.commit()
+
+    def alive(self):
+        """Whether a monitor has recorded a heartbeat that has not expired."""
+        row = self.conn.execute("SELECT value FROM heartbeat WHERE name = 'monitor'").fetchone()
+
+        return bool(row) and time.time() < row[0]
+
+    def close(self):
+        self.conn.close()
+
+
+class SessionMonitor(object):
+    def __init__(self, tautulli, deadline_for, on_due, queue=None, tick=TICK):
+        """Watch sessions and act on them when their deadline is reached.
+
+        Parameters
+        ----------
+        tautulli : obj
+            jbops.tautulli.Tautulli object.
+        deadline_for : func
+            deadline_for(session, data) called with each tracked session on every
+            poll. Returns the epoch time the session is due, or None to stop
+            tracking it.
+        on_due : func
+            on_due(session, data) called once when a session's deadline is reached.
+        queue : obj
+            SessionQueue to take new sessions from.
+        tick : int
+            Seconds between get_activity polls.
+        """
+        self.tautulli = tautulli
+        self.deadline_for = deadline_for
+        self.on_due = on_due
+        self.queue = queue
+        self.tick = tick
+        self.tracked = {}
+        self.deadlines = {}
+        self.heap = []
+
+    def track(self, session_id, data):
+        """Start tracking a session, it is scheduled on the next poll."""
+        self.tracked[session_id] = data
+        self.deadlines.pop(session_id, None)
+
+    def untrack(self, session_id):
+        self.tracked.pop(session_id, None)
+        self.deadlines.pop(session_id, None)
+
+    def poll(self):
+        """Refresh the deadline of every tracked session from one get_activity call.
+
+        Returns
+        -------
+        dict
+            The active sessions by session_id, None if the call failed.
+        """
+        activity = self.tautulli.get_activity()
+        if activity is None:
+            return None
+        sessions = {s['session_id']: s for s in activity['sessions']}
+
+        for session_id, data in list(self.tracked.items()):
+            session = sessions.get(session_id)
+            if session is None:
+                print("Session '{}' is no longer active on the server, stopping monitoring.".format(session_id))
+                self.untrack(session_id)
+                continue
+
+            deadline = self.deadline_for(session, data)
+            if deadline is None:
+                self.untrack(session_id)
+            elif deadline != self.deadlines.get(session_id):
+                # The old heap entry is skipped when popped
+                self.deadlines[session_id] = deadline
+                heapq.heappush(self.heap, (deadline, session_id))
+
+        return sessions
+
+    def run(self, forever=True):
+        """Poll and fire due sessions until stopped.
+
+        Parameters
+        ----------
+        forever : bool
+            Keep running with nothing tracked (daemon mode). When False return
+            once every tracked session has been handled.
+        """
+        while True:
+            if self.queue and forever:
+                # The loop waits at most one tick, allow a few for slow polls
+                self.queue.beat(self.tick * 3)
+                for session_id, data in self.queue.take():
+                    self.track(session_id, data)
+
+            if self.tracked:
+                sessions = self.poll()
+                now = time.time()
+                while sessions is not None and self.heap and self.heap[0][0] <= now:
+                    deadline, session_id = heapq.heappop(self.heap)
+                    if self.deadlines.get(session_id) != deadline:
+                        continue
+                    data = self.tracked[session_id]
+                    self.untrack(session_id)
+                    self.on_due(sessions[session_id], data)
+            elif not forever:
+                return
+
+            # Drop entries replaced by a newer deadline
+            while self.heap and self.deadlines.get(self.heap[0][1]) != self.heap[0][0]:
+                heapq.heappop(self.heap)
+            wait = self.tick
+            if self.heap:
+                wait = min(wait, max(self.heap[0][0] - time.time(), 1))
+            time.sleep(wait)
@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+
+"""
+Description: Local SQLite copies of Plex library sections refreshed from updatedAt deltas, shared by JBOPS scripts.
+Requires: plexapi, sqlite3 (standard library)
+
+ A section is listed in full on its first refresh. Later refreshes only list
+ the items added or updated since the newest updatedAt stored, and list the
+ section in full again when the stored item count no longer matches the
+ server (items were removed). Listings are requested one page at a time.
+
+ Scripts subclass LibrarySnapshot with the columns they keep for each item.
+
+ Usage:
+    from jbops.cache import cache_path
+    from jbops.snapshot import LibrarySnapshot
+
+    class TitleSnapshot(LibrarySnapshot):
+        COLUMNS = (('title', 'TEXT'),)
+
+        def row(self, section, item):
+            return (item.title,)
+
+    snapshot = TitleSnapshot(cache_path('titles.db'))
+    snapshot.refresh(plex.library.section('Movies'))
+    titles = [row['title'] for row in snapshot.items(section)]
+"""
+from __future__ import print_function
+from __future__ import unicode_literals
+
+from builtins import object
+import time
+import sqlite3
+from datetime import datetime
+
+# Items requested per page while listing a section
+PAGE_SIZE = 1000
+
+
+def epoch(date):
+    """Epoch seconds of a plexapi datetime."""
+    return int(time.mktime(date.timetuple()))
+
+
+def iter_items(section, **kwargs):
+    """Yield a section's items one page at a time instead of listing them all at once.
+
+    Parameters
+    ----------
+    section : obj
+        plexapi LibrarySection object.
+    kwargs
+        Passed to section.search, e.g. filters.
+    """
+    start = 0
+    while True:
+        page = section.search(container_start=start, container_size=PAGE_SIZE, maxresults=PAGE_SIZE, **kwargs)
+        for item in page:
+            yield item
+        if len(page) < PAGE_SIZE:
+            break
+        start += PAGE_SIZE
+
+
+class LibrarySnapshot(object):
+    # (name, SQLite type) of the columns stored for each item after rating_key and section_id
+    COLUMNS = ()
+    # Passed to section.search when listing, e.g. {'includeGuids': True}
+    SEARCH_KWARGS = {}
+
+    def __init__(self, path):
+        self.conn = sqlite3.connect(path)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute('CREATE TABLE IF NOT EXISTS items (rating_key TEXT PRIMARY KEY, section_id TEXT{})'.format(
+            ''.join(', {} {}'.format(name, column_type) for name, column_type in self.COLUMNS)))
+        self.conn.execute('CREATE INDEX IF NOT EXISTS items_section ON items (section_id)')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS sections (section_id TEXT PRIMARY KEY, updated_at INTEGER)')
+        self.conn.commit()
+
+    def row(self, section, item):
+        """Values of COLUMNS for a listed item.
+
+        Items come from the section listing and have _autoReload turned off,
+        attributes missing from the listing are None.
+        """
+        raise NotImplementedError
+
+    def refresh(self, section):
+        """Update the snapshot with the section items added or updated since the last refresh.
+
+        Parameters
+        ----------
+        section : obj
+            plexapi LibrarySection object.
+        """
+        section_id = str(section.key)
+        row = self.conn.execute('SELECT updated_at FROM sections WHERE section_id = ?', (section_id,)).fetchone()
+        updated_at = row[0] if row else 0
+        if updated_at:
+            updated_at = self._store(section, iter_items(
+                section, filters={'updatedAt>>': datetime.fromtimestamp(updated_at - 1)}, **self.SEARCH_KWARGS),
+                updated_at)
+        if not updated_at or self.count(section) != section.totalSize:
+            self.conn.execute('DELETE FROM items WHERE section_id = ?', (section_id,))
+            updated_at = self._store(section, iter_items(section, **self.SEARCH_KWARGS), 0)
+        self.conn.execute('INSERT OR REPLACE INTO sections VALUES (?, ?)', (section_id, updated_at))
+        self.conn.commit()
+
+    def _store(self, section, items, updated_at):
+        # Store listed items, returns the newest updatedAt seen
+        sql = 'INSERT OR REPLACE INTO items VALUES ({})'.format(', '.join('?' * (len(self.COLUMNS) + 2)))
+        for item in items:
+            item._autoReload = False
+            self.conn.execute(sql, (str(item.ratingKey), str(section.key)) + tuple(self.row(section, item)))
+            changed = item.updatedAt or item.addedAt
+            if changed:
+                updated_at = max(updated_at, epoch(changed))
+
+        return updated_at
+
+    def count(self, section):
+        """Number of section items in the snapshot."""
+        return self.conn.execute('SELECT COUNT(*) FROM items WHERE section_id = ?',
+                                 (str(section.key),)).fetchone()[0]
+
+    def items(self, section=None):
+        """Stored items as sqlite3.Row objects, of one section or of every section."""
+        if section is None:
+            return self.conn.execute('SELECT * FROM items ORDER BY rowid')
+
+        return self.conn.execute('SELECT * FROM items WHERE section_id = ? ORDER BY rowid', (str(section.key),))
+
+    def close(self):
+        self.conn.close()
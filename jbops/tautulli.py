@@ -0,0 +1,369 @@
+# -*- coding: utf-8 -*-
+
+"""
+Description: Pooled Tautulli API client shared by JBOPS scripts.
+Requires: requests, urllib3
+
+ Usage:
+    import os
+    import sys
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from jbops.tautulli import Tautulli
+
+    tautulli_server = Tautulli(TAUTULLI_URL, TAUTULLI_APIKEY, VERIFY_SSL)
+    activity = tautulli_server.get_activity()
+"""
+from __future__ import print_function
+from __future__ import unicode_literals
+
+from builtins import object
+import threading
+import traceback
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from requests import Session
+from requests.adapters import HTTPAdapter
+from requests.exceptions import RequestException
+from urllib3.util.retry import Retry
+
+from jbops.cache import MetadataCache
+
+# Connections kept alive per host. Raise this when running many calls at once.
+POOL_SIZE = 10
+# Retries for connection errors and 5xx responses, waiting
+# backoff * (2 ** (retry - 1)) seconds between attempts. Commands with side
+# effects (notify, terminate_session) only retry connection errors.
+RETRIES = 3
+BACKOFF = 0.3
+RETRY_STATUS = (500, 502, 503, 504)
+# Rows requested per page of a datatable command (get_history, get_library_media_info, ...)
+PAGE_LENGTH = 100
+# Concurrent calls made by fetch_all
+WORKERS = 10
+
+
+def pooled_session(verify_ssl=True, pool_size=POOL_SIZE, retries=RETRIES, backoff=BACKOFF,
+                   idempotent=True):
+    """Create a requests Session with keep-alive pooling and retries.
+
+    Parameters
+    ----------
+    verify_ssl : bool
+        Verify the SSL certificate of the server. Scripts with a VERIFY_SSL
+        setting pass it, the others keep verification on.
+    pool_size : int
+        Number of connections kept alive per host.
+    retries : int
+        Number of retries for failed connections and 5xx responses.
+    backoff : float
+        Backoff factor between retries.
+    idempotent : bool
+        False for sessions sending commands that must not run twice. Only
+        connection errors are retried, never read errors or 5xx responses
+        where the server may already have acted on the request.
+
+    Returns
+    -------
+    obj
+        requests Session object.
+    """
+    session = Session()
+    if idempotent:
+        retry = Retry(total=retries, connect=retries, read=retries,
+                      backoff_factor=backoff, status_forcelist=RETRY_STATUS)
+    else:
+        retry = Retry(total=retries, connect=retries, read=0, status=0,
+                      backoff_factor=backoff)
+    adapter = HTTPAdapter(max_retries=retry,
+                          pool_connections=pool_size,
+                          pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+
+    # Ignore verifying the SSL certificate
+    if verify_ssl is False:
+        session.verify = False
+        # Disable the warning that the request is insecure, we know that...
+        import urllib3
+        urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+
+    return session
+
+
+def paginate(api_call, length=PAGE_LENGTH, **kwargs):
+    """Yield every row of a paged Tautulli datatable command.
+
+    Parameters
+    ----------
+    api_call : function
+        Tautulli method accepting start and length, e.g. tautulli.get_history.
+    length : int
+        Number of rows requested per page.
+    kwargs
+        Passed to api_call.
+
+    Yields
+    ------
+    dict
+        A row of the command's 'data' list.
+    """
+    start = 0
+    while True:
+        page = api_call(start=start, length=length, **kwargs)
+        rows = page['data'] if page else []
+        for row in rows:
+            yield row
+        if len(rows) < length:
+            break
+        start += length
+
+
+def fetch_all(func, items, workers=WORKERS):
+    """Call func for every item using a bounded pool of threads.
+
+    Items are submitted as soon as they are read, so when items is a generator
+    (paginate) the next page is requested while the current one is worked on.
+
+    Parameters
+    ----------
+    func : function
+        Function called with a single item.
+    items : iterable
+        Items to call func with.
+    workers : int
+        Maximum number of calls running at the same time.
+
+    Yields
+    ------
+    tuple
+        (item, result) in the same order as items.
+    """
+    workers = max(workers, 1)
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for item in items:
+            pending.append((item, executor.submit(func, item)))
+            # Keep a bounded number of results waiting to be consumed
+            if len(pending) >= workers * 2:
+                item, future = pending.popleft()
+                yield item, future.result()
+        while pending:
+            item, future = pending.popleft()
+            yield item, future.result()
+
+
+class Tautulli(object):
+    def __init__(self, url, apikey, verify_ssl=True, debug=None, pool_size=POOL_SIZE,
+                 retries=RETRIES, backoff=BACKOFF, cache=None):
+        self.url = url.rstrip('/')
+        self.apikey = apikey
+        self.debug = debug
+        # jbops.cache.MetadataCache used by get_metadata, or True to open the
+        # default cache on the first get_metadata call.
+        self.cache = cache
+        self._cache_lock = threading.Lock()
+        self.session = pooled_session(verify_ssl, pool_size, retries, backoff)
+        # Separate pool for commands that must not be sent twice
+        self.command_session = pooled_session(verify_ssl, pool_size, retries, backoff,
+                                              idempotent=False)
+
+    def _call_api(self, cmd, payload=None, method='GET', idempotent=True):
+        payload = dict(payload or {})
+        payload['cmd'] = cmd
+        payload['apikey'] = self.apikey
+        session = self.session if idempotent else self.command_session
+
+        try:
+            response = session.request(method, self.url + '/api/v2', params=payload)
+        except RequestException as e:
+            print("Tautulli request failed for cmd '{}'. Invalid Tautulli URL? Error: {}".format(cmd, e))
+            if self.debug:
+                traceback.print_exc()
+            return
+
+        try:
+            response_json = response.json()
+        except ValueError:
+            print("Failed to parse json response for Tautulli API cmd '{}': {}".format(cmd, response.content))
+            return
+
+        if response_json['response']['result'] == 'success':
+            if self.debug:
+                print("Successfully called Tautulli API cmd '{}'".format(cmd))
+            return response_json['response']['data']
+        else:
+            error_msg = response_json['response']['message']
+            print("Tautulli API cmd '{}' failed: {}".format(cmd, error_msg))
+            return
+
+    def get_activity(self, session_key=None, session_id=None):
+        """Call Tautulli's get_activity api endpoint"""
+        payload = {}
+
+        if session_key:
+            payload['session_key'] = session_key
+        elif session_id:
+            payload['session_id'] = session_id
+
+        return self._call_api('get_activity', payload)
+
+    def notify(self, notifier_id, subject, body):
+        """Call Tautulli's notify api endpoint"""
+        payload = {'notifier_id': notifier_id,
+                   'subject': subject,
+                   'body': body}
+
+        return self._call_api('notify', payload, idempotent=False)
+
+    def terminate_session(self, session_key=None, session_id=None, message=''):
+        """Call Tautulli's terminate_session api endpoint"""
+        payload = {}
+
+        if session_key:
+            payload['session_key'] = session_key
+        elif session_id:
+            payload['session_id'] = session_id
+
+        if message:
+            payload['message'] = message
+
+        return self._call_api('terminate_session', payload, idempotent=False)
+
+    def get_history(self, user=None, user_id=None, section_id=None, rating_key=None,
+                    grandparent_rating_key=None, media_type=None, transcode_decision=None,
+                    start_date=None, before=None, after=None, start=None, length=None,
+                    order_column=None, order_dir=None, grouping=None):
+        """Call Tautulli's get_history api endpoint
+
+        Returns the whole response data dict ('data', 'recordsFiltered', ...).
+        """
+        payload = {}
+
+        if user:
+            payload['user'] = user
+        if user_id:
+            payload['user_id'] = user_id
+        if section_id:
+            payload['section_id'] = section_id
+        if rating_key:
+            payload['rating_key'] = rating_key
+        if grandparent_rating_key:
+            payload['grandparent_rating_key'] = grandparent_rating_key
+        if media_type:
+            payload['media_type'] = media_type
+        if transcode_decision:
+            payload['transcode_decision'] = transcode_decision
+        if start_date:
+            payload['start_date'] = start_date
+        if before:
+            payload['before'] = before
+        if after:
+            payload['after'] = after
+        if start:
+            payload['start'] = start
+        if length:
+            payload['length'] = length
+        if order_column:
+            payload['order_column'] = order_column
+            payload['order_dir'] = order_dir or 'desc'
+        if grouping is not None:
+            payload['grouping'] = int(grouping)
+
+        return self._call_api('get_history', payload)
+
+    def get_metadata(self, rating_key, updated_at=None):
+        """Call Tautulli's get_metadata api endpoint
+
+        Served from the metadata cache when one is set, unless the cached copy
+        is older than updated_at, the newest change time the caller knows of
+        (e.g. a library row's added_at).
+        """
+        cache = self.metadata_cache()
+        if cache is not None:
+            return cache.get_metadata(rating_key, self._get_metadata, updated_at)
+
+        return self._get_metadata(rating_key)
+
+    def metadata_cache(self):
+        """The metadata cache, opened on first use. None when caching is off."""
+        if self.cache is True:
+            with self._cache_lock:
+                if self.cache is True:
+                    self.cache = MetadataCache()
+
+        return self.cache or None
+
+    def _get_metadata(self, rating_key):
+        payload = {'rating_key': rating_key}
+
+        return self._call_api('get_metadata', payload)
+
+    def get_new_rating_keys(self, rating_key, media_type):
+        """Call Tautulli's get_new_rating_keys api endpoint"""
+        payload = {'rating_key': rating_key,
+                   'media_type': media_type}
+
+        return self._call_api('get_new_rating_keys', payload)
+
+    def get_libraries(self):
+        """Call Tautulli's get_libraries api endpoint"""
+        return self._call_api('get_libraries')
+
+    def get_library_media_info(self, section_id=None, rating_key=None, start=None, length=None,
+                               order_column=None, order_dir=None, refresh=None):
+        """Call Tautulli's get_library_media_info api endpoint"""
+        payload = {}
+
+        if section_id:
+            payload['section_id'] = section_id
+        if rating_key:
+            payload['rating_key'] = rating_key
+        if start:
+            payload['start'] = start
+        if length:
+            payload['length'] = length
+        if order_column:
+            payload['order_column'] = order_column
+            payload['order_dir'] = order_dir or 'desc'
+        if refresh:
+            payload['refresh'] = 'true'
+
+        return self._call_api('get_library_media_info', payload)
+
+    def get_home_stats(self, time_range, stats_type, stats_count):
+        """Call Tautulli's get_home_stats api endpoint"""
+        payload = {'time_range': time_range,
+                   'stats_type': stats_type,
+                   'stats_count': stats_count}
+
+        return self._call_api('get_home_stats', payload)
+
+    def get_users(self):
+        """Call Tautulli's get_users api endpoint"""
+        return self._call_api('get_users')
+
+    def get_users_table(self, length=None):
+        """Call Tautulli's get_users_table api endpoint"""
+        payload = {}
+
+        if length:
+            payload['length'] = length
+
+        return self._call_api('get_users_table', payload)
+
+    def get_user_ips(self, user_id, start=None, length=None):
+        """Call Tautulli's get_user_ips api endpoint"""
+        payload = {'user_id': user_id}
+
+        if start:
+            payload['start'] = start
+        if length:
+            payload['length'] = length
+
+        return self._call_api('get_user_ips', payload)
+
+    def get_geoip_lookup(self, ip_address):
+        """Call Tautulli's get_geoip_lookup api endpoint"""
+        payload = {'ip_address': ip_address}
+
+        return self._call_api('get_geoip_lookup', payload)
@@ -57,9 +57,11 @@ import json
 import time
 import argparse
 from datetime import datetime
-from requests import Session
-from requests.adapters import HTTPAdapter
-from requests.exceptions import RequestException
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from jbops.tautulli import Tautulli  # noqa: E402
+from jbops.monitor import SessionMonitor, SessionQueue  # noqa: E402
 
 
 TAUTULLI_URL = ''
@@ -145,6 +147,78 @@ def get_all_streams(tautulli, user_id=None):
     return streams
 
 
+def kill_all_streams(tautulli, streams, message, all_opts, workers=1):
+    """Terminate and notify a list of streams concurrently.
+
+    Parameters
+    ----------
+    tautulli : obj
+        Tautulli object.
+    streams : list
+        The stream objects to kill.
+    message : str
+        The message to use when the streams are terminated.
+    all_opts : obj
+        The parsed script arguments.
+    workers : int
+        The number of streams to kill at the same time.
+    """
+    def kill(a_stream):
+        tautulli.terminate_session(session_id=a_stream.session_id, message=message)
+        notify(all_opts, message, 'All Streams', a_stream, tautulli)
+
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+        # list() to surface any exception raised in a worker
+        list(executor.map(kill, streams))
+
+
+def pause_deadline(session, data):
+    """Epoch time a paused session is killed, None once it has been resumed.
+
+    Parameters
+    ----------
+    session : dict
+        The session from Tautulli's get_activity.
+    data : dict
+        The pause details queued for the session.
+    """
+    if session['state'] in ('playing', 'buffering'):
+        sys.stdout.write(
+            "Session '{}' from user '{}' has been resumed, "
+            .format(session['session_id'], session['username']) +
+            "stopping monitoring.\n")
+        return None
+
+    return data['paused_at'] + data['limit']
+
+
+def paused_monitor(tautulli, interval, queue=None):
+    """Create the monitor that kills sessions paused for longer than their limit.
+
+    Parameters
+    ----------
+    tautulli : obj
+        Tautulli object.
+    interval : int
+        The amount of time to wait between checks of the sessions' state.
+    queue : obj
+        SessionQueue to take sessions from when running as a daemon.
+    Returns
+    -------
+    obj
+        The jbops.monitor.SessionMonitor object.
+    """
+    def kill_paused(session, data):
+        a_stream = Stream(tautulli=tautulli, session=session)
+        a_stream.terminate(data['message'])
+        sys.stdout.write(
+            "Session '{}' from user '{}' has been killed.\n"
+            .format(a_stream.session_id, a_stream.username))
+        notify(argparse.Namespace(**data['opts']), data['message'], 'Paused', a_stream, tautulli)
+
+    return SessionMonitor(tautulli, pause_deadline, kill_paused, queue=queue, tick=interval)
+
+
 def notify(all_opts, message, kill_type=None, stream=None, tautulli=None):
     """Decides which notifier type to use"""
     if all_opts.notify and all_opts.richMessage:
@@ -239,90 +313,6 @@ def basic_notify(notifier_id, session_id, username=None, message=None, stream=No
     notification.send(SUBJECT_TEXT, body)
 
 
-class Tautulli(object):
-    def __init__(self, url, apikey, verify_ssl=False, debug=None):
-        self.url = url
-        self.apikey = apikey
-        self.debug = debug
-
-        self.session = Session()
-        self.adapters = HTTPAdapter(max_retries=3,
-                                    pool_connections=1,
-                                    pool_maxsize=1,
-                                    pool_block=True)
-        self.session.mount('http://', self.adapters)
-        self.session.mount('https://', self.adapters)
-
-        # Ignore verifying the SSL certificate
-        if verify_ssl is False:
-            self.session.verify = False
-            # Disable the warning that the request is insecure, we know that...
-            import urllib3
-            urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
-
-    def _call_api(self, cmd, payload, method='GET'):
-        payload['cmd'] = cmd
-        payload['apikey'] = self.apikey
-
-        try:
-            response = self.session.request(method, self.url + '/api/v2', params=payload)
-        except RequestException as e:
-            print("Tautulli request failed for cmd '{}'. Invalid Tautulli URL? Error: {}".format(cmd, e))
-            if self.debug:
-                traceback.print_exc()
-            return
-
-        try:
-            response_json = response.json()
-        except ValueError:
-            print(
-                "Failed to parse json response for Tautulli API cmd '{}': {}"
-                .format(cmd, response.content))
-            return
-
-        if response_json['response']['result'] == 'success':
-            if self.debug:
-                print("Successfully called Tautulli API cmd '{}'".format(cmd))
-            return response_json['response']['data']
-        else:
-            error_msg = response_json['response']['message']
-            print("Tautulli API cmd '{}' failed: {}".format(cmd, error_msg))
-            return
-
-    def get_activity(self, session_key=None, session_id=None):
-        """Call Tautulli's get_activity api endpoint"""
-        payload = {}
-
-        if session_key:
-            payload['session_key'] = session_key
-        elif session_id:
-            payload['session_id'] = session_id
-
-        return self._call_api('get_activity', payload)
-
-    def notify(self, notifier_id, subject, body):
-        """Call Tautulli's notify api endpoint"""
-        payload = {'notifier_id': notifier_id,
-                   'subject': subject,
-                   'body': body}
-
-        return self._call_api('notify', payload)
-
-    def terminate_session(self, session_key=None, session_id=None, message=''):
-        """Call Tautulli's terminate_session api endpoint"""
-        payload = {}
-
-        if session_key:
-            payload['session_key'] = session_key
-        elif session_id:
-            payload['session_id'] = session_id
-
-        if message:
-            payload['message'] = message
-
-        return self._call_api('terminate_session', payload)
-
-
 class Stream(object):
     def __init__(self, session_id=None, user_id=None, username=None, tautulli=None, session=None):
         self.state = None
@@ -359,55 +349,6 @@ class Stream(object):
         """
         self.tautulli.terminate_session(session_id=self.session_id, message=message)
 
-    def terminate_long_pause(self, message, limit, interval):
-        """Kills the session if it is paused for longer than <limit> seconds.
-
-        Parameters
-        ----------
-        message : str
-            The message to use if the stream is terminated.
-        limit : int
-            The number of seconds the session is allowed to remain paused before it
-            is terminated.
-        interval : int
-            The amount of time to wait between checks of the session state.
-        """
-        start = datetime.now()
-        checked_time = 0
-        # Continue checking 2 intervals past the allowed limit in order to
-        # account for system variances.
-        check_limit = limit + (interval * 2)
-
-        while checked_time < check_limit:
-            self.get_all_stream_info()
-
-            if self.session_exists is False:
-                sys.stdout.write(
-                    "Session '{}'  from user '{}' is no longer active "
-                    .format(self.session_id, self.username) +
-                    "on the server, stopping monitoring.\n")
-                return False
-
-            now = datetime.now()
-            checked_time = (now - start).total_seconds()
-
-            if self.state == 'paused':
-                if checked_time >= limit:
-                    self.terminate(message)
-                    sys.stdout.write(
-                        "Session '{}' from user '{}' has been killed.\n"
-                        .format(self.session_id, self.username))
-                    return True
-                else:
-                    time.sleep(interval)
-
-            elif self.state == 'playing' or self.state == 'buffering':
-                sys.stdout.write(
-                    "Session '{}' from user '{}' has been resumed, "
-                    .format(self.session_id, self.username) +
-                    "stopping monitoring.\n")
-                return False
-
 
 class Notification(object):
     def __init__(self, notifier_id, subject, body, tautulli, stream):
@@ -594,23 +535,27 @@ if __name__ == "__main__":
                         help='Color of the rich message')
     parser.add_argument('--delay', type=int, default=0,
                         help='Delay in seconds before killing the stream.')
+    parser.add_argument('--workers', type=int, default=10,
+                        help='Number of streams killed at the same time with allStreams.')
+    parser.add_argument('--monitor', action='store_true',
+                        help='With paused, run as the monitor watching every paused session. '
+                             'Scripts started by Tautulli hand their session to it.')
     parser.add_argument("--debug", action='store_true',
                         help='Enable debug messages.')
 
     opts = parser.parse_args()
 
-    if not opts.sessionId and opts.jbop != 'allStreams':
+    if not opts.sessionId and opts.jbop != 'allStreams' and not opts.monitor:
         sys.stderr.write("No sessionId provided! Is this synced content?\n")
         sys.exit(1)
 
     if opts.debug:
-        # Import traceback to get more detailed information
-        import traceback
         # Dump the ENVs passed from tautulli
         debug_dump_vars()
 
     # Create a Tautulli instance
-    tautulli_server = Tautulli(TAUTULLI_URL.rstrip('/'), TAUTULLI_APIKEY, VERIFY_SSL, opts.debug)
+    tautulli_server = Tautulli(TAUTULLI_URL.rstrip('/'), TAUTULLI_APIKEY, VERIFY_SSL, opts.debug,
+                               pool_size=max(opts.workers, 1))
 
     # Create initial Stream object with basic info
     tautulli_stream = Stream(opts.sessionId, opts.userId, opts.username, tautulli_server)
@@ -634,11 +579,20 @@ if __name__ == "__main__":
 
     elif opts.jbop == 'allStreams':
         all_streams = get_all_streams(tautulli_server, opts.userId)
-        for a_stream in all_streams:
-            tautulli_server.terminate_session(session_id=a_stream.session_id, message=kill_message)
-            notify(opts, kill_message, 'All Streams', a_stream, tautulli_server)
+        kill_all_streams(tautulli_server, all_streams, kill_message, opts, opts.workers)
 
     elif opts.jbop == 'paused':
-        killed_stream = tautulli_stream.terminate_long_pause(kill_message, opts.limit, opts.interval)
-        if killed_stream:
-            notify(opts, kill_message, 'Paused', tautulli_stream, tautulli_server)
+        queue = SessionQueue('kill_stream')
+        if opts.monitor:
+            paused_monitor(tautulli_server, opts.interval, queue).run()
+        else:
+            pause_data = {'paused_at': time.time(), 'limit': opts.limit, 'message': kill_message,
+                          'opts': vars(opts)}
+            if queue.hand_off(opts.sessionId, pause_data):
+                sys.stdout.write("Session '{}' handed to the running paused session monitor.\n"
+                                 .format(opts.sessionId))
+            else:
+                # No monitor took it, watch this session until it is resumed, stopped or killed
+                monitor = paused_monitor(tautulli_server, opts.interval)
+                monitor.track(opts.sessionId, pause_data)
+                monitor.run(forever=False)
@@ -48,15 +48,20 @@ Taultulli > Settings > Notification Agents > New Script > Script Arguments:
 from __future__ import print_function
 from __future__ import unicode_literals
 
-from builtins import range
 import requests
 import argparse
 from datetime import datetime, timedelta
 import sys
 import os
+import sqlite3
 from plexapi.server import PlexServer
 from time import time as ttime
-from time import sleep
+from time import mktime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from jbops.tautulli import Tautulli  # noqa: E402
+from jbops.history import HistoryStore, SyncError  # noqa: E402
+from jbops.monitor import SessionMonitor, SessionQueue  # noqa: E402
 
 TAUTULLI_URL = ''
 TAUTULLI_APIKEY = ''
@@ -135,74 +140,59 @@ def send_notification(subject_text, body_text, notifier_id):
         return None
 
 
-def get_activity(session_id=None):
-    """Get the current activity on the PMS.
+def sync_history(after):
+    """Sync the local copy of the Tautulli history.
+
+    Only plays newer than the last sync, and on the first run only plays back
+    to the start of the history window, are requested from Tautulli.
+
+    Parameters
+    ----------
+    after : int
+        Epoch time of the start of the history window.
 
     Returns
     -------
-    list
-        The current active sessions on the Plex server.
+    obj
+        The synced HistoryStore. Exits when the sync fails, limits are never
+        checked against a missing history.
     """
-    payload = {'apikey': TAUTULLI_APIKEY,
-               'cmd': 'get_activity'}
-    if session_id:
-        payload['session_id'] = session_id
-
     try:
-        req = sess.get(TAUTULLI_URL.rstrip('/') + '/api/v2', params=payload)
-        response = req.json()
-
-        if session_id:
-            res_data = response['response']['data']
-        else:
-            res_data = response['response']['data']['sessions']
-        return res_data
+        history = HistoryStore()
+        history.sync(Tautulli(TAUTULLI_URL, TAUTULLI_APIKEY, verify_ssl=sess.verify), after=after)
+        return history
 
-    except Exception as e:
-        sys.stderr.write(
-            "Tautulli API 'get_activity' request failed: {0}.\n".format(e))
-        pass
+    except (SyncError, requests.exceptions.RequestException, sqlite3.Error) as e:
+        sys.stderr.write("Tautulli API 'get_history' request failed: {0}.\n".format(e))
+        sys.exit(1)
 
 
-def get_history(username, start_date=None, section_id=None):
-    """Get the Tautulli history.
+def get_history(history, username, after, section_id=None, grandparent_rating_key=None):
+    """Get the user's plays from the local copy of the Tautulli history.
 
     Parameters
     ----------
+    history : obj
+        HistoryStore returned by sync_history.
     username : str
         The username to gather history from.
+    after : int
+        Epoch time of the start of the history window.
 
     Optional
     ----------
-    start_date : list ["YYYY-MM-DD", ...]
-        The date in history to search.
     section_id : int
         The libraries numeric identifier
+    grandparent_rating_key : int
+        The unique identifier for the TV show or artist.
 
     Returns
     -------
-    dict
-        The total number of watches, plays, or total playtime.
+    list
+        The user's grouped plays in the window, newest first.
     """
-    payload = {'apikey': TAUTULLI_APIKEY,
-               'cmd': 'get_history',
-               'user': username}
-
-    if start_date:
-        payload['start_date'] = start_date
-
-    if section_id:
-        payload['section_id '] = section_id
-
-    try:
-        req = sess.get(TAUTULLI_URL.rstrip('/') + '/api/v2', params=payload)
-        response = req.json()
-
-        res_data = response['response']['data']
-        return res_data
-
-    except Exception as e:
-        sys.stderr.write("Tautulli API 'get_history' request failed: {0}.".format(e))
+    return history.query(user=username, section_id=section_id, grandparent_rating_key=grandparent_rating_key,
+                         after=after, grouping=True)
 
 
 def terminate_session(session_id, message, notifier=None, username=None):
@@ -246,6 +236,45 @@ def terminate_session(session_id, message, notifier=None, username=None):
         return None
 
 
+def limit_deadline(session, data):
+    """Epoch time the session reaches the user's limit.
+
+    The time left is counted from the view offset of the session when the
+    monitor first saw it, so time spent paused is not counted.
+
+    Parameters
+    ----------
+    session : dict
+        The session from Tautulli's get_activity.
+    data : dict
+        The limit details queued for the session.
+
+    Returns
+    -------
+    int
+        The epoch time to terminate the session.
+    """
+    view_offset = int(session.get('view_offset') or 0) // 1000
+    if data['offset'] is None:
+        data['offset'] = view_offset
+
+    return int(ttime()) + data['remaining'] - (view_offset - data['offset'])
+
+
+def limit_reached(session, data):
+    """Terminate a monitored session that reached the user's limit."""
+    print('Total {} ({} + current item duration {}) is greater than limit ({}).'
+          .format(data['jbop'], data['total'], data['duration'], data['limit']))
+    terminate_session(session['session_id'], data['message'], data['notify'], data['username'])
+
+
+def limit_monitor(queue=None):
+    """Create the monitor that terminates sessions once they reach their limit."""
+    tautulli = Tautulli(TAUTULLI_URL, TAUTULLI_APIKEY, verify_ssl=sess.verify)
+
+    return SessionMonitor(tautulli, limit_deadline, limit_reached, queue=queue)
+
+
 def arg_decoding(arg):
     return arg.decode(TAUTULLI_ENCODING).encode('UTF-8')
 
@@ -253,11 +282,11 @@ def arg_decoding(arg):
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
         description="Limiting Plex users by plays, watches, or total time from Tautulli.")
-    parser.add_argument('--jbop', required=True, choices=SELECTOR,
+    parser.add_argument('--jbop', choices=SELECTOR,
                         help='Limit selector.\nChoices: (%(choices)s)')
-    parser.add_argument('--username', required=True,
+    parser.add_argument('--username',
                         help='The username of the person streaming.')
-    parser.add_argument('--sessionId', required=True,
+    parser.add_argument('--sessionId',
                         help='The unique identifier for the stream.')
     parser.add_argument('--notify', type=int,
                         help='Notification Agent ID number to Agent to send '
@@ -278,19 +307,24 @@ if __name__ == "__main__":
                              'Default: %(default)s day(s) (today).')
     parser.add_argument('--duration', type=int, default=0,
                         help='Duration of item that triggered script agent.')
+    parser.add_argument('--monitor', action='store_true',
+                        help='Run as the monitor terminating every session that reaches its limit '
+                             'while playing. Scripts started by Tautulli hand their session to it.')
 
     opts = parser.parse_args()
 
-    history_lst = []
+    if opts.monitor:
+        limit_monitor(SessionQueue('limiterr')).run()
+        sys.exit(0)
+
+    if not opts.jbop or not opts.username:
+        parser.error('--jbop and --username are required.')
+
     total_limit = 0
     total_jbop = 0
     duration = 0
-    dates = []
-    delta = timedelta(days=opts.days)
-
-    for i in range(delta.days + 1):
-        day = TODAY + timedelta(days=-i)
-        dates.append(day.strftime('%Y-%m-%d'))
+    # Start of the first day in the history window
+    window_start = mktime((TODAY - timedelta(days=opts.days)).date().timetuple())
 
     if opts.limit:
         limit = dict(opts.limit)
@@ -318,20 +352,20 @@ if __name__ == "__main__":
     else:
         message = ''
 
-    for date in dates:
-        if opts.section:
-            section_id = lib_dict[opts.section]
-            history = get_history(username=opts.username, section_id=section_id, start_date=date)
-        else:
-            history = get_history(username=opts.username, start_date=date)
-        history_lst.append(history)
-        
+    # Synced once, both the limit and the --jbop limit checks read from it
+    history_store = sync_history(window_start)
+
+    if opts.section:
+        history = get_history(history_store, opts.username, window_start, section_id=int(lib_dict[opts.section]))
+    else:
+        history = get_history(history_store, opts.username, window_start)
+
     if opts.jbop == 'watch':
-        total_jbop = sum([data['watched_status'] for history in history_lst for data in history['data']])
+        total_jbop = sum([data['watched_status'] for data in history])
     if opts.jbop == 'time':
-        total_jbop = sum([data['duration'] for history in history_lst for data in history['data']])
+        total_jbop = sum([data['duration'] for data in history])
     if opts.jbop == 'plays':
-        total_jbop = sum([history['recordsFiltered'] for history in history_lst])
+        total_jbop = len(history)
 
     if total_jbop:
         if total_jbop > total_limit:
@@ -339,19 +373,17 @@ if __name__ == "__main__":
                   .format(opts.jbop, total_jbop, total_limit))
             terminate_session(opts.sessionId, message, opts.notify, opts.username)
         elif (duration + total_jbop) > total_limit:
-            interval = 60
-            start = 0
-            while (start + total_jbop) < total_limit:
-                if get_activity(opts.sessionId):
-                    sleep(interval)
-                    start += interval
-                else:
-                    print('Session; {} has been dropped. Stopping monitoring of stream.'.format(opts.sessionId))
-                    exit()
-
-            print('Total {} ({} + current item duration {}) is greater than limit ({}).'
-                  .format(opts.jbop, total_jbop, duration, total_limit))
-            terminate_session(opts.sessionId, message, opts.notify, opts.username)
+            limit_data = {'jbop': opts.jbop, 'total': total_jbop, 'duration': duration, 'limit': total_limit,
+                          'remaining': total_limit - total_jbop, 'offset': None, 'message': message,
+                          'notify': opts.notify, 'username': opts.username}
+            queue = SessionQueue('limiterr')
+            if queue.hand_off(opts.sessionId, limit_data):
+                print('Session {} handed to the running limiterr monitor.'.format(opts.sessionId))
+            else:
+                # No monitor took it, watch this session until it ends or reaches the limit
+                monitor = limit_monitor()
+                monitor.track(opts.sessionId, limit_data)
+                monitor.run(forever=False)
         else:
             if duration:
                 print('Total {} ({} + current item duration {}) is less than limit ({}).'
@@ -362,22 +394,15 @@ if __name__ == "__main__":
     # todo-me need more flexibility for pulling history
     # limit work requires gp_rating_key only? Needs more options.
     if opts.jbop == 'limit' and opts.grandparent_rating_key:
-        ep_watched = []
-        stopped_time = []
-        for date in dates:
-            history_lst.append(get_history(username=opts.username, start_date=date))
         # If message is not already defined use default message
         if not message:
             message = LIMIT_MESSAGE.format(delay=opts.delay)
-        for history in history_lst:
-            ep_watched += [data['watched_status'] for data in history['data']
-                          if data['grandparent_rating_key'] == opts.grandparent_rating_key and
-                          data['watched_status'] == 1]
-            
-            stopped_time += [data['stopped'] for data in history['data']
-                            if data['grandparent_rating_key'] == opts.grandparent_rating_key and
-                            data['watched_status'] == 1]
-            
+        show_history = [data for data in get_history(history_store, opts.username, window_start,
+                                                     grandparent_rating_key=opts.grandparent_rating_key)
+                        if data['watched_status'] == 1]
+        ep_watched = [data['watched_status'] for data in show_history]
+        stopped_time = [data['stopped'] for data in show_history]
+
         # If show has no history for date range start at 0.
         if not ep_watched:
             ep_watched = 0
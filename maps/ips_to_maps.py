@@ -44,6 +44,10 @@ import time
 import webbrowser
 import re
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from jbops.cache import GeoIPCache  # noqa: E402
+from jbops.tautulli import Tautulli, fetch_all  # noqa: E402
+
 # ## EDIT THESE SETTINGS ##
 TAUTULLI_APIKEY = ''  # Your Tautulli API key
 TAUTULLI_URL = 'http://localhost:8181/'  # Your Tautulli URL
@@ -53,6 +57,9 @@ TAUTULLI_URL = 'http://localhost:8181/'  # Your Tautulli URL
 LAN_SUBNET = ('10.10', '127.0.0')
 REPLACEMENT_WAN_IP = ''
 
+# Number of Tautulli requests (user IP tables, GeoIP lookups) made at the same time
+WORKERS = 10
+
 # Enter Friendly name for Server ie 'John Smith'
 SERVER_FRIENDLY = 'Server'
 
@@ -80,6 +87,10 @@ PLATFORM_COLORS = {'Android': '#a4c639',  # Green
 # title of map
 title_string = "Location of Plex users based on ISP data"
 
+# Local cache of get_geoip_lookup results, see jbops/cache.py
+geoip_cache = GeoIPCache()
+tautulli_server = Tautulli(TAUTULLI_URL, TAUTULLI_APIKEY, pool_size=WORKERS)
+
 
 def clean_up_text(title):
     cleaned = re.sub('\W+', ' ', title)
@@ -141,126 +152,154 @@ def get_users_tables(users='', length=''):
 
 def get_users_ips(user_id, length):
     # Get the user IP list from Tautulli
-    payload = {'apikey': TAUTULLI_APIKEY,
-               'cmd': 'get_user_ips',
-               'user_id': user_id}
-
     try:
-        r = requests.get(TAUTULLI_URL.rstrip('/') + '/api/v2', params=payload)
-        response = r.json()
-        res_data = response['response']['data']['data']
+        res_data = tautulli_server.get_user_ips(user_id)['data']
         return [UserIPs(data=d) for d in res_data]
     except Exception as e:
         sys.stderr.write("Tautulli API 'get_users_ips' request failed: {0}.".format(e))
 
 
 def get_geoip_info(ip_address=''):
-    # Get the geo IP lookup from Tautulli
-    payload = {'apikey': TAUTULLI_APIKEY,
-               'cmd': 'get_geoip_lookup',
-               'ip_address': ip_address}
-
+    # Get the geo IP lookup from the local cache or Tautulli
     try:
-        r = requests.get(TAUTULLI_URL.rstrip('/') + '/api/v2', params=payload)
-        response = r.json()
-        if response['response']['result'] == 'success':
-            data = response['response']['data']
-            if data.get('error'):
-                raise Exception(data['error'])
-            else:
-                sys.stdout.write("Successfully retrieved geolocation data.")
-                return GeoData(data=data)
+        data = geoip_cache.get_geoip_lookup(ip_address, tautulli_server.get_geoip_lookup)
+        if not data:
+            raise Exception('no data returned')
+        elif data.get('error'):
+            raise Exception(data['error'])
         else:
-            raise Exception(response['response']['message'])
+            return GeoData(data=data)
     except Exception as e:
         sys.stderr.write("Tautulli API 'get_geoip_lookup' request failed: {0}.".format(e))
         pass
 
 
-def add_to_dictlist(d, key, val):
+def get_geoip_infos(ip_addresses):
+    # Look up each distinct IP address once, cache misses are requested concurrently
+    return dict(fetch_all(get_geoip_info, set(ip_addresses), WORKERS))
+
+
+def add_to_dictlist(d, key, val, locations):
+    # locations indexes each user's entries by (region, city) so counting them does not rescan the list
     if key not in d:
         d[key] = [val]
     else:
         d[key].append(val)
-    for x in d[key]:
-        if (val['region'], val['city']) == (x['region'], x['city']):
-            x['location_count'] += 1
+    locations.setdefault((key, val['region'], val['city']), []).append(val)
+
+
+def count_locations(locations):
+    # Number of entries from the same (region, city) added from each entry onwards
+    for same_location in locations.values():
+        for i, val in enumerate(same_location):
+            val['location_count'] = len(same_location) - i
 
 
 def get_geo_dict(length, users):
     geo_dict = {SERVER_FRIENDLY: [{'lon': SERVER_LON, 'lat': SERVER_LAT, 'city': SERVER_CITY, 'region': SERVER_STATE,
                                    'ip': REPLACEMENT_WAN_IP, 'play_count': 0, 'platform': SERVER_PLATFORM,
                                    'location_count': 0}]}
-
-    for i in get_users_tables(users):
-        user_ip = get_users_ips(user_id=i, length=length)
-        city_cnt = 0
-        for a in user_ip:
-            try:
-                ip = a.ip_address
-                if ip.startswith(LAN_SUBNET) and REPLACEMENT_WAN_IP:
-                    ip = REPLACEMENT_WAN_IP
-
-                g = get_geoip_info(ip_address=ip)
-
-                add_to_dictlist(geo_dict, a.friendly_name, {'lon': str(g.longitude), 'lat': str(g.latitude),
-                                                            'city': str(g.city), 'region': str(g.region),
-                                                            'ip': ip, 'play_count': a.play_count,
-                                                            'platform': a.platform, 'location_count': city_cnt})
-            except AttributeError:
-                print('User: {} IP: {} caused error in geo_dict.'.format(a.friendly_name, a.ip_address))
-                pass
-            except Exception as e:
-                print('Error here: {}'.format(e))
-                pass
+    locations = {}
+
+    # Fetch the users' IP tables concurrently, in user order
+    user_ips = []
+    for _, ips in fetch_all(lambda user_id: get_users_ips(user_id=user_id, length=length),
+                            get_users_tables(users), WORKERS):
+        user_ips += ips or []
+
+    def lookup_ip(user_ip):
+        if user_ip.ip_address.startswith(LAN_SUBNET) and REPLACEMENT_WAN_IP:
+            return REPLACEMENT_WAN_IP
+        return user_ip.ip_address
+
+    geo_info = get_geoip_infos(lookup_ip(a) for a in user_ips)
+
+    for a in user_ips:
+        try:
+            ip = lookup_ip(a)
+            g = geo_info[ip]
+
+            add_to_dictlist(geo_dict, a.friendly_name, {'lon': str(g.longitude), 'lat': str(g.latitude),
+                                                        'city': str(g.city), 'region': str(g.region),
+                                                        'ip': ip, 'play_count': a.play_count,
+                                                        'platform': a.platform, 'location_count': 0},
+                            locations)
+        except AttributeError:
+            print('User: {} IP: {} caused error in geo_dict.'.format(a.friendly_name, a.ip_address))
+            pass
+        except Exception as e:
+            print('Error here: {}'.format(e))
+            pass
+
+    count_locations(locations)
     return geo_dict
 
 
-def get_geojson_dict(user_locations):
-    locs = []
+def get_geojson_features(user_locations):
+    # Yield the GeoJSON features one at a time, a point and a line to the server per location
     for username, locations in user_locations.items():
         for location in locations:
             try:
-                locs.append({
-                    "type": "Feature",
-                    "properties": {
-                        "User": username,
-                        "City": location['city'],
-                        "State": location['region'],
-                        "IP": location['ip'],
-                        "Count": location['play_count']
-                    },
-                    "geometry": {
-                        "type": "Point",
-                        "coordinates": [
-                            float(location['lon']), float(location['lat'])
-                        ]
-                    }
-                })
-
-                locs.append({
-                    "type": "Feature",
-                    "properties": {
-                        "geodesic": "true",
-                        "geodesic_steps": 50,
-                        "geodesic_wrap": "true"
-                    },
-                    "geometry": {
-                        "type": "LineString",
-                        "coordinates": [
-                            [float(location['lon']), float(location['lat'])],
-                            [float(SERVER_LON), float(SERVER_LAT)],
-                        ]
-                    }
-                })
+                lon, lat = float(location['lon']), float(location['lat'])
             except ValueError:
-                pass
+                continue
+
+            yield {
+                "type": "Feature",
+                "properties": {
+                    "User": username,
+                    "City": location['city'],
+                    "State": location['region'],
+                    "IP": location['ip'],
+                    "Count": location['play_count']
+                },
+                "geometry": {
+                    "type": "Point",
+                    "coordinates": [
+                        lon, lat
+                    ]
+                }
+            }
+
+            try:
+                server_lon, server_lat = float(SERVER_LON), float(SERVER_LAT)
+            except ValueError:
+                continue
+
+            yield {
+                "type": "Feature",
+                "properties": {
+                    "geodesic": "true",
+                    "geodesic_steps": 50,
+                    "geodesic_wrap": "true"
+                },
+                "geometry": {
+                    "type": "LineString",
+                    "coordinates": [
+                        [lon, lat],
+                        [server_lon, server_lat],
+                    ]
+                }
+            }
+
+
+def get_geojson_dict(user_locations):
     return {
         "type": "FeatureCollection",
-        "features": locs
+        "features": list(get_geojson_features(user_locations))
     }
 
 
+def write_geojson(user_locations, fp):
+    # Write the FeatureCollection feature by feature instead of building it in memory
+    fp.write('{"type": "FeatureCollection", "features": [\n')
+    for i, feature in enumerate(get_geojson_features(user_locations)):
+        if i:
+            fp.write(',\n')
+        fp.write(json.dumps(feature, sort_keys=True))
+    fp.write('\n]}\n')
+
+
 def draw_map(map_type, geo_dict, filename, headless, leg_choice):
     import matplotlib as mpl
     if headless:
@@ -435,11 +474,10 @@ if __name__ == '__main__':
             json.dump(geo_json, fp, indent=4, sort_keys=True)
 
     if opts.map == 'Geo':
-        geojson = get_geojson_dict(geo_json)
         print("\n")
         geojson_file = '{}.geojson'.format(''.join(opts.filename))
         with open(geojson_file, 'w') as fp:
-            json.dump(geojson, fp, indent=4, sort_keys=True)
+            write_geojson(geo_json, fp)
 
     else:
         draw_map(opts.map, geo_json, filename, opts.headless, opts.legend)
@@ -14,6 +14,10 @@ from builtins import str
 import requests
 import sys
 import time
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from jbops.tautulli import Tautulli  # noqa: E402
 
 TFRAME = 1.577e+7  # ~ 6 months in seconds
 TODAY = time.time()
@@ -26,6 +30,10 @@ SUBJECT_TEXT = "Tautulli Notification"
 NOTIFIER_ID = 12  # The email notification agent ID for Tautulli
 
 
+# get_metadata results are kept in the local metadata cache, see jbops/cache.py
+tautulli_server = Tautulli(TAUTULLI_URL, TAUTULLI_APIKEY, cache=True)
+
+
 class LIBINFO(object):
     def __init__(self, data=None):
         d = data or {}
@@ -74,16 +82,10 @@ def get_new_rating_keys(rating_key, media_type):
         sys.stderr.write("Tautulli API 'get_new_rating_keys' request failed: {0}.".format(e))
 
 
-def get_metadata(rating_key):
-    # Get the metadata for a media item.
-    payload = {'apikey': TAUTULLI_APIKEY,
-               'rating_key': rating_key,
-               'cmd': 'get_metadata'}
-
+def get_metadata(rating_key, updated_at=None):
+    # Get the metadata for a media item, refetched when updated_at is newer than the cached copy.
     try:
-        r = requests.get(TAUTULLI_URL.rstrip('/') + '/api/v2', params=payload)
-        response = r.json()
-        res_data = response['response']['data']
+        res_data = tautulli_server.get_metadata(rating_key, updated_at)
         return METAINFO(data=res_data)
 
     except Exception as e:
@@ -152,6 +154,8 @@ def send_notification(body_text):
 
 
 show_lst = []
+# Library rows have no updated_at, their added_at still marks older cached copies as stale
+movie_added_at = {}
 notify_lst = []
 
 libraries = [lib for lib in get_libraries_table()]
@@ -167,6 +171,7 @@ for library in libraries:
                 else:
                     # Find movie rating_key.
                     show_lst += [int(lib.rating_key)]
+                    movie_added_at[int(lib.rating_key)] = lib.added_at
             except Exception as e:
                 print("Rating_key failed: {e}".format(e=e))
 
@@ -175,7 +180,7 @@ for library in libraries:
 
 for show in show_lst:
     try:
-        meta = get_metadata(str(show))
+        meta = get_metadata(str(show), movie_added_at.get(show))
         added = time.ctime(float(meta.added_at))
         if meta.grandparent_title == '' or meta.media_type == 'movie':
             # Movies
@@ -25,8 +25,13 @@ from email.mime.text import MIMEText
 import email.utils
 import smtplib
 import sys
+import os
 import argparse
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from jbops.tautulli import Tautulli  # noqa: E402
+from jbops.history import HistoryStore  # noqa: E402
+
 # ## EDIT THESE SETTINGS ##
 TAUTULLI_APIKEY = 'XXXXXXX'  # Your Tautulli API key
 TAUTULLI_URL = 'http://localhost:8181/'  # Your Tautulli URL
@@ -81,22 +86,15 @@ def get_user(user_id):
 
 
 def get_history(showkey):
-    """Get the user history from Tautulli.
+    """Get the user history of a show.
 
-    Length matters!
+    Syncs the local copy of the Tautulli history first, so all plays are counted.
     """
-    payload = {'apikey': TAUTULLI_APIKEY,
-               'cmd': 'get_history',
-               'grandparent_rating_key': showkey,
-               'length': 10000}
-
     try:
-        r = requests.get(TAUTULLI_URL.rstrip('/') + '/api/v2', params=payload)
-        response = r.json()
-        res_data = response['response']['data']['data']
-        return [UserHIS(data=d) for d in res_data
-                if d['watched_status'] == 1 and
-                d['media_type'].lower() in ('episode', 'show')]
+        history = HistoryStore()
+        history.sync(Tautulli(TAUTULLI_URL, TAUTULLI_APIKEY))
+        return [UserHIS(data=d) for d in history.query(grandparent_rating_key=showkey, watched=True,
+                                                       media_type=('episode', 'show'), grouping=True)]
 
     except Exception as e:
         sys.stderr.write("Tautulli API 'get_history' request failed: {0}.".format(e))
@@ -15,6 +15,10 @@ from builtins import object
 import requests
 import sys
 import time
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from jbops.tautulli import Tautulli  # noqa: E402
 
 STARTFRAME = 1480550400  # 2016, Dec 1 in seconds
 ENDFRAME = 1488326400  # 2017, March 1 in seconds
@@ -32,6 +36,10 @@ TAUTULLI_URL = 'http://localhost:8181/'  # Your Tautulli URL
 LIBRARY_NAMES = ['TV Shows', 'Movies']  # Names of your libraries you want to check.
 
 
+# get_metadata results are kept in the local metadata cache, see jbops/cache.py
+tautulli_server = Tautulli(TAUTULLI_URL, TAUTULLI_APIKEY, cache=True)
+
+
 class LIBINFO(object):
     def __init__(self, data=None):
         d = data or {}
@@ -95,18 +103,10 @@ def get_library_media_info(section_id):
         sys.stderr.write("Tautulli API 'get_library_media_info' request failed: {0}.".format(e))
 
 
-def get_metadata(rating_key):
-    # Get the metadata for a media item.
-    payload = {'apikey': TAUTULLI_APIKEY,
-               'rating_key': rating_key,
-               'cmd': 'get_metadata',
-               'media_info': True}
-
+def get_metadata(rating_key, updated_at=None):
+    # Get the metadata for a media item, refetched when updated_at is newer than the cached copy.
     try:
-        r = requests.get(TAUTULLI_URL.rstrip('/') + '/api/v2', params=payload)
-        response = r.json()
-
-        res_data = response['response']['data']
+        res_data = tautulli_server.get_metadata(rating_key, updated_at)
         if STARTFRAME <= int(res_data['added_at']) <= ENDFRAME:
             return METAINFO(data=res_data)
 
@@ -148,6 +148,8 @@ def get_libraries_table():
 
 
 show_lst = []
+# Library rows have no updated_at, their added_at still marks older cached copies as stale
+movie_added_at = {}
 count_lst = []
 size_lst = []
 
@@ -167,6 +169,7 @@ for i in glt:
                 else:
                     # Find movie rating_key.
                     show_lst += [int(x.rating_key)]
+                    movie_added_at[int(x.rating_key)] = x.added_at
             except Exception as e:
                 print(("Rating_key failed: {e}").format(e=e))
 
@@ -179,7 +182,7 @@ for i in glt:
 
 for i in sorted(show_lst, reverse=True):
     try:
-        x = get_metadata(str(i))
+        x = get_metadata(str(i), movie_added_at.get(i))
         added = time.ctime(float(x.added_at))
         count_lst += [x.media_type]
         size_lst += [int(x.file_size)]
@@ -9,12 +9,22 @@ Description: Comparing content between two or more Plex servers.
                       items found in server 1, server 2, etc
                       items unique to server 1
                       items missing from server 1
+              --ndjson writes one line per item instead:
+                  {"item": {..}, "list": "missing", "media_type": "movie"}
 Author: Blacktwin
 Requires: requests, plexapi
 
  Example:
     python find_diff_other_servers.py --server "My Plex Server" --server PlexServer2
     python find_diff_other_servers.py --server "My Plex Server" --server PlexServer2 --server "Steven Plex"
+    python find_diff_other_servers.py --server "My Plex Server" --server PlexServer2 --ndjson
+    python find_diff_other_servers.py --server "My Plex Server" --server PlexServer2 --snapshot
+    python find_diff_other_servers.py --server "My Plex Server" --server PlexServer2 --snapshot --noRefresh
+
+ --snapshot keeps each server's inventory in a local SQLite file (see jbops/cache.py
+ for the folder). Later runs only list the items added or updated since, so repeat
+ comparisons are quick. --noRefresh compares the stored snapshots without
+ contacting the servers.
 
 """
 from __future__ import print_function
@@ -23,9 +33,15 @@ from __future__ import unicode_literals
 import argparse
 import requests
 import json
+import os
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from plexapi.server import PlexServer, CONFIG
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from jbops.cache import cache_path  # noqa: E402
+from jbops.snapshot import LibrarySnapshot  # noqa: E402
+
 TAUTULLI_URL = ''
 TAUTULLI_APIKEY = ''
 TAUTULLI_URL = CONFIG.data['auth'].get('tautulli_baseurl', TAUTULLI_URL)
@@ -39,6 +55,13 @@ PLEX_TOKEN = CONFIG.data['auth'].get('server_token', PLEX_TOKEN)
 # Sections to ignore from comparision.
 IGNORE_LST = ['Library name']
 
+# External ids used to match items between servers, legacy agent names mapped to their id source.
+GUID_SOURCES = {'imdb': 'imdb',
+                'tmdb': 'tmdb',
+                'themoviedb': 'tmdb',
+                'tvdb': 'tvdb',
+                'thetvdb': 'tvdb'}
+
 sess = requests.Session()
 # Ignore verifying the SSL certificate
 sess.verify = False  # '/path/to/certfile'
@@ -58,10 +81,9 @@ SERVER_DICT = {server.name: server for server in
                if 'server' in server.provides.split(',')}
 
 shared_lst = []
-server_lst = []
 
 
-def find_things(server, media_type):
+def find_things(server, media_type, fetch_items=False):
     """Get all items based on media type
 
     Parameters
@@ -70,11 +92,13 @@ def find_things(server, media_type):
         plexServerObject
     media_type: list
         ['movie', 'show', ..]
+    fetch_items: bool
+        Fetch every item's full metadata instead of using the library listing.
 
     Returns
     -------
     dictionary
-        {media_type:[plexObject, ..]}
+        {media_type:[(title_key, guids, meta_dict), ..]}, see get_record
 
     """
 
@@ -82,12 +106,58 @@ def find_things(server, media_type):
     print('Finding items from {}.'.format(server.friendlyName))
     for section in server.library.sections():
         if section.title not in IGNORE_LST and section.type in media_type:
-            for item in server.library.section(section.title).all():
-                dict_tt[section.type].append(server.fetchItem(item.ratingKey))
+            for item in section.all(includeGuids=True):
+                if fetch_items:
+                    item = server.fetchItem(item.ratingKey)
+                else:
+                    # The listing has the genres, guids, rating and year compared,
+                    # don't reload the item when one of them is empty.
+                    item._autoReload = False
+                dict_tt[section.type].append(get_record(item))
 
     return dict_tt
 
 
+def get_guids(item):
+    """Get the external ids of a Plex item.
+
+    Parameters
+    ----------
+    item: Object
+        plexObject
+
+    Returns
+    -------
+    dictionary
+        {"imdb": "tt5158522", "tmdb": "369972", ..}
+    """
+    guids = {}
+    for guid in getattr(item, 'guids', None) or []:
+        # New agents list every id (imdb://tt4302938)
+        source, _, source_id = guid.id.partition('://')
+        if source in GUID_SOURCES:
+            guids[GUID_SOURCES[source]] = source_id
+    if item.guid and '://' in item.guid:
+        # Legacy agents (com.plexapp.agents.thetvdb://79349?lang=en)
+        agent, _, source_id = item.guid.partition('://')
+        source = agent.split('.')[-1]
+        if source in GUID_SOURCES:
+            guids.setdefault(GUID_SOURCES[source], source_id.split('?')[0].split('/')[0])
+
+    return guids
+
+
+def guids_conflict(guids, other_guids):
+    """True if both items have an id from the same source and the ids differ."""
+    return any(guids[source] != source_id for source, source_id in other_guids.items()
+               if source in guids)
+
+
+def thumb_url(server, thumb):
+    """URL of a thumb path on a server, with the server's token."""
+    return '{}{}?X-Plex-Token={}'.format(server._baseurl, thumb, server._token)
+
+
 def get_meta(meta):
     """Get metadata from Plex item.
     Parameters
@@ -105,15 +175,12 @@ def get_meta(meta):
         "title": "Title"
         }
     """
-    thumb_url = '{}{}?X-Plex-Token={}'.format(
-        meta._server._baseurl, meta.thumb, meta._server._token)
-
     meta_dict = {'title': meta.title,
                  'rating': meta.rating if
                  meta.rating is not None else 0.0,
                  'genres': [x.tag for x in meta.genres],
                  'server': [meta._server.friendlyName],
-                 'thumb': [thumb_url]
+                 'thumb': [thumb_url(meta._server, meta.thumb)]
                  }
     if meta.guid:
         # guid will return (com.plexapp.agents.imdb://tt4302938?lang=en)
@@ -122,6 +189,7 @@ def get_meta(meta):
         source_name = agent.split('://')[0].split('.')[-1]
         source_id = agent.split('://')[1].split('?')[0]
         meta_dict[source_name] = source_id
+    meta_dict.update(get_guids(meta))
 
     if meta.type == 'movie':
         # For movies with same titles
@@ -129,7 +197,76 @@ def get_meta(meta):
     return meta_dict
 
 
-def org_diff(lst_dicts, media_type, main_server):
+def get_record(item):
+    """Compact record of a Plex item, the Plex object is not kept.
+
+    Parameters
+    ----------
+    item: Object
+        plexObject
+
+    Returns
+    -------
+    tuple
+        ('title://title (year)', {"imdb": "tt5158522", ..}, get_meta dictionary)
+    """
+    title_key = u'title://{} ({})'.format(item.title, item.year).lower()
+
+    return title_key, get_guids(item), get_meta(item)
+
+
+class InventorySnapshot(LibrarySnapshot):
+    """Local copy of a server's compared library items, see jbops/snapshot.py."""
+    COLUMNS = (('media_type', 'TEXT'), ('title_key', 'TEXT'), ('guids', 'TEXT'), ('meta', 'TEXT'))
+    SEARCH_KWARGS = {'includeGuids': True}
+
+    def __init__(self, client_identifier):
+        super(InventorySnapshot, self).__init__(cache_path('server_compare_{}.db'.format(client_identifier)))
+
+    def refresh_sections(self, server, media_type):
+        """Refresh the snapshot of every compared section of a server.
+
+        Parameters
+        ----------
+        server: Object
+            plexServerObject
+        media_type: list
+            ['movie', 'show', ..]
+        """
+        print('Refreshing snapshot of {}.'.format(server.friendlyName))
+        for section in server.library.sections():
+            if section.title not in IGNORE_LST and section.type in media_type:
+                self.refresh(section)
+
+    def row(self, section, item):
+        title_key, guids, meta = get_record(item)
+        # The thumb URL holds the server's token, only its path is written to disk
+        meta['thumb'] = [item.thumb]
+
+        return section.type, title_key, json.dumps(guids), json.dumps(meta)
+
+    def inventory(self, media_type, server=None):
+        """Get the snapshot's items like find_things.
+
+        Parameters
+        ----------
+        media_type: list
+            ['movie', 'show', ..]
+        server: Object
+            plexServerObject used to turn thumb paths back into URLs, None to keep the paths.
+        """
+        dict_tt = {name: [] for name in media_type}
+        for row in self.items():
+            if row['media_type'] in dict_tt:
+                meta = json.loads(row['meta'])
+                if server is not None:
+                    meta['thumb'] = [thumb_url(server, path) for path in meta['thumb']]
+                dict_tt[row['media_type']].append((row['title_key'], json.loads(row['guids']), meta))
+
+        return dict_tt
+
+
+def org_diff(lst_dicts, media_type, main_server, fp=None):
     """Organizing the items from each server
 
     Parameters
@@ -137,9 +274,13 @@ def org_diff(lst_dicts, media_type, main_server):
     media_type: list
         ['movie', 'show',..]
     lst_dicts: list
-        [{media_type:[plexObject, ..]}, {media_type: [..]}]
+        [{media_type:[record, ..]}, {media_type: [..]}], see get_record
+        Each server's records are removed once they are combined.
     main_server: str
         'Plex Server Name'
+    fp: file
+        Write each media type to fp with write_ndjson as soon as it is
+        combined instead of returning it.
 
     Returns
     -------
@@ -165,33 +306,38 @@ def org_diff(lst_dicts, media_type, main_server):
 
     for mtype in media_type:
         meta_lst = []
-        seen = {}
+        # External ids found for each item of meta_lst
+        meta_guids = []
+        # 'source://id' and 'title://title (year)' keys to the item's position in meta_lst
+        index = {}
         missing = []
         unique = []
         print('...combining {}s'.format(mtype))
         for server_lst in lst_dicts:
-            for item in server_lst[mtype]:
-                if mtype == 'movie':
-                    title = u'{} ({})'.format(item.title, item.year)
+            for title_key, guids, item_meta in server_lst.pop(mtype):
+                # Match on external ids, title and year only when the ids don't disagree
+                position = next((index[key] for key in
+                                 ('{}://{}'.format(source, source_id) for source, source_id in guids.items())
+                                 if key in index), None)
+                if position is None and title_key in index and \
+                        not guids_conflict(meta_guids[index[title_key]], guids):
+                    position = index[title_key]
+
+                if position is None:
+                    position = len(meta_lst)
+                    meta_lst.append(item_meta)
+                    meta_guids.append({})
+                    index.setdefault(title_key, position)
                 else:
-                    title = item.title
+                    # Duplicate found, append the duplicate server's name
+                    meta = meta_lst[position]
+                    meta['server'] += item_meta['server']
+                    meta['thumb'] += item_meta['thumb']
+
+                for source, source_id in guids.items():
+                    meta_guids[position].setdefault(source, source_id)
+                    index.setdefault('{}://{}'.format(source, source_id), position)
 
-                # Look for duplicate titles
-                if title not in seen:
-                    seen[title] = 1
-                    meta_lst.append(get_meta(item))
-                else:
-                    # Duplicate found
-                    if seen[title] >= 1:
-                        # Go back through list to find original
-                        for meta in meta_lst:
-                            if meta['title'] == title:
-                                # Append the duplicate server's name
-                                meta['server'].append(item._server.friendlyName)
-                                thumb_url = '{}{}?X-Plex-Token={}'.format(
-                                    item._server._baseurl, item.thumb, item._server._token)
-                                meta['thumb'].append(thumb_url)
-                    seen[title] += 1
         # Sort item list by Plex rating
         # Duplicates will use originals rating
         meta_lst = sorted(meta_lst, key=lambda d: d['rating'], reverse=True)
@@ -218,9 +364,65 @@ def org_diff(lst_dicts, media_type, main_server):
             'count': len(unique),
             'list': unique}})
 
+        if fp is not None:
+            # Only one media type is held at a time
+            write_ndjson({mtype: diff_dict.pop(mtype)}, fp)
+
     return diff_dict
 
 
+def write_ndjson(diff_dict, fp):
+    """Write the diff one item per line.
+
+    Parameters
+    ----------
+    diff_dict: dictionary
+        org_diff results
+    fp: file
+        File to write to.
+    """
+    for mtype, lists in diff_dict.items():
+        for name, found in lists.items():
+            for item in found['list']:
+                fp.write(json.dumps({'media_type': mtype, 'list': name, 'item': item}, sort_keys=True) + '\n')
+
+
+def connect(server):
+    """Connect to a server, None when it fails."""
+    try:
+        server_connected = SERVER_DICT[server].connect()
+        print('Connected to {} server.'.format(server_connected.friendlyName))
+        return server_connected
+    except Exception as e:
+        sys.stderr.write("Error: {}.\nSkipping...\n".format(e))
+
+
+def snapshot_things(server, connection, media_type):
+    """Get all items from a server's snapshot, refreshing it first when connected.
+
+    Parameters
+    ----------
+    server: str
+        'Plex Server Name'
+    connection: Object
+        plexServerObject, None to use the stored snapshot as is.
+    media_type: list
+        ['movie', 'show', ..]
+
+    Returns
+    -------
+    dictionary
+        {media_type:[(title_key, guids, meta_dict), ..]}, see get_record
+    """
+    snapshot = InventorySnapshot(SERVER_DICT[server].clientIdentifier)
+    try:
+        if connection is not None:
+            snapshot.refresh_sections(connection, media_type)
+        return snapshot.inventory(media_type, connection)
+    finally:
+        snapshot.close()
+
+
 if __name__ == "__main__":
 
     parser = argparse.ArgumentParser(
@@ -235,50 +437,63 @@ if __name__ == "__main__":
                         help='Choose media type(s) to compare.'
                              '\nDefault: (%(default)s)'
                              '\nChoices: (%(choices)s)')
+    parser.add_argument('--fetchItems', action='store_true',
+                        help='Fetch the full metadata of every item instead of using the library listings.\n'
+                             'Slower, one request per item.')
+    parser.add_argument('--ndjson', action='store_true',
+                        help='Write the diff as one JSON item per line (.ndjson).')
+    parser.add_argument('--snapshot', action='store_true',
+                        help='Compare local snapshots of the servers, only listing items added or updated '
+                             'since the last run.')
+    parser.add_argument('--noRefresh', action='store_true',
+                        help='With --snapshot, compare the stored snapshots without contacting the servers.')
     # todo-me add media_type [x], library_ignore[], media filters (genre, etc.) []
 
     opts = parser.parse_args()
-    combined_lst = []
 
     if len(opts.server) < 2:
         sys.stderr.write("Need more than one server to compare.\n")
         sys.exit(1)
 
-    server_compare = SERVER_DICT[opts.server[0]]
-    # First server in args is main server.
-    main_server = server_compare.connect()
-    print('Connected to {} server.'.format(main_server.friendlyName))
-
-    for server in opts.server[1:]:
-        other_server = SERVER_DICT[server]
-        # Attempt to connect to other servers
-        try:
-            server_connected = other_server.connect()
-            print('Connected to {} server.'.format(
-                server_connected.friendlyName))
-            server_lst.append(server_connected)
-        except Exception as e:
-            sys.stderr.write("Error: {}.\nSkipping...\n".format(e))
-            pass
-
-    if len(server_lst) == 0:
+    if opts.snapshot and opts.noRefresh:
+        connections = [None] * len(opts.server)
+        names = list(opts.server)
+    else:
+        # Connect to every server at the same time
+        with ThreadPoolExecutor(max_workers=len(opts.server)) as executor:
+            connections = list(executor.map(connect, opts.server))
+
+        # First server in args is main server.
+        if connections[0] is None:
+            sys.exit(1)
+        names = [connection.friendlyName if connection is not None else None for connection in connections]
+
+    # Servers that failed to connect are skipped
+    server_lst = [(server, name, connection) for server, name, connection in zip(opts.server, names, connections)
+                  if name is not None]
+    main_server = server_lst[0][1]
+    servers = [name for server, name, connection in server_lst[1:]]
+
+    if len(servers) == 0:
         sys.stderr.write("Need more than one server to compare.\n")
         sys.exit(1)
 
-    combined_lst.append(find_things(main_server, opts.media_type))
-
-    servers = [server.friendlyName for server in server_lst]
-
-    for connection in server_lst:
-        combined_lst.append(find_things(connection, opts.media_type))
+    # List every server at the same time, main server first
+    with ThreadPoolExecutor(max_workers=len(server_lst)) as executor:
+        if opts.snapshot:
+            combined_lst = list(executor.map(lambda x: snapshot_things(x[0], x[2], opts.media_type), server_lst))
+        else:
+            combined_lst = list(executor.map(lambda x: find_things(x[2], opts.media_type, opts.fetchItems),
+                                             server_lst))
 
     print('Combining findings from {} and {}'.format(
-        main_server.friendlyName, ' and '.join(servers)))
-
-    main_dict = org_diff(combined_lst, opts.media_type, main_server.friendlyName)
+        main_server, ' and '.join(servers)))
 
-    filename = 'diff_{}_{}_servers.json'.format(
-        opts.server[0], '_'.join(servers))
+    filename = 'diff_{}_{}_servers.{}'.format(
+        opts.server[0], '_'.join(servers), 'ndjson' if opts.ndjson else 'json')
 
     with open(filename, 'w') as fp:
-        json.dump(main_dict, fp, indent=4, sort_keys=True)
+        if opts.ndjson:
+            org_diff(combined_lst, opts.media_type, main_server, fp)
+        else:
+            json.dump(org_diff(combined_lst, opts.media_type, main_server), fp, indent=4, sort_keys=True)
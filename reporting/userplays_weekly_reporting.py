@@ -10,8 +10,13 @@ from __future__ import unicode_literals
 from builtins import object
 import requests
 import sys
+import os
 import time
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from jbops.tautulli import Tautulli  # noqa: E402
+from jbops.history import HistoryStore  # noqa: E402
+
 TODAY = int(time.time())
 LASTWEEK = int(TODAY - 7 * 24 * 60 * 60)
 
@@ -36,18 +41,12 @@ class UserHIS(object):
 
 
 def get_history():
-    # Get the Tautulli history. Count matters!!!
-    payload = {'apikey': TAUTULLI_APIKEY,
-               'cmd': 'get_history',
-               'length': 100000}
-
+    # Sync the local copy of the Tautulli history, then read this week's plays from it.
     try:
-        r = requests.get(TAUTULLI_URL.rstrip('/') + '/api/v2', params=payload)
-        response = r.json()
-
-        res_data = response['response']['data']['data']
-        return [UserHIS(data=d) for d in res_data if d['watched_status'] == 1 and
-                LASTWEEK < d['date'] < TODAY]
+        history = HistoryStore()
+        history.sync(Tautulli(TAUTULLI_URL, TAUTULLI_APIKEY))
+        plays = history.query(watched=True, after=LASTWEEK + 1, before=TODAY, grouping=True)
+        return [UserHIS(data=d) for d in plays]
 
     except Exception as e:
         sys.stderr.write("Tautulli API 'get_history' request failed: {0}.".format(e))
@@ -4,14 +4,25 @@
 from __future__ import print_function
 from __future__ import unicode_literals
 from builtins import object
+import os
+import sys
 import time
+import csv
+import json
 import argparse
+import threading
+from functools import partial
+import numpy as np
 from plexapi.myplex import MyPlexAccount
 from plexapi.server import PlexServer
 from plexapi.server import CONFIG
-from requests import Session
-from requests.adapters import HTTPAdapter
-from requests.exceptions import RequestException
+from plexapi import utils
+from plexapi.exceptions import NotFound
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from jbops.tautulli import Tautulli as TautulliClient  # noqa: E402
+from jbops.tautulli import fetch_all, paginate, pooled_session  # noqa: E402
+from jbops.cache import KeyValueCache, cache_path  # noqa: E402
 
 # Using CONFIG file
 PLEX_URL = ''
@@ -38,28 +49,15 @@ if not TAUTULLI_APIKEY:
     TAUTULLI_APIKEY = CONFIG.data['auth'].get('tautulli_apikey')
 
 VERIFY_SSL = False
+# Seconds to keep the collection and show title indexes on disk, 0 keeps them for one run only
+INDEX_TTL = 0
 
 timestr = time.strftime("%Y%m%d-%H%M%S")
 
-
-class Connection(object):
-    def __init__(self, url=None, apikey=None, verify_ssl=False):
-        self.url = url
-        self.apikey = apikey
-        self.session = Session()
-        self.adapters = HTTPAdapter(max_retries=3,
-                                    pool_connections=1,
-                                    pool_maxsize=1,
-                                    pool_block=True)
-        self.session.mount('http://', self.adapters)
-        self.session.mount('https://', self.adapters)
-
-        # Ignore verifying the SSL certificate
-        if verify_ssl is False:
-            self.session.verify = False
-            # Disable the warning that the request is insecure, we know that...
-            import urllib3
-            urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+# Item type counted for each section type
+SECTION_LIBTYPES = {'movie': 'movie', 'show': 'episode'}
+# Users counted at the same time
+USER_WORKERS = 8
 
 
 class Library(object):
@@ -77,66 +75,100 @@ class Library(object):
             pass
 
 
-class Tautulli(object):
-    def __init__(self, connection):
-        self.connection = connection
+class Source(object):
+    def __init__(self, kind, name, total, count, verb='watched'):
+        """A library, collection or show users are compared on.
+
+        Parameters
+        ----------
+        kind: str
+            Printed before the name (Section, Collection, Show)
+        name: str
+        total: int
+            Number of items
+        count: func
+            count(user) returns the number of items the user watched
+        verb: str
+            Printed in the report, e.g. listened for music
+        """
+        self.kind = kind
+        self.name = name
+        self.total = total
+        self.count = count
+        self.verb = verb
+
 
-    def _call_api(self, cmd, payload, method='GET'):
-        payload['cmd'] = cmd
-        payload['apikey'] = self.connection.apikey
+class Tautulli(TautulliClient):
+    def watched_count(self, user, section_id):
+        """Number of distinct items a user watched in a section"""
+        return len(set(d['rating_key'] for d in paginate(self.get_history, user=user, section_id=section_id)
+                       if d['watched_status'] == 1))
 
-        try:
-            response = self.connection.session.request(method, self.connection.url + '/api/v2', params=payload)
-        except RequestException as e:
-            print("Tautulli request failed for cmd '{}'. Invalid Tautulli URL? Error: {}".format(cmd, e))
-            return
 
-        try:
-            response_json = response.json()
-        except ValueError:
-            print("Failed to parse json response for Tautulli API cmd '{}'".format(cmd))
-            return
+def count_items(server, section, libtype=None, **filters):
+    """Count a section's items without listing them.
 
-        if response_json['response']['result'] == 'success':
-            return response_json['response']['data']
-        else:
-            error_msg = response_json['response']['message']
-            print("Tautulli API cmd '{}' failed: {}".format(cmd, error_msg))
-            return
+    Requests an empty page and reads the container's totalSize.
 
-    def get_watched_history(self, user=None, section_id=None, rating_key=None, start=None, length=None):
-        """Call Tautulli's get_history api endpoint"""
-        payload = {"order_column": "full_title",
-                   "order_dir": "asc"}
-        if user:
-            payload["user"] = user
-        if section_id:
-            payload["section_id"] = section_id
-        if rating_key:
-            payload["rating_key"] = rating_key
-        if start:
-            payload["start"] = start
-        if length:
-            payload["lengh"] = length
+    Parameters
+    ----------
+    server: obj
+        PlexServer, a user's server counts that user's watch status
+    section: obj
+        Library section
+    libtype: str
+        Item type to count, defaults to the section type
+    filters: dict
+        Plex filters, e.g. unwatched=0
 
-        history = self._call_api('get_history', payload)
+    Returns
+    -------
+    int
+    """
+    args = {'type': utils.searchType(libtype or section.type),
+            'X-Plex-Container-Start': 0,
+            'X-Plex-Container-Size': 0}
+    args.update(filters)
+    data = server.query('/library/sections/{}/all{}'.format(section.key, utils.joinArgs(args)))
 
-        return [d for d in history['data'] if d['watched_status'] == 1]
+    return int(data.attrib.get('totalSize', 0))
 
-    def get_libraries(self):
-        """Call Tautulli's get_libraries api endpoint"""
 
-        payload = {}
-        return self._call_api('get_libraries', payload)
+def library_watched(user_server, library, libtype):
+    """Number of items the user watched in a library"""
+    return count_items(user_server, user_server.library.section(library), libtype, unwatched=0)
+
+
+def collection_watched(user_server, rating_key, albums=False):
+    """Number of items the user watched in a collection, from one request for the user's view of it.
+
+    Albums count once any track was listened.
+    """
+    items = user_server.fetchItem(rating_key).items()
+    if albums:
+        return sum(1 for album in items if album.viewedLeafCount)
+
+    return sum(1 for item in items if item.isWatched)
+
+
+def show_watched(user_server, rating_key):
+    """Number of episodes the user watched in a show"""
+    return user_server.fetchItem(rating_key).viewedLeafCount
 
 
 class Plex(object):
-    def __init__(self, token, url=None):
+    def __init__(self, token, url=None, index_ttl=INDEX_TTL):
         if token and not url:
             self.account = MyPlexAccount(token)
         if token and url:
-            session = Connection().session
+            session = pooled_session(VERIFY_SSL)
             self.server = PlexServer(baseurl=url, token=token, session=session)
+        self.index_ttl = index_ttl
+        self.index_cache = None
+        # Listings are kept for the run, each one is only requested once
+        self._sections = None
+        self._collections = None
+        self._shows = None
 
     def all_users(self):
         """All users
@@ -157,9 +189,10 @@ class Plex(object):
         sections: dict
             {section title: section object}
         """
-        sections = {section.title: section for section in self.server.library.sections()}
+        if self._sections is None:
+            self._sections = {section.title: section for section in self.server.library.sections()}
 
-        return sections
+        return self._sections
     
     def all_collections(self):
         """All collections from server
@@ -168,28 +201,78 @@ class Plex(object):
         collections: dict
             {collection title: collection object}
         """
-        collections = {}
-        for section in self.all_sections().values():
-            if section.type != 'photo':
-                for collection in section.collections():
-                    collections[collection.title] = collection
-
-        return collections
+        if self._collections is None:
+            collections = {}
+            for section in self.all_sections().values():
+                if section.type != 'photo':
+                    for collection in section.collections():
+                        collections[collection.title] = collection
+            self._collections = collections
+
+        return self._collections
     
     def all_shows(self):
-        """All collections from server
+        """All shows from server
         Returns
         -------
         shows: dict
             {Show title: show object}
         """
-        shows = {}
-        for section in self.all_sections().values():
-            if section.type == 'show':
-                for show in section.all():
-                    shows[show.title] = show
+        if self._shows is None:
+            shows = {}
+            for section in self.all_sections().values():
+                if section.type == 'show':
+                    for show in section.all():
+                        shows[show.title] = show
+            self._shows = shows
+
+        return self._shows
+
+    def collection(self, title):
+        """Collection by title, see find()"""
+        return self.find(title, 'collections', self.all_collections)
+
+    def show(self, title):
+        """Show by title, see find()"""
+        return self.find(title, 'shows', self.all_shows)
+
+    def find(self, title, name, listing):
+        """Find an item by title.
+
+        With index_ttl the {title: ratingKey} index is kept on disk and the item
+        is fetched by its rating key, later runs skip listing every section.
+        A title missing from the index or a deleted item rebuilds the index once.
+
+        Parameters
+        ----------
+        title: str
+        name: str
+            Index name (collections, shows)
+        listing: func
+            Returns {title: object} from the server
 
-        return shows
+        Returns
+        -------
+        obj or None
+        """
+        if not self.index_ttl:
+            return listing().get(title)
+
+        if self.index_cache is None:
+            self.index_cache = KeyValueCache(cache_path('watched_percentages.db'), ttl=self.index_ttl)
+        key = '{}:{}'.format(self.server.machineIdentifier, name)
+        for refresh in (False, True):
+            index = self.index_cache.get_value(
+                key, lambda: {item_title: item.ratingKey for item_title, item in listing().items()}, refresh)
+            rating_key = index.get(title)
+            if rating_key is None:
+                continue
+            try:
+                return self.server.fetchItem(rating_key)
+            except NotFound:
+                pass
+
+        return None
 
     def all_sections_totals(self, library=None):
         """All sections total items
@@ -202,14 +285,11 @@ class Plex(object):
         if library:
             sections = [self.all_sections()[library]]
         else:
-            sections = self.all_sections()
+            sections = self.all_sections().values()
         for section in sections:
-            if section.type == 'movie':
-                section_total = len(section.all())
-            elif section.type == 'show':
-                section_total = len(section.search(libtype='episode'))
-            else:
+            if section.type not in SECTION_LIBTYPES:
                 continue
+            section_total = count_items(self.server, section, SECTION_LIBTYPES[section.type])
 
             if library:
                 return section_total
@@ -219,8 +299,73 @@ class Plex(object):
         return section_totals
 
 
-def make_pie(user_dict, source_dict, title, filename=None, image=None, headless=None):
-
+def watched_matrix(users, sources, user_count, workers=USER_WORKERS):
+    """Count every user's watched items in every source.
+
+    Users are counted concurrently, each user's sources in turn.
+
+    Parameters
+    ----------
+    users: list
+    sources: list
+        Source objects
+    user_count: func
+        user_count(user) returns a function that takes a Source and returns
+        the user's watched count, e.g. after connecting as the user.
+
+    Returns
+    -------
+    watched: numpy.ndarray
+        users x sources watched counts
+    percents: numpy.ndarray
+        users x sources watched percentages
+    """
+    def count_user(user):
+        count = user_count(user)
+        return [count(source) for source in sources]
+
+    watched = np.zeros((len(users), len(sources)), dtype=np.int64)
+    for row, (user, counts) in enumerate(fetch_all(count_user, users, workers)):
+        watched[row] = counts
+
+    totals = np.array([source.total for source in sources], dtype=np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        percents = np.where(totals > 0, 100 * watched / totals, 0)
+
+    return watched, percents
+
+
+def print_report(users, sources, watched, percents):
+    for column, source in enumerate(sources):
+        print("{}: {}, has {} items.".format(source.kind, source.name, source.total))
+        for row, user in enumerate(users):
+            print("    {} has {} {} items ({}%).".format(user, source.verb, watched[row, column],
+                                                         int(percents[row, column])))
+
+
+def write_report(users, sources, watched, percents, filename, export):
+    """Save the counts and percentages as csv (one row per user and source) or json"""
+    output_file = '{}.{}'.format(filename, export)
+    if export == 'csv':
+        with open(output_file, 'w') as fp:
+            writer = csv.writer(fp)
+            writer.writerow(['user', 'source', 'total', 'watched', 'percent'])
+            for row, user in enumerate(users):
+                for column, source in enumerate(sources):
+                    writer.writerow([user, source.name, source.total, watched[row, column],
+                                     round(percents[row, column], 2)])
+    elif export == 'json':
+        report = {'sources': {source.name: source.total for source in sources},
+                  'users': {user: {source.name: {'watched': int(watched[row, column]),
+                                                 'percent': round(float(percents[row, column]), 2)}
+                                   for column, source in enumerate(sources)}
+                            for row, user in enumerate(users)}}
+        with open(output_file, 'w') as fp:
+            json.dump(report, fp, indent=4, sort_keys=True)
+    print('Report saved as: {}'.format(output_file))
+
+
+def pyplot(headless=None):
     import matplotlib as mpl
     mpl.rcParams['text.color'] = FONT_COLOR
     mpl.rcParams['axes.labelcolor'] = FONT_COLOR
@@ -230,43 +375,71 @@ def make_pie(user_dict, source_dict, title, filename=None, image=None, headless=
         mpl.use("Agg")
 
     import matplotlib.pyplot as plt
-    
-    user_len = len(user_dict.keys())
-    source_len = len(source_dict.keys())
-    user_position = 0
-    
+
+    return plt
+
+
+def show_figure(plt, fig, title, filename=None, headless=None):
+    plt.suptitle(title, bbox=BBOX_PROPS, size=15)
+    plt.tight_layout()
+    fig.subplots_adjust(top=0.88)
+
+    if filename:
+        plt.savefig('{}_{}.png'.format(filename, timestr), facecolor=BACKGROUND_COLOR)
+        print('Image saved as: {}_{}.png'.format(filename, timestr))
+    if not headless:
+        plt.show()
+
+
+def make_pie(users, sources, watched, percents, title, filename=None, headless=None):
+    plt = pyplot(headless)
+
+    user_len = len(users)
+    source_len = len(sources)
+
     fig = plt.figure(figsize=(source_len + 10, user_len + 10), facecolor=BACKGROUND_COLOR)
 
-    for user, values in user_dict.items():
-        source_position = 0
-        for source, watched_value in values.items():
-            source_total = source_dict.get(source)
-            percent_watched = 100 * (float(watched_value) / float(source_total))
+    for user_position, user in enumerate(users):
+        for source_position, source in enumerate(sources):
+            percent_watched = percents[user_position, source_position]
             fracs = [percent_watched, 100 - percent_watched]
             ax = plt.subplot2grid((user_len, source_len), (user_position, source_position))
             pie, text, autotext = ax.pie(fracs, explode=EXPLODE, colors=COLORS, pctdistance=1.3,
-                   autopct='%1.1f%%', shadow=True, startangle=300, radius=0.8,
-                   wedgeprops=dict(width=0.5, edgecolor=BACKGROUND_COLOR))
+                                         autopct='%1.1f%%', shadow=True, startangle=300, radius=0.8,
+                                         wedgeprops=dict(width=0.5, edgecolor=BACKGROUND_COLOR))
 
             if user_position == 0:
-                ax.set_title("{}: {}".format(source, source_total), bbox=BBOX_PROPS,
+                ax.set_title("{}: {}".format(source.name, source.total), bbox=BBOX_PROPS,
                              ha='center', va='bottom', size=12)
             if source_position == 0:
                 ax.set_ylabel(user, bbox=BBOX_PROPS, size=13, horizontalalignment='right').set_rotation(0)
                 ax.yaxis.labelpad = 40
-            ax.set_xlabel("User watched: {}".format(watched_value), bbox=BBOX_PROPS)
-            source_position += 1
-        user_position += 1
+            ax.set_xlabel("User watched: {}".format(watched[user_position, source_position]), bbox=BBOX_PROPS)
 
-    plt.suptitle(title, bbox=BBOX_PROPS, size=15)
-    plt.tight_layout()
-    fig.subplots_adjust(top=0.88)
+    show_figure(plt, fig, title, filename, headless)
 
-    if filename:
-        plt.savefig('{}_{}.png'.format(filename, timestr), facecolor=BACKGROUND_COLOR)
-        print('Image saved as: {}_{}.png'.format(filename, timestr))
-    if not headless:
-        plt.show()
+
+def make_heatmap(users, sources, percents, title, filename=None, headless=None):
+    """One chart for all users and sources, sized for large user lists"""
+    plt = pyplot(headless)
+    from matplotlib.colors import LinearSegmentedColormap
+
+    fig, ax = plt.subplots(figsize=(max(len(sources) * 1.5, 8), max(len(users) * 0.4, 6)),
+                           facecolor=BACKGROUND_COLOR)
+    ax.set_facecolor(BACKGROUND_COLOR)
+    cmap = LinearSegmentedColormap.from_list('watched', [BOX_COLOR, COLORS[0]])
+    image = ax.imshow(percents, cmap=cmap, vmin=0, vmax=100, aspect='auto')
+
+    ax.set_xticks(np.arange(len(sources)))
+    ax.set_xticklabels(['{}: {}'.format(source.name, source.total) for source in sources],
+                       rotation=30, ha='right')
+    ax.set_yticks(np.arange(len(users)))
+    ax.set_yticklabels(users)
+    for (row, column), percent in np.ndenumerate(percents):
+        ax.text(column, row, '{:.1f}%'.format(percent), ha='center', va='center', size=9)
+    fig.colorbar(image, ax=ax, label='% watched')
+
+    show_figure(plt, fig, title, filename, headless)
 
 
 if __name__ == '__main__':
@@ -290,131 +463,77 @@ if __name__ == '__main__':
                         help='Users to scan for watched content.')
     parser.add_argument('--pie', default=False, action='store_true',
                         help='Display pie chart')
+    parser.add_argument('--heatmap', default=False, action='store_true',
+                        help='Display one heatmap of all users and sources')
+    parser.add_argument('--export', choices=['csv', 'json'],
+                        help='Save the counts and percentages to a file.\nChoices: %(choices)s')
     parser.add_argument('--filename', type=str, default='Users_Watched_{}'.format(timestr), metavar='',
-                        help='Filename of pie chart. None will not save. \n(default: %(default)s)')
+                        help='Filename of pie chart, heatmap or export. None will not save the charts. '
+                             '\n(default: %(default)s)')
     parser.add_argument('--headless', action='store_true', help='Run headless.')
+    parser.add_argument('--indexTTL', type=int, default=INDEX_TTL, metavar='',
+                        help='Seconds to keep the collection and show title indexes on disk. '
+                             '0 keeps them for this run only.\n(default: %(default)s)')
 
     opts = parser.parse_args()
 
-    source_dict = {}
-    user_servers = []
+    sources = []
     sections_dict = {}
-    user_dict = {}
     title = ''
-    image = ''
-
 
     if opts.plex:
         admin_account = Plex(PLEX_TOKEN)
-        plex_server = Plex(PLEX_TOKEN, PLEX_URL)
-        for user in opts.users:
-            user_server = plex_server.server.switchUser(user)
-            user_server._username = user
-            user_servers.append(user_server)
-        
+        plex_server = Plex(PLEX_TOKEN, PLEX_URL, opts.indexTTL)
+
         if opts.libraries:
             title = "User's Watch Percentage by Library\nFrom: {}"
             title = title.format(plex_server.server.friendlyName)
 
             for library in opts.libraries:
+                section_type = plex_server.all_sections()[library].type
+                if section_type not in SECTION_LIBTYPES:
+                    print("Not doing that...")
+                    continue
                 section_total = plex_server.all_sections_totals(library)
-                source_dict[library] = section_total
-                print("Section: {}, has {} items.".format(library, section_total))
-                for user_server in user_servers:
-                    section = user_server.library.section(library)
-                    if section.type == 'movie':
-                        section_watched_lst = section.search(unwatched=False)
-                    elif section.type == 'show':
-                        section_watched_lst = section.search(libtype='episode', unwatched=False)
-                    else:
-                        continue
-                    section_watched_total = len(section_watched_lst)
-                    percent_watched = 100 * (float(section_watched_total) / float(section_total))
-                    print("    {} has watched {} items ({}%).".format(user_server._username, section_watched_total,
-                                                                      int(percent_watched)))
-
-                    if user_dict.get(user_server._username):
-                        user_dict[user_server._username].update({library: section_watched_total})
-                    else:
-                        user_dict[user_server._username] = {library: section_watched_total}
-                            
+                libtype = SECTION_LIBTYPES[section_type]
+                sources.append(Source('Section', library, section_total,
+                                      partial(library_watched, library=library, libtype=libtype)))
+
         if opts.collections:
             title = "User's Watch Percentage by Collection\nFrom: {}"
             title = title.format(plex_server.server.friendlyName)
             for collection in opts.collections:
-                _collection = plex_server.all_collections()[collection]
-                collection_albums = _collection.items()
-                collection_total = len(collection_albums)
-                source_dict[collection] = collection_total
-                print("Collection: {}, has {} items.".format(collection, collection_total))
-                if _collection.subtype == 'album':
-                    for user_server in user_servers:
-                        collection_watched_lst = []
-                        user_collection = user_server.fetchItem(_collection.ratingKey)
-                        for album in user_collection.items():
-                            if album.viewedLeafCount:
-                                collection_watched_lst.append(album)
-                        collection_watched_total = len(collection_watched_lst)
-                        percent_watched = 100 * (float(collection_watched_total) / float(collection_total))
-                        print("    {} has listened {} items ({}%).".format(user_server._username,
-                                                                           collection_watched_total,
-                                                                          int(percent_watched)))
-                        if user_dict.get(user_server._username):
-                            user_dict[user_server._username].update({collection: collection_watched_total})
-                        else:
-                            user_dict[user_server._username] = {collection: collection_watched_total}
-                        
-                else:
-                    collection_items = _collection.items()
-                    collection_total = len(collection_items)
-                    thumb_url = '{}{}&X-Plex-Token={}'.format(PLEX_URL, _collection.thumb, PLEX_TOKEN)
-                    # image = rget(thumb_url, stream=True)
-                    image = urllib.request.urlretrieve(thumb_url)
-                    for user_server in user_servers:
-                        collection_watched_lst = []
-                        for item in collection_items:
-                            user_item = user_server.fetchItem(item.ratingKey)
-                            if user_item.isWatched:
-                                collection_watched_lst.append(user_item)
-                        collection_watched_total = len(collection_watched_lst)
-                        percent_watched = 100 * (float(collection_watched_total) / float(collection_total))
-                        print("    {} has watched {} items ({}%).".format(user_server._username,
-                                                                          collection_watched_total,
-                                                                          int(percent_watched)))
-                        if user_dict.get(user_server._username):
-                            user_dict[user_server._username].update({collection: collection_watched_total})
-                        else:
-                            user_dict[user_server._username] = {collection: collection_watched_total}
+                _collection = plex_server.collection(collection)
+                if _collection is None:
+                    parser.error('Collection not found: {}'.format(collection))
+                albums = _collection.subtype == 'album'
+                sources.append(Source('Collection', collection, _collection.childCount,
+                                      partial(collection_watched, rating_key=_collection.ratingKey, albums=albums),
+                                      verb='listened' if albums else 'watched'))
 
         if opts.shows:
             title = "User's Watch Percentage by Shows\nFrom: {}"
             title = title.format(plex_server.server.friendlyName)
-            all_shows = plex_server.all_shows()
-            
             for show_title in opts.shows:
-                show = all_shows.get(show_title)
-                episode_total = len(show.episodes())
-                season_total = len(show.seasons())
-                source_dict[show_title] = len(show.episodes())
-                print("Show: {}, has {} episodes.".format(show_title, episode_total))
-                for user_server in user_servers:
-                    user_show = user_server.fetchItem(show.ratingKey)
-                    source_watched_lst = user_show.watched()
-                    source_watched_total = len(source_watched_lst)
-                    percent_watched = 100 * (float(source_watched_total) / float(episode_total))
-                    print("    {} has watched {} items ({}%).".format(user_server._username, source_watched_total,
-                                                                      int(percent_watched)))
-            
-                    if user_dict.get(user_server._username):
-                        user_dict[user_server._username].update({show_title: source_watched_total})
-                    else:
-                        user_dict[user_server._username] = {show_title: source_watched_total}
+                show = plex_server.show(show_title)
+                if show is None:
+                    parser.error('Show not found: {}'.format(show_title))
+                # Episode counts are attributes of the show, no need to list the episodes
+                sources.append(Source('Show', show_title, show.leafCount,
+                                      partial(show_watched, rating_key=show.ratingKey)))
+
+        # switchUser shares the admin's MyPlexAccount, which is loaded on first use,
+        # so users are switched one at a time and only their counts run concurrently
+        switch_lock = threading.Lock()
+
+        def user_count(user):
+            with switch_lock:
+                user_server = plex_server.server.switchUser(user)
+            return lambda source: source.count(user_server)
 
     elif opts.tautulli:
         # Create a Tautulli instance
-        tautulli_server = Tautulli(Connection(url=TAUTULLI_URL.rstrip('/'),
-                                              apikey=TAUTULLI_APIKEY,
-                                              verify_ssl=VERIFY_SSL))
+        tautulli_server = Tautulli(TAUTULLI_URL, TAUTULLI_APIKEY, VERIFY_SSL)
         # Pull all libraries from Tautulli
         tautulli_sections = tautulli_server.get_libraries()
         title = "User's Watch Percentage by Library\nFrom: Tautulli"
@@ -432,37 +551,28 @@ if __name__ == '__main__':
                 print("Not doing that...")
                 section_total = 0
 
-            print("Section: {}, has {} items.".format(library, section_total))
-            source_dict[library] = section_total
-            for user in opts.users:
-                count = 25
-                start = 0
-                section_watched_lst = []
-                try:
-                    while True:
-                        # Getting all watched history for userFrom
-                        tt_watched = tautulli_server.get_watched_history(user=user, section_id=section.key,
-                                                                         start=start, length=count)
-                        if all([tt_watched]):
-                            start += count
-                            for item in tt_watched:
-                                section_watched_lst.append(item["rating_key"])
-                            continue
-                        elif not all([tt_watched]):
-                            break
-                        start += count
+            sources.append(Source('Section', library, section_total,
+                                  partial(tautulli_server.watched_count, section_id=section.key)))
 
+        def user_count(user):
+            def count(source):
+                try:
+                    return source.count(user)
                 except Exception as e:
                     print((user, e))
+                    return 0
+            return count
 
-                section_watched_total = len(list(set(section_watched_lst)))
-                percent_watched = 100 * (float(section_watched_total) / float(section_total))
-                print("    {} has watched {} items ({}%).".format(user, section_watched_total, int(percent_watched)))
+    else:
+        parser.error('Select --plex or --tautulli.')
 
-                if user_dict.get(user):
-                    user_dict[user].update({library: section_watched_total})
-                else:
-                    user_dict[user] = {library: section_watched_total}
+    users = opts.users or []
+    watched, percents = watched_matrix(users, sources, user_count)
+    print_report(users, sources, watched, percents)
 
+    if opts.export:
+        write_report(users, sources, watched, percents, opts.filename, opts.export)
+    if opts.heatmap:
+        make_heatmap(users, sources, percents, title, opts.filename, opts.headless)
     if opts.pie:
-        make_pie(user_dict, source_dict, title, opts.filename, image, opts.headless)
+        make_pie(users, sources, watched, percents, title, opts.filename, opts.headless)
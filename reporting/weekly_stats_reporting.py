@@ -17,14 +17,17 @@ from builtins import range
 from builtins import object
 from plexapi.server import CONFIG
 from datetime import datetime, timedelta, date
-from requests import Session
-from requests.adapters import HTTPAdapter
-from requests.exceptions import RequestException
 from operator import itemgetter
+import os
+import sys
 import time
 import json
 import argparse
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from jbops.tautulli import Tautulli as TautulliClient  # noqa: E402
+from jbops.growth import GrowthSeries  # noqa: E402
+
 
 # EDIT THESE SETTINGS #
 TAUTULLI_URL = ''
@@ -71,6 +74,12 @@ ARTIST_STAT = 'Artists: {0}, Albums: {1}, Songs: {2}'
 PHOTO_STAT = 'Folders: {0}, Subfolders: {1}, Photos: {2}'
 MOVIE_STAT = 'Movies: {0}'
 
+# Library growth (--growth), count compared for each library type and its label
+GROWTH_COUNTS = {'movie': ('count', 'Movies'),
+                 'show': ('child_count', 'Episodes'),
+                 'artist': ('child_count', 'Songs'),
+                 'photo': ('child_count', 'Photos')}
+
 # Library names you do not want shown. Logging before exclusion.
 LIB_IGNORE = ['XXX']
 
@@ -190,7 +199,15 @@ def get_user_stats(home_stats, rich, stats_type, notify=None):
     return user_stats_lst
 
 
-def get_library_stats(libraries, tautulli, rich, notify=None):
+def to_int(value):
+    """Tautulli library counts are strings, missing for some library types"""
+    try:
+        return int(value)
+    except (ValueError, TypeError):
+        return None
+
+
+def get_library_stats(libraries, tautulli, rich, notify=None, growth=None):
     section_count = ''
     total_size = 0
     sections_stats_lst = []
@@ -200,6 +217,12 @@ def get_library_stats(libraries, tautulli, rich, notify=None):
 
         library = tautulli.get_library_media_info(section['section_id'])
         total_size += library['total_file_size']
+        if growth:
+            # Keep a sample of every library for growth reporting
+            growth.record('tautulli', section['section_id'], section['section_name'], section['section_type'],
+                          count=to_int(section.get('count')), parent_count=to_int(section.get('parent_count')),
+                          child_count=to_int(section.get('child_count')),
+                          total_file_size=library['total_file_size'])
 
         if section['section_type'] == 'artist':
             section_count = ARTIST_STAT.format(section['count'], section['parent_count'], section['child_count'])
@@ -229,101 +252,43 @@ def get_library_stats(libraries, tautulli, rich, notify=None):
     return sections_stats_lst
 
 
-class Tautulli(object):
-    def __init__(self, url, apikey, verify_ssl=False, debug=None):
-        self.url = url
-        self.apikey = apikey
-        self.debug = debug
-
-        self.session = Session()
-        self.adapters = HTTPAdapter(max_retries=3,
-                                    pool_connections=1,
-                                    pool_maxsize=1,
-                                    pool_block=True)
-        self.session.mount('http://', self.adapters)
-        self.session.mount('https://', self.adapters)
-
-        # Ignore verifying the SSL certificate
-        if verify_ssl is False:
-            self.session.verify = False
-            # Disable the warning that the request is insecure, we know that...
-            import urllib3
-            urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
-            
-            
+def get_growth_stats(growth, since, rich, notify=None):
+    """Library growth since the epoch time since, from the stored library samples"""
+    growth_stats_lst = []
+    size_growth = 0
+
+    print('Checking library growth.')
+    for library in growth.delta('tautulli', since):
+        size_growth += library['total_file_size'] or 0
+        column, label = GROWTH_COUNTS.get(library['section_type'], ('count', 'Items'))
+        if library['section_name'] in LIB_IGNORE or library[column] is None:
+            continue
+        growth_stats_lst += ['{}: {:+d} {}'.format(library['section_name'], library[column], label)]
+
+    if growth_stats_lst:
+        growth_stats_lst = ['Growth since {}:'.format(time.ctime(float(since)))] + growth_stats_lst
+        growth_stats_lst += ['Capacity: {}{}'.format('+' if size_growth >= 0 else '-', sizeof_fmt(abs(size_growth)))]
+    else:
+        growth_stats_lst += ['No library stats saved before {} yet.'.format(time.ctime(float(since)))]
+
+    if not rich and notify:
+        # Html formatting
+        growth_stats_lst = ['<li>{}</li>'.format(stat) for stat in growth_stats_lst]
+
+    return growth_stats_lst
+
+
+class Tautulli(TautulliClient):
     def get_library_media_info(self, section_id=None, refresh=None):
-        """Call Tautulli's get_activity api endpoint"""
-        payload = {}
+        """Call Tautulli's get_library_media_info api endpoint"""
         if refresh:
             for library in self.get_libraries():
-                payload['section_id'] = library['section_id']
-                payload['refresh'] = 'true'
                 print('Refreshing library: {}'.format(library['section_name']))
-                self._call_api('get_library_media_info', payload)
+                super(Tautulli, self).get_library_media_info(section_id=library['section_id'], refresh=True)
             print('Libraries have been refreshed, please wait while library stats are updated.')
             exit()
-        else:
-            payload['section_id'] = section_id
 
-        return self._call_api('get_library_media_info', payload)
-    
-    def get_libraries(self):
-        """Call Tautulli's get_activity api endpoint"""
-        payload = {}
-        
-        return self._call_api('get_libraries', payload)
-
-    def get_home_stats(self, time_range, stats_type, stats_count):
-        """Call Tautulli's get_activity api endpoint"""
-        payload = {}
-        payload['time_range'] = time_range
-        payload['stats_type'] = stats_type
-        payload['stats_count'] = stats_count
-        
-        return self._call_api('get_home_stats', payload)
-
-    def get_history(self, section_id, check_date):
-        """Call Tautulli's get_activity api endpoint"""
-        payload = {}
-        payload['section_id'] = int(section_id)
-        payload['start_date'] = check_date
-    
-        return self._call_api('get_history', payload)
-
-    def notify(self, notifier_id, subject, body):
-        """Call Tautulli's notify api endpoint"""
-        payload = {'notifier_id': notifier_id,
-                   'subject': subject,
-                   'body': body}
-
-        return self._call_api('notify', payload)
-    
-    def _call_api(self, cmd, payload, method='GET'):
-        payload['cmd'] = cmd
-        payload['apikey'] = self.apikey
-
-        try:
-            response = self.session.request(method, self.url + '/api/v2', params=payload)
-        except RequestException as e:
-            print("Tautulli request failed for cmd '{}'. Invalid Tautulli URL? Error: {}".format(cmd, e))
-            return
-
-        try:
-            response_json = response.json()
-        except ValueError:
-            print(
-                "Failed to parse json response for Tautulli API cmd '{}': {}"
-                .format(cmd, response.content))
-            return
-
-        if response_json['response']['result'] == 'success':
-            if self.debug:
-                print("Successfully called Tautulli API cmd '{}'".format(cmd))
-            return response_json['response']['data']
-        else:
-            error_msg = response_json['response']['message']
-            print("Tautulli API cmd '{}' failed: {}".format(cmd, error_msg))
-            return
+        return super(Tautulli, self).get_library_media_info(section_id=section_id)
 
 
 class Notification(object):
@@ -454,8 +419,9 @@ if __name__ == '__main__':
                         help='Only retrieve library stats.')
     parser.add_argument('--userStats', action='store_true',
                         help='Only retrieve users stats.')
-    
-    # todo Goals: growth reporting? show library size growth over time?
+    parser.add_argument('--growth', action='store_true',
+                        help='Add library growth over the days to the library stats.\n'
+                             'Library stats are saved on every run, growth starts after the first run.')
 
     opts = parser.parse_args()
 
@@ -483,7 +449,11 @@ if __name__ == '__main__':
     sections_stats = ''
     if opts.libraryStats or (not opts.libraryStats and not opts.userStats):
         libraries = tautulli_server.get_libraries()
-        lib_stats = get_library_stats(libraries, tautulli_server, opts.richMessage, opts.notify)
+        growth = GrowthSeries()
+        lib_stats = get_library_stats(libraries, tautulli_server, opts.richMessage, opts.notify, growth)
+        if opts.growth:
+            lib_stats += get_growth_stats(growth, DAYS_AGO, opts.richMessage, opts.notify)
+        growth.close()
         sections_stats = "\n".join(lib_stats)
 
     user_stats = ''
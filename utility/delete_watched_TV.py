@@ -34,7 +34,7 @@ class METAINFO(object):
 
 
 def get_metadata(rating_key):
-    # Get the metadata for a media item.
+    # Get the metadata for a media item. Not cached, the file path is used for deletion.
     payload = {'apikey': TAUTULLI_APIKEY,
                'rating_key': rating_key,
                'cmd': 'get_metadata',
@@ -74,7 +74,7 @@ def get_new_rating_keys(rating_key, media_type):
 
 
 def get_metadata(rating_key):
-    # Get the metadata for a media item.
+    # Get the metadata for a media item. Not cached, the file path is used for deletion.
     payload = {'apikey': TAUTULLI_APIKEY,
                'rating_key': rating_key,
                'cmd': 'get_metadata',
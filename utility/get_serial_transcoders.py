@@ -9,11 +9,18 @@ Requires: requests, plexapi, python3.6+
 from __future__ import print_function
 from __future__ import division
 from __future__ import unicode_literals
+import os
+import sys
+import time
 from past.utils import old_div
 from requests import Session
+from requests.exceptions import RequestException
 from plexapi.server import CONFIG
 from datetime import date, timedelta
-from json.decoder import JSONDecodeError
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from jbops.tautulli import Tautulli  # noqa: E402
+from jbops.history import HistoryStore, SyncError  # noqa: E402
 
 TAUTULLI_URL = ''
 TAUTULLI_API_KEY = ''
@@ -33,15 +40,14 @@ SESSION = Session()
 SESSION.params = {'apikey': TAUTULLI_API_KEY}
 FORMATTED_URL = f'{TAUTULLI_URL}/api/v2'
 
-PARAMS = {'cmd': 'get_history', 'grouping': 1, 'order_column': 'date', 'length': 1000}
-
-REQUEST = None
+# Sync the local copy of the Tautulli history, then read the past days from it.
+LOCAL_HISTORY = HistoryStore()
 try:
-    REQUEST = SESSION.get(FORMATTED_URL, params=PARAMS).json()['response']['data']['data']
-except JSONDecodeError:
+    LOCAL_HISTORY.sync(Tautulli(TAUTULLI_URL, TAUTULLI_API_KEY))
+except (SyncError, RequestException):
     exit("Error talking to Tautulli API, please check your TAUTULLI_URL")
 
-HISTORY = [play for play in REQUEST if date.fromtimestamp(play['started']) >= START_DATE]
+HISTORY = LOCAL_HISTORY.query(after=time.mktime(START_DATE.timetuple()), grouping=True)
 
 USERS = {}
 for play in HISTORY:
@@ -4,20 +4,35 @@
 """
 Check Plex library locations growth over time using added date.
 Check Plex, Tautulli, OS for added time, last updated, originally availableAt, played dates
+
+ Each library is listed once, keeping only the added date, release year and
+ genres of its items in a local snapshot (see jbops/cache.py for the folder).
+ Later runs only request the items added or updated since the last run.
+ Each run also saves the item count of the libraries (see jbops/growth.py),
+ --delta reports the change over past days from those counts without listing
+ the libraries.
 """
 
 import argparse
 import datetime
+import json
+import os
 import sys
+import time
 from plexapi.server import PlexServer
 from plexapi.server import CONFIG
 import requests
+import numpy as np
 import matplotlib.pyplot as plt
 import matplotlib.ticker as plticker
-from collections import Counter
 from matplotlib import rcParams
 rcParams.update({'figure.autolayout': True})
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from jbops.cache import cache_path  # noqa: E402
+from jbops.growth import GrowthSeries  # noqa: E402
+from jbops.snapshot import LibrarySnapshot, epoch  # noqa: E402
+
 PLEX_URL =''
 PLEX_TOKEN = ''
 TAUTULLI_URL = ''
@@ -100,59 +115,95 @@ def exclusions(all_true, select, all_items):
     return output
 
 
-def plex_growth(section, axs):
-    library = plex.library.sectionByID(section)
+class GrowthSnapshot(LibrarySnapshot):
+    """Added date, release year and genres of each library item, see jbops/snapshot.py."""
+    COLUMNS = (('added_at', 'INTEGER'), ('released', 'INTEGER'), ('genres', 'TEXT'))
 
-    allthem = library.all()
-    
-    allAddedAt = [x.addedAt.date() for x in allthem if x.addedAt]
-    y = range(len(allAddedAt))
-    axs[0].plot(sorted(allAddedAt), y)
+    def __init__(self, client_identifier):
+        super(GrowthSnapshot, self).__init__(cache_path('library_growth_{}.db'.format(client_identifier)))
+
+    def row(self, section, item):
+        released = item.originallyAvailableAt.year if item.originallyAvailableAt else 0
+
+        return (epoch(item.addedAt) if item.addedAt else None, released,
+                json.dumps([genre.tag for genre in item.genres]))
+
+    def series(self, library):
+        """The library's items as compact arrays.
+
+        Returns
+        -------
+        added: numpy.ndarray
+            Added dates as epoch seconds, sorted
+        released: numpy.ndarray
+            Release year of each item, 0 when unknown
+        genre_years: numpy.ndarray
+            Release year of each (item, genre) pair
+        genre_ids: numpy.ndarray
+            Index in genres of each (item, genre) pair
+        genres: list
+            Genre names, sorted
+        """
+        added = []
+        released = []
+        pairs = []
+        for row in self.items(library):
+            added_at, year, item_genres = row['added_at'], row['released'], row['genres']
+            if added_at:
+                added.append(added_at)
+            released.append(year)
+            if year:
+                pairs.extend((year, genre) for genre in json.loads(item_genres))
+
+        genres = sorted(set(genre for year, genre in pairs))
+        genre_index = {genre: i for i, genre in enumerate(genres)}
+
+        return (np.sort(np.array(added, dtype=np.int64)),
+                np.array(released, dtype=np.int64),
+                np.array([year for year, genre in pairs], dtype=np.int64),
+                np.array([genre_index[genre] for year, genre in pairs], dtype=np.int64),
+                genres)
+
+
+def plex_growth(library, series, axs):
+    added = series[0]
+    # Items added per month, then the running total
+    months = added.astype('datetime64[s]').astype('datetime64[M]').astype(np.int64)
+    if len(months):
+        first = months.min()
+        totals = np.cumsum(np.bincount(months - first))
+        dates = (np.arange(len(totals)) + first).astype('datetime64[M]').astype(datetime.date)
+        axs[0].step(dates, totals, where='post')
     axs[0].set_title('Plex {} Library Growth'.format(library.title))
 
 
-def plex_released(section, axs):
-    
-    library = plex.library.sectionByID(section)
-    allthem = library.all()
-    
-    originallyAvailableAt = [x.originallyAvailableAt.date().strftime('%Y')
-                             for x in allthem if x.originallyAvailableAt]
-    counts = Counter(sorted(originallyAvailableAt))
+def plex_released(library, series, axs):
+    released, genre_years, genre_ids, genres = series[1:]
+    released = released[released > 0]
 
-    axs[1].bar(list(counts.keys()), list(counts.values()))
-    loc = plticker.MultipleLocator(base=5.0) # this locator puts ticks at regular intervals
-    axs[1].xaxis.set_major_locator(loc)
+    if len(released):
+        first = released.min()
+        counts = np.bincount(released - first)
+        years = np.arange(len(counts)) + first
+        axs[1].bar(years, counts)
+    axs[1].xaxis.set_major_locator(plticker.MultipleLocator(base=5.0))  # ticks at regular intervals
     axs[1].set_title('Plex {} Library Released Date'.format(library.title))
-    
-    releasedGenres = {}
-    genres = []
-    for x in allthem:
-        if x.originallyAvailableAt:
-            releaseYear = x.originallyAvailableAt.date().strftime('%Y')
-            if releasedGenres.get(releaseYear):
-                for genre in x.genres:
-                    releasedGenres[releaseYear].append(genre.tag)
-                    genres.append(genre.tag)
-            else:
-                for genre in x.genres:
-                    releasedGenres[releaseYear] = [genre.tag]
-                    genres.append(genre.tag)
-
-    labels = sorted(list(set(genres)))
-    for year, genre in sorted(releasedGenres.items()):
-        yearGenre = Counter(sorted(genre))
-        genresCounts = list(yearGenre.values())
-        for i in range(len(yearGenre)):
-            axs[2].bar(year, genresCounts, bottom=sum(genresCounts[:i]))
-        
-        loc = plticker.MultipleLocator(base=5.0) # this locator puts ticks at regular intervals
-        axs[2].xaxis.set_major_locator(loc)
-    axs[2].legend(labels, bbox_to_anchor=(0, -0.25, 1., .102), loc='lower center',
-       ncol=12, mode="expand", borderaxespad=0.)
-    axs[2].set_title('Plex {} Library Released Date (Genre)'.format(library.title))
-    # plt.tight_layout()
 
+    if len(genre_years):
+        # Counts per (year, genre) from one bincount, stacked with one bar call per genre
+        first = genre_years.min()
+        year_count = genre_years.max() - first + 1
+        counts = np.bincount((genre_years - first) * len(genres) + genre_ids,
+                             minlength=year_count * len(genres)).reshape(year_count, len(genres))
+        years = np.arange(year_count) + first
+        bottom = np.zeros(year_count, dtype=np.int64)
+        for i, genre in enumerate(genres):
+            axs[2].bar(years, counts[:, i], bottom=bottom, label=genre)
+            bottom = bottom + counts[:, i]
+        axs[2].legend(bbox_to_anchor=(0, -0.25, 1., .102), loc='lower center',
+                      ncol=12, mode="expand", borderaxespad=0.)
+    axs[2].xaxis.set_major_locator(plticker.MultipleLocator(base=5.0))
+    axs[2].set_title('Plex {} Library Released Date (Genre)'.format(library.title))
 
 
 if __name__ == '__main__':
@@ -163,16 +214,44 @@ if __name__ == '__main__':
                              'Choices: %(choices)s')
     parser.add_argument('--allLibraries', default=False, action='store_true',
                         help='Select all libraries.')
-    
+    parser.add_argument('--delta', type=int, metavar='DAYS',
+                        help='Print the item count change of the libraries over the last DAYS days\n'
+                             'from the counts saved by earlier runs, without listing the libraries.')
+
     opts = parser.parse_args()
     # Defining libraries
     libraries = exclusions(opts.allLibraries, opts.libraries, sections_dict)
-    
+    # Library counts of this server, section keys are only unique per server
+    growth_source = 'plex:{}'.format(plex.machineIdentifier)
+    growth = GrowthSeries()
+
+    if opts.delta:
+        since = time.time() - opts.delta * 24 * 60 * 60
+        deltas = {library['section_id']: library for library in growth.delta(growth_source, since)}
+        for library in libraries:
+            delta = deltas.get(str(library))
+            if delta:
+                print("{}: {:+d} items since {} ({} items)".format(
+                    sections_dict.get(library), delta['count'], time.ctime(delta['start']['taken']),
+                    delta['end']['count']))
+            else:
+                print("{}: no counts saved before {}".format(sections_dict.get(library), time.ctime(since)))
+        exit()
+
+    snapshot = GrowthSnapshot(plex.machineIdentifier)
+
     for library in libraries:
         library_title = sections_dict.get(library)
         print("Starting {}".format(library_title))
+        section = plex.library.sectionByID(library)
+        snapshot.refresh(section)
+        growth.record(growth_source, section.key, section.title, section.type, count=snapshot.count(section))
+        series = snapshot.series(section)
         graph = graph_setup()
-        plex_growth(library, graph)
-        plex_released(library, graph)
+        plex_growth(section, series, graph)
+        plex_released(section, series, graph)
         plt.savefig('{}_library_growth.png'.format(library_title), bbox_inches='tight', dpi=100)
-        # plt.show()
\ No newline at end of file
+        # plt.show()
+
+    snapshot.close()
+    growth.close()
\ No newline at end of file
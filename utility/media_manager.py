@@ -36,14 +36,17 @@ from builtins import object
 import argparse
 import datetime
 import time
+import os
 import re
+import sys
 from collections import Counter
 from plexapi.server import PlexServer
 from plexapi.server import CONFIG
 from plexapi.exceptions import NotFound
-from requests import Session
-from requests.adapters import HTTPAdapter
-from requests.exceptions import RequestException
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from jbops.tautulli import Tautulli as TautulliClient  # noqa: E402
+from jbops.tautulli import pooled_session, paginate, fetch_all  # noqa: E402
 
 PLEX_URL =''
 PLEX_TOKEN = ''
@@ -61,6 +64,8 @@ if not TAUTULLI_APIKEY:
     TAUTULLI_APIKEY = CONFIG.data['auth'].get('tautulli_apikey')
 
 VERIFY_SSL = False
+# Number of Tautulli metadata requests made at the same time
+WORKERS = 10
 
 SELECTOR = ['watched', 'unwatched', 'transcoded', 'rating', 'size', 'lastPlayed']
 ACTIONS = ['delete', 'move', 'archive', 'optimize', 'show']
@@ -81,26 +86,6 @@ OPTIMIZE_DEFAULT = {'targetTagID': 'Mobile',
                    'policyUnwatched': 0,
                    'videoQuality': None}
 
-class Connection(object):
-    def __init__(self, url=None, apikey=None, verify_ssl=False):
-        self.url = url
-        self.apikey = apikey
-        self.session = Session()
-        self.adapters = HTTPAdapter(max_retries=3,
-                                    pool_connections=1,
-                                    pool_maxsize=1,
-                                    pool_block=True)
-        self.session.mount('http://', self.adapters)
-        self.session.mount('https://', self.adapters)
-
-        # Ignore verifying the SSL certificate
-        if verify_ssl is False:
-            self.session.verify = False
-            # Disable the warning that the request is insecure, we know that...
-            import urllib3
-            urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
-
-
 class Library(object):
     def __init__(self, data=None):
         d = data or {}
@@ -171,104 +156,27 @@ class User(object):
         self.direct = {}
 
 
-class Tautulli(object):
-    def __init__(self, connection):
-        self.connection = connection
-
-    def _call_api(self, cmd, payload, method='GET'):
-        payload['cmd'] = cmd
-        payload['apikey'] = self.connection.apikey
-
-        try:
-            response = self.connection.session.request(method, self.connection.url + '/api/v2', params=payload)
-        except RequestException as e:
-            print("Tautulli request failed for cmd '{}'. Invalid Tautulli URL? Error: {}".format(cmd, e))
-            return
-
-        try:
-            response_json = response.json()
-        except ValueError:
-            print("Failed to parse json response for Tautulli API cmd '{}'".format(cmd))
-            return
-
-        if response_json['response']['result'] == 'success':
-            return response_json['response']['data']
-        else:
-            error_msg = response_json['response']['message']
-            print("Tautulli API cmd '{}' failed: {}".format(cmd, error_msg))
-            return
-
+class Tautulli(TautulliClient):
     def get_history(self, user=None, section_id=None, rating_key=None, start=None, length=None, watched=None,
                     transcode_decision=None):
         """Call Tautulli's get_history api endpoint."""
-        payload = {"order_column": "full_title",
-                   "order_dir": "asc"}
-        
         watched_status = None
         if watched is True:
             watched_status = 1
         if watched is False:
             watched_status = 0
-        
-        if user:
-            payload["user"] = user
-        if section_id:
-            payload["section_id"] = section_id
-        if rating_key:
-            payload["rating_key"] = rating_key
-        if start:
-            payload["start"] = start
-        if length:
-            payload["lengh"] = length
-        if transcode_decision:
-            payload["transcode_decision"] = transcode_decision
-
-        history = self._call_api('get_history', payload)
-        
+
+        history = super(Tautulli, self).get_history(user=user, section_id=section_id, rating_key=rating_key,
+                                                    start=start, length=length,
+                                                    transcode_decision=transcode_decision,
+                                                    order_column='full_title', order_dir='asc')
+
         if isinstance(watched_status, int):
             return [d for d in history['data'] if d['watched_status'] == watched_status]
         else:
             return [d for d in history['data']]
 
-    def get_metadata(self, rating_key):
-        """Call Tautulli's get_metadata api endpoint."""
-        payload = {"rating_key": rating_key}
-        return self._call_api('get_metadata', payload)
-
-    def get_libraries(self):
-        """Call Tautulli's get_libraries api endpoint."""
-        payload = {}
-        return self._call_api('get_libraries', payload)
-
-    def get_library_media_info(self, section_id, start, length, unwatched=None, date=None, order_column=None,
-                               last_played=None):
-        """Call Tautulli's get_library_media_info api endpoint."""
-        payload = {'section_id': section_id}
-        if start:
-            payload["start"] = start
-        if length:
-            payload["lengh"] = length
-        if order_column:
-            payload["order_column"] = order_column
-            payload['order_dir'] = 'desc'
-            
-        library_stats = self._call_api('get_library_media_info', payload)
-        if unwatched and not date:
-            return [d for d in library_stats['data'] if d['play_count'] is None]
-        elif unwatched and date:
-            return [d for d in library_stats['data'] if d['play_count'] is None
-                    and (float(d['added_at'])) < date]
-        elif last_played and date:
-            return [d for d in library_stats['data'] if d['play_count'] is not None]
-        else:
-            return [d for d in library_stats['data']]
-        
-    def get_new_rating_keys(self, rating_key, media_type):
-        """Call Tautulli's get_new_rating_keys api endpoint."""
-        payload = {"rating_key": rating_key, "media_type": media_type}
-        return self._call_api('get_new_rating_keys', payload)
-        
-        
+
 def sizeof_fmt(num, suffix='B'):
     # Function found https://stackoverflow.com/a/1094933
     for unit in ['', 'Ki', 'Mi', 'Gi', 'Ti', 'Pi', 'Ei', 'Zi']:
@@ -330,120 +238,110 @@ def plex_deletion(items, libraries, toggleDeletion):
         plex._allowMediaDeletion(False)
 
 
-def last_played_work(sectionID, date=None):
+def item_metadata(item):
+    """Fetch the Metadata object of a library media info row.
+
+    Returns None if the rating_key no longer exists on the Plex server.
+    """
+    # Library rows have no updated_at, their added_at still marks older cached copies as stale
+    _meta = tautulli_server.get_metadata(item['rating_key'], item.get('added_at'))
+    if _meta:  # rating_key that no longer exists on the Plex server will return blank metadata
+        return Metadata(_meta)
+
+
+def library_metadata(sectionID, keep=None, workers=WORKERS, **kwargs):
+    """Page through a library and fetch the metadata of its items concurrently.
+
+    Parameters
+    ----------
+    sectionID (int): Library key
+    keep (function): Only fetch metadata for library media info rows where keep(row) is True
+    workers (int): Number of metadata requests made at the same time
+    kwargs: Passed to get_library_media_info
+
+    Returns
+    -------
+    (row, Metadata) generator in library order, Metadata is None for missing items
+    """
+    rows = paginate(tautulli_server.get_library_media_info, section_id=sectionID, **kwargs)
+    if keep:
+        rows = (row for row in rows if keep(row))
+    return fetch_all(item_metadata, rows, workers)
+
+
+def last_played_work(sectionID, date=None, workers=WORKERS):
     """
     Parameters
     ----------
     sectionID (int): Library key
     date (float): Epoch time
+    workers (int): Number of metadata requests made at the same time
 
     Returns
     -------
     last_played_lst (list): List of Metdata objects of last played items
     """
-    count = 25
-    start = 0
     last_played_lst = []
-    while True:
-        
-        # Getting all watched history
-        tt_history = tautulli_server.get_library_media_info(section_id=sectionID,
-                                                            start=start, length=count, last_played=True,
-                                                            date=date, order_column='last_played')
-        
-        if all([tt_history]):
-            start += count
-            for item in tt_history:
-                _meta = tautulli_server.get_metadata(item['rating_key'])
-                if _meta:  # rating_key that no longer exists on the Plex server will return blank metadata
-                    metadata = Metadata(_meta)
-                    if (float(item['last_played'])) < date:
-                        metadata.last_played = item['last_played']
-                        last_played_lst.append(metadata)
-        elif not all([tt_history]):
-            break
-        start += count
-    
+
+    def keep(item):
+        return item['play_count'] is not None and (float(item['last_played'])) < date
+
+    for item, metadata in library_metadata(sectionID, keep, workers, order_column='last_played'):
+        if metadata:
+            metadata.last_played = item['last_played']
+            last_played_lst.append(metadata)
+
     return last_played_lst
 
 
-def unwatched_work(sectionID, date=None):
+def unwatched_work(sectionID, date=None, workers=WORKERS):
     """
     Parameters
     ----------
     sectionID (int): Library key
     date (float): Epoch time
+    workers (int): Number of metadata requests made at the same time
 
     Returns
     -------
     unwatched_lst (list): List of Metdata objects of unwatched items
     """
-    count = 25
-    start = 0
-    unwatched_lst = []
-    while True:
-    
-        # Getting all watched history for userFrom
-        tt_history = tautulli_server.get_library_media_info(section_id=sectionID,
-                                                     start=start, length=count, unwatched=True, date=date)
-    
-        if all([tt_history]):
-            start += count
-            for item in tt_history:
-                _meta = tautulli_server.get_metadata(item['rating_key'])
-                if _meta:  # rating_key that no longer exists on the Plex server will return blank metadata
-                    metadata = Metadata(_meta)
-                    unwatched_lst.append(metadata)
-            continue
-        elif not all([tt_history]):
-            break
-        start += count
+    def keep(item):
+        return item['play_count'] is None and (not date or (float(item['added_at'])) < date)
 
-    return unwatched_lst
+    return [metadata for item, metadata in library_metadata(sectionID, keep, workers) if metadata]
 
 
-def size_work(sectionID, operator, value, episodes):
+def size_work(sectionID, operator, value, episodes, workers=WORKERS):
     """
     Parameters
     ----------
     sectionID (int): Library key
-    date (float): Epoch time
+    operator (function): Comparison used against value
+    value (int): File size in bytes
+    episodes (bool): Compare the episodes of shows instead of the shows
+    workers (int): Number of metadata requests made at the same time
 
     Returns
     -------
-    unwatched_lst (list): List of Metdata objects of unwatched items
+    size_lst (list): List of Metdata objects of items matching the size criteria
     """
-    count = 25
-    start = 0
     size_lst = []
-    while True:
-        
-        # Getting all watched history for userFrom
-        tt_size = tautulli_server.get_library_media_info(section_id=sectionID,
-                                                            start=start, length=count,
-                                                            order_column="file_size")
-        if all([tt_size]):
-            start += count
-            for item in tt_size:
-                _meta = tautulli_server.get_metadata(item['rating_key'])
-                if _meta:  # rating_key that no longer exists on the Plex server will return blank metadata
-                    metadata = Metadata(_meta)
-                    try:
-                        if episodes:
-                            for _episode in metadata.episodes:
-                                file_size = int(_episode.file_size)
-                                if operator(file_size, value):
-                                    size_lst.append(_episode)
-                        else:
-                            file_size = int(metadata.file_size)
-                            if operator(file_size, value):
-                                size_lst.append(metadata)
-                    except AttributeError:
-                        print("Metadata error found with rating_key: ({})".format(item['rating_key']))
-            continue
-        elif not all([tt_size]):
-            break
-        start += count
+    for item, metadata in library_metadata(sectionID, workers=workers, order_column='file_size'):
+        if metadata:
+            try:
+                if episodes:
+                    for _episode in metadata.episodes:
+                        file_size = int(_episode.file_size)
+                        if operator(file_size, value):
+                            size_lst.append(_episode)
+                else:
+                    file_size = int(metadata.file_size)
+                    if operator(file_size, value):
+                        size_lst.append(metadata)
+            except AttributeError:
+                print("Metadata error found with rating_key: ({})".format(item['rating_key']))
+
     return size_lst
 
 
@@ -488,41 +386,32 @@ def watched_work(user, sectionID=None, ratingKey=None):
             break
         start += count
 
-def rating_work(sectionID, operator, value):
+def rating_work(sectionID, operator, value, workers=WORKERS):
     """
     Parameters
     ----------
     sectionID (int): Library key
     value (str): audience rating criteria
+    workers (int): Number of metadata requests made at the same time
+
     Returns
     -------
     rating_lst (list): List of Metdata objects of items matching audience rating
     """
-    count = 25
-    start = 0
     rating_lst = []
-    while True:
-        tt_size = tautulli_server.get_library_media_info(section_id=sectionID,
-                                                            start=start, length=count)
-        if all([tt_size]):
-            start += count
-            for item in tt_size:
-                _meta = tautulli_server.get_metadata(item['rating_key'])
-                if _meta:  # rating_key that no longer exists on the Plex server will return blank metadata
-                    metadata = Metadata(_meta)
-                    try:
-                        if metadata.audience_rating:
-                            audience_rating = float(metadata.audience_rating)
-                            if operator(audience_rating, float(value)):
-                                rating_lst.append(metadata)
-                    except AttributeError:
-                        print("Metadata error found with rating_key: ({})".format(item['rating_key']))
-            continue
-        elif not all([tt_size]):
-            break
-        start += count
+    for item, metadata in library_metadata(sectionID, workers=workers):
+        if metadata:
+            try:
+                if metadata.audience_rating:
+                    audience_rating = float(metadata.audience_rating)
+                    if operator(audience_rating, float(value)):
+                        rating_lst.append(metadata)
+            except AttributeError:
+                print("Metadata error found with rating_key: ({})".format(item['rating_key']))
+
     return rating_lst
 
+
 def transcode_work(sectionID, operator, value):
     """
     Parameters
@@ -620,7 +509,7 @@ def action_show(items, selector, date, users=None):
 
 if __name__ == '__main__':
     
-    session = Connection().session
+    session = pooled_session(VERIFY_SSL)
     plex = PlexServer(PLEX_URL, PLEX_TOKEN, session=session)
     all_users = plex.myPlexAccount().users()
     all_users.append(plex.myPlexAccount())
@@ -667,6 +556,12 @@ if __name__ == '__main__':
                              '">_3" ie. items played transcoded more than 3 times.')
     parser.add_argument('--episodes', action='store_true',
                         help='Enable Plex to scan episodes if Show library is selected.')
+    parser.add_argument('--noCache', action='store_true',
+                        help='Do not use or update the local Tautulli metadata cache.\n'
+                             'The cache is never used with --action delete.')
+    parser.add_argument('--workers', type=int, default=WORKERS,
+                        help='Number of Tautulli metadata requests made at the same time.\n'
+                             '(default: %(default)s)')
 
     opts = parser.parse_args()
     # todo find: watched by list of users[x], unwatched based on time[x], based on size, most transcoded, star rating
@@ -701,9 +596,10 @@ if __name__ == '__main__':
         date_format = time.strftime("%Y-%m-%d", time.localtime(date))
         date_format = '{} ({} days)'.format(date_format, days.days)
     # Create a Tautulli instance
-    tautulli_server = Tautulli(Connection(url=TAUTULLI_URL.rstrip("/"),
-                                          apikey=TAUTULLI_APIKEY,
-                                          verify_ssl=VERIFY_SSL))
+    # Items picked for deletion are always read fresh from Tautulli
+    use_cache = not opts.noCache and opts.action != 'delete'
+    tautulli_server = Tautulli(TAUTULLI_URL, TAUTULLI_APIKEY, VERIFY_SSL, pool_size=opts.workers,
+                               cache=use_cache)
 
     # Pull all libraries from Tautulli
     _sections = {}
@@ -730,7 +626,7 @@ if __name__ == '__main__':
         if libraries:
             for _library in libraries:
                 print("Checking library: '{}' watch statuses...".format(_library.title))
-                unwatched_lst += unwatched_work(sectionID=_library.key, date=date)
+                unwatched_lst += unwatched_work(sectionID=_library.key, date=date, workers=opts.workers)
         if not unwatched_lst:
             print("{} item(s) have been found.".format(len(unwatched_lst)))
             exit()
@@ -777,7 +673,8 @@ if __name__ == '__main__':
         if libraries:
             for _library in libraries:
                 print("Checking library: '{}' watch statuses...".format(_library.title))
-                last_played_lst += last_played_work(sectionID=_library.key, date=date)
+                last_played_lst += last_played_work(sectionID=_library.key, date=date,
+                                                    workers=opts.workers)
     
         if opts.action == "show":
             action_show(last_played_lst, opts.select, date_format)
@@ -803,7 +700,8 @@ if __name__ == '__main__':
                 if libraries:
                     for _library in libraries:
                         print("Checking library: '{}' items {}{} in size...".format(_library.title, operator, value))
-                        size_lst += size_work(sectionID=_library.key, operator=op, value=size, episodes=opts.episodes)
+                        size_lst += size_work(sectionID=_library.key, operator=op, value=size,
+                                              episodes=opts.episodes, workers=opts.workers)
 
                 if opts.action == "show":
                     action_show(size_lst, opts.select, opts.date)
@@ -815,7 +713,8 @@ if __name__ == '__main__':
                 for _library in libraries:
                     print("Checking library: '{}' items with {}{} rating...".format(
                         _library.title, operator, value))
-                    rating_lst += rating_work(sectionID=_library.key, operator=op, value=value)
+                    rating_lst += rating_work(sectionID=_library.key, operator=op, value=value,
+                                              workers=opts.workers)
 
             if opts.action == "show":
                 action_show(rating_lst, opts.select, None)
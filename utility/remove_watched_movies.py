@@ -10,11 +10,14 @@ from __future__ import unicode_literals
 
 from builtins import input
 from builtins import object
-import requests
 import sys
 import os
 import shutil
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from jbops.tautulli import Tautulli  # noqa: E402
+from jbops.history import HistoryStore  # noqa: E402
+
 
 # ## EDIT THESE SETTINGS ##
 TAUTULLI_APIKEY = 'xxxxxxxx'  # Your Tautulli API key
@@ -39,17 +42,10 @@ class METAINFO(object):
 
 
 def get_metadata(rating_key):
-    # Get the metadata for a media item.
-    payload = {'apikey': TAUTULLI_APIKEY,
-               'rating_key': rating_key,
-               'cmd': 'get_metadata',
-               'media_info': True}
-
+    # Get the metadata for a media item. The file is deleted from this path,
+    # so it is always read from Tautulli and never from the metadata cache.
     try:
-        r = requests.get(TAUTULLI_URL.rstrip('/') + '/api/v2', params=payload)
-        response = r.json()
-
-        res_data = response['response']['data']
+        res_data = tautulli_server.get_metadata(rating_key)
         if res_data['library_name'] in LIBRARY_NAMES:
             return METAINFO(data=res_data)
 
@@ -58,24 +54,11 @@ def get_metadata(rating_key):
         pass
 
 
-def get_history(user, start, length):
-    # Get the Tautulli history.
-    payload = {'apikey': TAUTULLI_APIKEY,
-               'cmd': 'get_history',
-               'user': user,
-               'media_type': 'movie',
-               'start': start,
-               'length': length}
-
-    try:
-        r = requests.get(TAUTULLI_URL.rstrip('/') + '/api/v2', params=payload)
-        response = r.json()
-
-        res_data = response['response']['data']['data']
-        return [UserHIS(data=d) for d in res_data if d['watched_status'] == 1]
-
-    except Exception as e:
-        sys.stderr.write("Tautulli API 'get_history' request failed: {0}.".format(e))
+def get_history(user):
+    # Get the user's watched movies from the local copy of the Tautulli history.
+    # Grouped like Tautulli's history, a movie watched over several sessions counts as watched.
+    return [UserHIS(data=d) for d in history_store.query(user=user, media_type='movie', watched=True,
+                                                         grouping=True)]
 
 
 def delete_files(tmp_lst):
@@ -92,34 +75,28 @@ movie_dict = {}
 movie_lst = []
 delete_lst = []
 
-count = 25
+# Sync the local copy of the Tautulli history once for all users
+tautulli_server = Tautulli(TAUTULLI_URL, TAUTULLI_APIKEY)
+history_store = HistoryStore()
+history_store.sync(tautulli_server)
+
 for user in USER_LST:
-    start = 0
-    while True:
-        # Getting all watched history for listed users
-        history = get_history(user, start, count)
+    # Getting all watched history for listed users
+    for h in get_history(user):
         try:
-            if all([history]):
-                start += count
-                for h in history:
-                    # Getting metadata of what was watched
-                    movies = get_metadata(h.rating_key)
-                    if not any(d['title'] == movies.title for d in movie_lst):
-                        movie_dict = {
-                            'title': movies.title,
-                            'file': movies.file,
-                            'watched_by': [user]
-                        }
-                        movie_lst.append(movie_dict)
-                    else:
-                        for d in movie_lst:
-                            if d['title'] == movies.title:
-                                d['watched_by'].append(user)
-                continue
-            elif not all([history]):
-                break
-
-            start += count
+            # Getting metadata of what was watched
+            movies = get_metadata(h.rating_key)
+            if not any(d['title'] == movies.title for d in movie_lst):
+                movie_dict = {
+                    'title': movies.title,
+                    'file': movies.file,
+                    'watched_by': [user]
+                }
+                movie_lst.append(movie_dict)
+            else:
+                for d in movie_lst:
+                    if d['title'] == movies.title:
+                        d['watched_by'].append(user)
         except Exception as e:
             print(e)
             pass
@@ -54,19 +54,34 @@ Taultulli > Settings > Notification Agents > New Script > Script Arguments:
        - Synced watch statuse of rating key 1234 from USER1's Tautulli history to {USER2 or USER3}'s account
        on selected servers.
        **Rating key must be a movie or episode. Shows and Seasons not support.... yet.
+
+    sync_watch_status.py --userFrom USER1=Tautulli --userTo USER2=Server1 USER3=Server2 --replicate
+       - Keeps running and syncs every new watched item in USER1's Tautulli history to {USER2 or USER3}'s
+       account on selected servers. Use instead of the Tautulli notification agent.
+       Items watched close together are synced in one batch. The last synced history id is saved, a restart
+       continues from there.
 """
 from __future__ import print_function
 from __future__ import unicode_literals
 from builtins import object
 import argparse
 import os
+import sys
+import time
+import threading
+from collections import OrderedDict
+from itertools import chain, islice
+from concurrent.futures import ThreadPoolExecutor
 from plexapi.myplex import MyPlexAccount
 from plexapi.server import PlexServer
 from plexapi.server import CONFIG
-from requests import Session
-from requests.adapters import HTTPAdapter
 from requests.exceptions import RequestException
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from jbops.tautulli import Tautulli as TautulliClient  # noqa: E402
+from jbops.tautulli import paginate, pooled_session  # noqa: E402
+from jbops.history import HistoryStore, SyncError  # noqa: E402
+
 # Manual
 PLEX_URL = ''
 PLEX_TOKEN = ''
@@ -92,25 +107,25 @@ if not TAUTULLI_APIKEY:
 
 VERIFY_SSL = False
 
-
-class Connection(object):
-    def __init__(self, url=None, apikey=None, verify_ssl=False):
-        self.url = url
-        self.apikey = apikey
-        self.session = Session()
-        self.adapters = HTTPAdapter(max_retries=3,
-                                    pool_connections=1,
-                                    pool_maxsize=1,
-                                    pool_block=True)
-        self.session.mount('http://', self.adapters)
-        self.session.mount('https://', self.adapters)
-
-        # Ignore verifying the SSL certificate
-        if verify_ssl is False:
-            self.session.verify = False
-            # Disable the warning that the request is insecure, we know that...
-            import urllib3
-            urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+# Number of markPlayed requests made at the same time for each user
+SYNC_WORKERS = 10
+# Number of users connected to and synced at the same time
+USER_WORKERS = 10
+# Below this many watched items, look each one up instead of listing the whole target library
+BULK_MIN = 25
+# Items requested per page when finding watched items
+PAGE_LENGTH = 100
+# --replicate: seconds between history checks, seconds without new watched items before
+# syncing a batch and the longest a watched item waits in a batch.
+REPLICATE_INTERVAL = 30
+REPLICATE_DEBOUNCE = 120
+REPLICATE_MAX_DELAY = 15 * 60
+# --replicate: seconds of history requested again on each check, and seconds between checks
+# requesting the history's full SYNC_OVERLAP for plays that ran longer.
+REPLICATE_OVERLAP = 10 * 60
+REPLICATE_FULL_SYNC = 60 * 60
+# Item types listed from each library type
+LIBTYPES = {'show': 'episode', 'artist': 'track'}
 
 
 class Library(object):
@@ -124,6 +139,9 @@ class Metadata(object):
     def __init__(self, data=None):
         d = data or {}
         self.type = d['media_type']
+        self.ratingKey = d.get('rating_key')
+        self.guid = d.get('guid')
+        self.guids = d.get('guids') or []
         self.grandparentTitle = d['grandparent_title']
         self.parentIndex = d['parent_media_index']
         self.index = d['media_index']
@@ -147,61 +165,22 @@ class Metadata(object):
             pass
 
 
-class Tautulli(object):
-    def __init__(self, connection):
-        self.connection = connection
-
-    def _call_api(self, cmd, payload, method='GET'):
-        payload['cmd'] = cmd
-        payload['apikey'] = self.connection.apikey
-
-        try:
-            response = self.connection.session.request(method, self.connection.url + '/api/v2', params=payload)
-        except RequestException as e:
-            print("Tautulli request failed for cmd '{}'. Invalid Tautulli URL? Error: {}".format(cmd, e))
-            return
-
-        try:
-            response_json = response.json()
-        except ValueError:
-            print("Failed to parse json response for Tautulli API cmd '{}'".format(cmd))
-            return
-
-        if response_json['response']['result'] == 'success':
-            return response_json['response']['data']
-        else:
-            error_msg = response_json['response']['message']
-            print("Tautulli API cmd '{}' failed: {}".format(cmd, error_msg))
-            return
-
+class Tautulli(TautulliClient):
     def get_watched_history(self, user=None, section_id=None, rating_key=None, start=None, length=None):
         """Call Tautulli's get_history api endpoint."""
-        payload = {"order_column": "full_title",
-                   "order_dir": "asc"}
-        if user:
-            payload["user"] = user
-        if section_id:
-            payload["section_id"] = section_id
-        if rating_key:
-            payload["rating_key"] = rating_key
-        if start:
-            payload["start"] = start
-        if length:
-            payload["lengh"] = length
-
-        history = self._call_api('get_history', payload)
+        history = self.get_history(user=user, section_id=section_id, rating_key=rating_key,
+                                   start=start, length=length, order_column='full_title', order_dir='asc')
 
         return [d for d in history['data'] if d['watched_status'] == 1]
 
-    def get_metadata(self, rating_key):
-        """Call Tautulli's get_metadata api endpoint."""
-        payload = {"rating_key": rating_key}
-        return self._call_api('get_metadata', payload)
-
-    def get_libraries(self):
-        """Call Tautulli's get_libraries api endpoint."""
-        payload = {}
-        return self._call_api('get_libraries', payload)
+    def iter_watched_history(self, user=None, section_id=None, length=PAGE_LENGTH):
+        """Yield the user's watched items page by page, once per rating key."""
+        seen = set()
+        for d in paginate(self.get_history, length=length, user=user, section_id=section_id,
+                          order_column='full_title', order_dir='asc'):
+            if d['watched_status'] == 1 and d['rating_key'] not in seen:
+                seen.add(d['rating_key'])
+                yield Metadata(d)
 
 
 class Plex(object):
@@ -209,8 +188,15 @@ class Plex(object):
         if token and not url:
             self.account = MyPlexAccount(token=token)
         if token and url:
-            session = Connection().session
+            session = pooled_session(VERIFY_SSL)
             self.server = PlexServer(baseurl=url, token=token, session=session)
+        # Looked up once, reused by every user
+        self._admin_servers = None
+        self._users = None
+        self._connections = {}
+        # One lock per server name, guarded by _lock
+        self._connection_locks = {}
+        self._lock = threading.Lock()
 
     def admin_servers(self):
         """Get all owned servers.
@@ -220,12 +206,14 @@ class Plex(object):
         data: dict
 
         """
-        resources = {}
-        for resource in self.account.resources():
-            if 'server' in [resource.provides] and resource.owned is True:
-                resources[resource.name] = resource
+        if self._admin_servers is None:
+            resources = {}
+            for resource in self.account.resources():
+                if 'server' in [resource.provides] and resource.owned is True:
+                    resources[resource.name] = resource
+            self._admin_servers = resources
 
-        return resources
+        return self._admin_servers
 
     def all_users(self):
         """Get all users.
@@ -235,11 +223,35 @@ class Plex(object):
         data: dict
 
         """
-        users = {self.account.title: self.account}
-        for user in self.account.users():
-            users[user.title] = user
+        if self._users is None:
+            users = {self.account.title: self.account}
+            for user in self.account.users():
+                users[user.title] = user
+            self._users = users
+
+        return self._users
+
+    def connection(self, name):
+        """Connect to an owned server, later calls reuse the connection.
+
+        Parameters
+        ----------
+        name: str
+            Server name
+
+        Returns
+        -------
+        server: class
+
+        """
+        with self._lock:
+            lock = self._connection_locks.setdefault(name, threading.Lock())
+        # Only calls for the same server wait for its connection
+        with lock:
+            if name not in self._connections:
+                self._connections[name] = self.admin_servers()[name].connect()
 
-        return users
+        return self._connections[name]
 
     def all_sections(self):
         """Get all sections from all owned servers.
@@ -249,19 +261,22 @@ class Plex(object):
         data: dict
 
         """
-        data = {}
         servers = self.admin_servers()
         print("Connecting to admin server(s) for access info...")
-        for name, server in servers.items():
-            connect = server.connect()
-            sections = {section.title: section for section in connect.library.sections()}
-            data[name] = sections
+        with ThreadPoolExecutor(max_workers=max(len(servers), 1)) as executor:
+            connections = list(executor.map(self.connection, servers))
 
-        return data
+        return {name: {section.title: section for section in connect.library.sections()}
+                for name, connect in zip(servers, connections)}
 
-    def users_access(self):
+    def users_access(self, sections=True):
         """Get users access across all owned servers.
 
+        Parameters
+        ----------
+        sections: bool
+            Also list the sections each user can access, only needed when syncing libraries.
+
         Returns
         -------
         data: dict
@@ -269,7 +284,7 @@ class Plex(object):
         """
         all_users = self.all_users().values()
         admin_servers = self.admin_servers()
-        all_sections = self.all_sections()
+        all_sections = self.all_sections() if sections else {}
 
         data = {self.account.title: {"account": self.account}}
 
@@ -279,10 +294,12 @@ class Plex(object):
                 for server in user.servers:
                     if admin_servers.get(server.name):
                         access = {}
-                        sections = {section.title: section for section in server.sections()
-                                    if section.shared is True}
+                        if sections:
+                            access['sections'] = {section.title: section for section in server.sections()
+                                                  if section.shared is True}
+                        else:
+                            access['sections'] = {}
                         access['server'] = {server.name: admin_servers.get(server.name)}
-                        access['sections'] = sections
                         servers += [access]
                         data[user.title] = {'account': user,
                                             'access': servers}
@@ -291,9 +308,8 @@ class Plex(object):
                 servers = []
                 for name, server in admin_servers.items():
                     access = {}
-                    sections = all_sections.get(name)
                     access['server'] = {name: server}
-                    access['sections'] = sections
+                    access['sections'] = all_sections.get(name, {})
                     servers += [access]
                     data[user.title] = {'account': user,
                                         'access': servers}
@@ -317,9 +333,10 @@ def connect_to_server(server_obj, user_account):
     user = user_account.title
 
     print('Connecting {} to {}...'.format(user, server_name))
-    server_connection = server_obj.connect()
+    # The admin's connection to the server is made once and shared by every user
+    server_connection = plex_admin.connection(server_name)
     url = server_connection._baseurl
-    if user_account.title == Plex(PLEX_TOKEN).account.title:
+    if user_account.title == plex_admin.account.title:
         token = PLEX_TOKEN
     else:
         token = user_account.get_token(server_connection.machineIdentifier)
@@ -373,9 +390,122 @@ def check_users_access(access, user, server_name, libraries=None):
         exit()
 
 
+def shared_guid(guid):
+    """Whether a guid names the same item on other servers, local guids only mean something on their own."""
+    return bool(guid) and not guid.startswith('local://') and 'agents.none' not in guid
+
+
+def item_keys(item, same_server=False):
+    """Keys matching an item between libraries, best match first.
+
+    Parameters
+    ----------
+    item: class
+        Plex item or Metadata
+    same_server: bool
+        Match on ratingKey as well
+
+    Returns
+    -------
+    keys: list
+        ratingKey, guids then title (movies) or show title and episode numbers.
+
+    """
+    keys = []
+    if same_server:
+        keys.append('ratingKey://{}'.format(item.ratingKey))
+    # Plex lists guids as Guid objects, Tautulli as strings
+    guids = [item.guid] + [getattr(guid, 'id', guid) for guid in item.guids or []]
+    keys += [guid for guid in guids if shared_guid(guid)]
+    if item.type == 'episode':
+        try:
+            keys.append('episode://{}/{}/{}'.format(item.grandparentTitle.lower(), int(item.parentIndex),
+                                                    int(item.index)))
+        except (AttributeError, TypeError, ValueError):
+            pass
+    elif item.title:
+        keys.append('{}://{}'.format(item.type, item.title.lower()))
+
+    return keys
+
+
+def library_index(section, same_server=False):
+    """List a library once and index its items by item_keys.
+
+    Parameters
+    ----------
+    section: class
+        Library section of the user syncing to
+    same_server: bool
+        Index on ratingKey as well
+
+    Returns
+    -------
+    index: dict
+        {key: Plex item}
+
+    """
+    index = {}
+    for item in section.search(libtype=LIBTYPES.get(section.type, section.type), includeGuids=True):
+        # The listing has the watched state and guids, don't reload the item when one is empty
+        item._autoReload = False
+        for key in item_keys(item, same_server):
+            index.setdefault(key, item)
+
+    return index
+
+
+def find_item(sectionTo, item, same_server=False):
+    """Look up a single watched item in the library syncing to.
+
+    Parameters
+    ----------
+    sectionTo: class
+        Library section of the user syncing to
+    item: class
+        Plex item or Metadata
+    same_server: bool
+        Are serverFrom and serverTo the same
+
+    Returns
+    -------
+    fetch_check: class
+        The matching Plex item, None if not found.
+
+    """
+    if not same_server and shared_guid(item.guid):
+        # Titles and episode numbers can match the wrong item, try the guid first
+        try:
+            found = sectionTo.search(libtype=item.type, guid=item.guid)
+            if found:
+                return sectionTo.fetchItem(found[0].key)
+        except Exception:
+            pass
+
+    try:
+        if same_server:
+            return sectionTo.fetchItem(item.ratingKey)
+        if item.type == 'episode':
+            show_name = item.grandparentTitle
+            show = sectionTo.get(show_name)
+            watch_check = show.episode(season=int(item.parentIndex), episode=int(item.index))
+        else:
+            title = item.title
+            watch_check = sectionTo.get(title)
+        # .get retrieves a partial object
+        # .fetchItem retrieves a full object
+        return sectionTo.fetchItem(watch_check.key)
+
+    except Exception as e:
+        print(e)
+
+
 def sync_watch_status(watched, section, accountTo, userTo, same_server=False):
     """Sync watched status between two users.
 
+    Larger syncs list the library syncing to once and match the watched items
+    in memory, only items the user hasn't played are marked.
+
     Parameters
     ----------
     watched: list
@@ -392,55 +522,202 @@ def sync_watch_status(watched, section, accountTo, userTo, same_server=False):
     """
     print('Marking watched...')
     sectionTo = accountTo.library.section(section)
-    for item in watched:
-        try:
-            if same_server:
-                fetch_check = sectionTo.fetchItem(item.ratingKey)
-            else:
-                if item.type == 'episode':
-                    show_name = item.grandparentTitle
-                    show = sectionTo.get(show_name)
-                    watch_check = show.episode(season=int(item.parentIndex), episode=int(item.index))
-                else:
-                    title = item.title
-                    watch_check = sectionTo.get(title)
-                # .get retrieves a partial object
-                # .fetchItem retrieves a full object
-                fetch_check = sectionTo.fetchItem(watch_check.key)
-            # If item is already watched ignore
-            if not fetch_check.isPlayed:
-                # todo-me should watched count be synced?
-                fetch_check.markPlayed()
-                title = fetch_check._prettyfilename()
-                print("Synced watched status of {} to account {}...".format(title, userTo))
+    # watched can be a generator, sync starts while its later pages are loading
+    watched = iter(watched)
+    first = list(islice(watched, BULK_MIN))
+    if len(first) < BULK_MIN:
+        targets = (find_item(sectionTo, item, same_server) for item in first)
+    else:
+        index = library_index(sectionTo, same_server)
+        targets = (next((index[key] for key in item_keys(item, same_server) if key in index), None)
+                   for item in chain(first, watched))
 
+    def mark_played(item):
+        try:
+            # todo-me should watched count be synced?
+            item.markPlayed()
+            title = item._prettyfilename()
+            print("Synced watched status of {} to account {}...".format(title, userTo))
         except Exception as e:
             print(e)
-            pass
 
+    marked = set()
+    not_found = 0
+    with ThreadPoolExecutor(max_workers=SYNC_WORKERS) as executor:
+        for target in targets:
+            if target is None:
+                not_found += 1
+            # If item is already watched ignore
+            elif not target.isPlayed and target.ratingKey not in marked:
+                marked.add(target.ratingKey)
+                executor.submit(mark_played, target)
+    if not_found and len(first) >= BULK_MIN:
+        print("{} watched item(s) not found in {}'s library: '{}'.".format(not_found, userTo, section))
+
+
+def batching_watched(section, libtype, count=PAGE_LENGTH):
+    """Yield the watched items of a library page by page, once per rating key.
 
-def batching_watched(section, libtype):
-    count = 100
+    Parameters
+    ----------
+    section: class
+        Library section of the user syncing from
+    libtype: str
+        Library type, 'movie' or 'show'
+    count: int
+        Items requested per page
+
+    """
+    seen = set()
     start = 0
-    watched_lst = []
     while True:
-    
         if libtype == 'show':
             search_watched = section.search(libtype='episode', container_start=start, container_size=count,
-                                         **{'show.unwatchedLeaves': False})
+                                            maxresults=count, **{'show.unwatchedLeaves': False})
         else:
-            search_watched = section.search(unwatched=False, container_start=start, container_size=count)
-        if all([search_watched]):
-            start += count
-            for item in search_watched:
-                if item not in watched_lst:
-                    watched_lst.append(item)
-            continue
-        elif not all([search_watched]):
+            search_watched = section.search(unwatched=False, container_start=start, container_size=count,
+                                            maxresults=count)
+        for item in search_watched:
+            if item.ratingKey not in seen:
+                seen.add(item.ratingKey)
+                # Matched on the listed guids, don't reload the item when they are empty
+                item._autoReload = False
+                yield item
+        if len(search_watched) < count:
             break
         start += count
-        
-    return watched_lst
+
+
+def connect_users(access, users_to, libraries=None):
+    """Check every user's access and connect them at the same time.
+
+    Parameters
+    ----------
+    access: dict
+    users_to: list
+        [[user, server_name], ..]
+    libraries: list
+
+    Returns
+    -------
+    plexTo: list
+        [[user, server_connection], ..] for the users that could connect
+
+    """
+    with ThreadPoolExecutor(max_workers=USER_WORKERS) as executor:
+        connections = list(executor.map(lambda user: check_users_access(access, user[0], user[1], libraries),
+                                        users_to))
+
+    plexTo = []
+    for (user, server_name), server_connection in zip(users_to, connections):
+        if server_connection is None:
+            print("Skipping {}, could not connect to {}.".format(user, server_name))
+        else:
+            plexTo.append([user, server_connection])
+
+    return plexTo
+
+
+def sync_users(watched, plexTo, section=None, serverFrom=None):
+    """Sync watched items to every user at the same time.
+
+    Parameters
+    ----------
+    watched: list
+        List of watched items either from Tautulli or Plex
+    plexTo: list
+        [[user, server_connection], ..]
+    section: str
+        Section title, defaults to the first watched item's library on each user's server
+    serverFrom: str
+        Server name of sync from user
+
+    """
+    def sync_user(user):
+        username, server = user
+        title = section or server.library.sectionByID(watched[0].librarySectionID).title
+        sync_watch_status(watched, title, server, username, server.friendlyName == serverFrom)
+
+    with ThreadPoolExecutor(max_workers=USER_WORKERS) as executor:
+        list(executor.map(sync_user, plexTo))
+
+
+def replicate(tautulli_server, userFrom, plexTo):
+    """Keep syncing new watched items from the user's Tautulli history.
+
+    New plays are read from the local history store (see jbops/history.py)
+    and collected into a batch until none arrive for REPLICATE_DEBOUNCE
+    seconds or the batch is REPLICATE_MAX_DELAY seconds old. The id of the
+    last play synced is saved after each batch. Items already played by a
+    user are skipped, so a batch synced again after a restart changes nothing.
+    Plays are matched on their guid first, plays synced into the history
+    store before it kept guids fall back to titles.
+
+    Each check requests the last REPLICATE_OVERLAP seconds of history again,
+    the whole SYNC_OVERLAP is requested every REPLICATE_FULL_SYNC seconds.
+    A failed check is reported and retried on the next one.
+
+    Parameters
+    ----------
+    tautulli_server: class
+    userFrom: str
+        Tautulli username to sync from
+    plexTo: list
+        [[user, server_connection], ..]
+
+    """
+    history = HistoryStore()
+    checkpoint = 'sync_watch_status:{}'.format(userFrom)
+    history.sync(tautulli_server)
+    last_id = history.checkpoint(checkpoint)
+    if last_id is None:
+        # First run, start from the user's newest play
+        newest = history.query(user=userFrom)
+        last_id = newest[0]['id'] if newest else 0
+        history.set_checkpoint(checkpoint, last_id)
+    print("Replicating {}'s watched items from history id {}...".format(userFrom, last_id))
+
+    sections = {}
+    pending = OrderedDict()
+    first_added = last_added = 0
+    last_full_sync = time.time()
+    while True:
+        full_sync = time.time() - last_full_sync >= REPLICATE_FULL_SYNC
+        try:
+            if full_sync:
+                history.sync(tautulli_server)
+                last_full_sync = time.time()
+            else:
+                history.sync(tautulli_server, overlap=REPLICATE_OVERLAP)
+        except (SyncError, RequestException) as e:
+            sys.stderr.write("History sync failed, retrying in {} seconds: {}\n".format(REPLICATE_INTERVAL, e))
+        # Oldest first, a rating key watched again moves to the end of the batch
+        for row in reversed(history.query(user=userFrom, watched=True, after_id=last_id)):
+            pending.pop(row['rating_key'], None)
+            pending[row['rating_key']] = row
+            last_id = max(last_id, row['id'])
+            last_added = time.time()
+            first_added = first_added or last_added
+
+        now = time.time()
+        if pending and (now - last_added >= REPLICATE_DEBOUNCE or now - first_added >= REPLICATE_MAX_DELAY):
+            by_library = OrderedDict()
+            for row in pending.values():
+                if row['section_id'] not in sections:
+                    sections.update({int(library['section_id']): library['section_name']
+                                     for library in tautulli_server.get_libraries() or []})
+                by_library.setdefault(sections.get(row['section_id']), []).append(Metadata(row))
+            for library, watched in by_library.items():
+                if library is None:
+                    print("Skipping {} item(s) from a library Tautulli no longer lists.".format(len(watched)))
+                    continue
+                print("Syncing {} watched item(s) from library: '{}'...".format(len(watched), library))
+                sync_users(watched, plexTo, library)
+            history.set_checkpoint(checkpoint, last_id)
+            pending.clear()
+            first_added = last_added = 0
+
+        time.sleep(REPLICATE_INTERVAL)
 
 
 if __name__ == '__main__':
@@ -457,6 +734,8 @@ if __name__ == '__main__':
     requiredNamed.add_argument('--userTo', nargs='*', metavar='user=server', required=True,
                                type=lambda kv: kv.split("="),
                                help='Select user and server to sync to.')
+    parser.add_argument('--replicate', action='store_true',
+                        help='Keep running and sync new watched items from the Tautulli user (user=Tautulli).')
 
     opts = parser.parse_args()
     # print(opts)
@@ -465,19 +744,14 @@ if __name__ == '__main__':
     libraries = []
     all_sections = {}
     watchedFrom = ''
-    same_server = False
-    count = 25
-    start = 0
     plex_admin = Plex(PLEX_TOKEN)
-    plex_access = plex_admin.users_access()
+    plex_access = plex_admin.users_access(sections=bool(opts.libraries))
 
     userFrom, serverFrom = opts.userFrom
 
     if serverFrom == "Tautulli":
         # Create a Tautulli instance
-        tautulli_server = Tautulli(Connection(url=TAUTULLI_URL.rstrip('/'),
-                                              apikey=TAUTULLI_APIKEY,
-                                              verify_ssl=VERIFY_SSL))
+        tautulli_server = Tautulli(TAUTULLI_URL, TAUTULLI_APIKEY, VERIFY_SSL)
 
     if serverFrom == "Tautulli" and opts.libraries:
         # Pull all libraries from Tautulli
@@ -508,42 +782,33 @@ if __name__ == '__main__':
         print("Checking {}'s access to {}".format(userFrom, serverFrom))
         watchedFrom = check_users_access(plex_access, userFrom, serverFrom, libraries)
 
-    if libraries:
-        print("Finding watched items in libraries...")
-        plexTo = []
+    if opts.replicate:
+        if serverFrom != "Tautulli" or userFrom == "Tautulli":
+            print("Replication reads a user's Tautulli history, use --userFrom USER=Tautulli.")
+            exit()
+        plexTo = connect_users(plex_access, opts.userTo)
+        replicate(tautulli_server, userFrom, plexTo)
 
-        for user, server_name in opts.userTo:
-            plexTo.append([user, check_users_access(plex_access, user, server_name, libraries)])
+    elif libraries:
+        print("Finding watched items in libraries...")
+        plexTo = connect_users(plex_access, opts.userTo, libraries)
 
         for _library in libraries:
-            watched_lst = []
             print("Checking {}'s library: '{}' watch statuses...".format(userFrom, _library.title))
             if tautulli_server:
-                while True:
-                    # Getting all watched history for userFrom
-                    tt_watched = tautulli_server.get_watched_history(user=userFrom, section_id=_library.key,
-                                                                     start=start, length=count)
-                    if all([tt_watched]):
-                        start += count
-                        for item in tt_watched:
-                            watched_lst.append(Metadata(item))
-                        continue
-                    elif not all([tt_watched]):
-                        break
-                    start += count
+                # Getting all watched history for userFrom
+                watched_lst = tautulli_server.iter_watched_history(user=userFrom, section_id=_library.key)
             else:
                 # Check library for watched items
                 sectionFrom = watchedFrom.library.section(_library.title)
                 watched_lst = batching_watched(sectionFrom, _library.type)
+            if len(plexTo) > 1:
+                # Every user syncs the same items
+                watched_lst = list(watched_lst)
 
-            for user in plexTo:
-                username, server = user
-                if server.friendlyName == serverFrom:
-                    same_server = True
-                sync_watch_status(watched_lst, _library.title, server, username, same_server)
+            sync_users(watched_lst, plexTo, _library.title, serverFrom)
 
     elif opts.ratingKey and serverFrom == "Tautulli":
-        plexTo = []
         watched_item = []
 
         if userFrom != "Tautulli":
@@ -559,16 +824,11 @@ if __name__ == '__main__':
             print("Request from Tautulli notification agent to update watch status")
             watched_item = Metadata(tautulli_server.get_metadata(opts.ratingKey))
 
-        for user, server_name in opts.userTo:
-            # Check access and connect
-            plexTo.append([user, check_users_access(plex_access, user, server_name, libraries)])
-
-        for user in plexTo:
-            username, server = user
-            sync_watch_status([watched_item], watched_item.libraryName, server, username)
+        # Check access and connect
+        plexTo = connect_users(plex_access, opts.userTo, libraries)
+        sync_users([watched_item], plexTo, watched_item.libraryName)
 
     elif opts.ratingKey and serverFrom != "Tautulli":
-        plexTo = []
         watched_item = []
     
         if userFrom != "Tautulli":
@@ -583,14 +843,9 @@ if __name__ == '__main__':
             print("Use an actual user.")
             exit()
     
-        for user, server_name in opts.userTo:
-            # Check access and connect
-            plexTo.append([user, check_users_access(plex_access, user, server_name, libraries)])
-    
-        for user in plexTo:
-            username, server = user
-            library = server.library.sectionByID(watched_item.librarySectionID)
-            sync_watch_status([watched_item], library.title, server, username)
+        # Check access and connect
+        plexTo = connect_users(plex_access, opts.userTo, libraries)
+        sync_users([watched_item], plexTo)
 
     else:
         print("You aren't using this script correctly... bye!")